@@ -0,0 +1,168 @@
+import argparse
+import hashlib
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from batch_queue import LEASE_SIZE, LEASE_TTL_SEC, LeaseQueue, QueueServer, RemoteQueue, run_worker
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TASK1_ROOT = os.path.abspath(os.path.join(BASE_DIR, ".."))
+IMAGE_FOLDER = os.path.join(TASK1_ROOT, "images")
+
+# queue state stays outside the source tree unless --db/--dlq (or the env vars) say otherwise
+DB_PATH = os.environ.get("BATCH_QUEUE_DB") or os.path.join(tempfile.gettempdir(), "batch_queue.db")
+DLQ_PATH = os.environ.get("BATCH_QUEUE_DLQ") or os.path.join(tempfile.gettempdir(), "dlq.jsonl")
+PORT = 7070
+
+def load_paths(images: str, manifest: str) -> list:
+    if manifest:
+        with open(manifest) as f:
+            return [line.strip() for line in f if line.strip()]
+    return sorted(
+        os.path.join(images, f) for f in os.listdir(images)
+        if f.lower().endswith((".jpg", ".jpeg", ".png"))
+    )
+
+def ocr_process_fn():
+    # real Phase-3 routing; imported here so fake-OCR workers don't need tesseract
+    from hybrid_router import route_image
+
+    def process(path: str) -> dict:
+        r = route_image(path)
+        return {
+            "path": path,
+            "decision": r.decision,
+            "detail": f"raw={r.raw_conf:.2f} retry={r.retry_conf} ai={r.ai_conf}",
+            "dlq": r.scrap,
+        }
+    return process
+
+def fake_process_fn(seconds: float):
+    # stand-in OCR for load tests: fixed cost, ~2% of images "unusable"
+    def process(path: str) -> dict:
+        time.sleep(seconds)
+        bad = int(hashlib.sha256(path.encode("utf-8")).hexdigest()[:4], 16) % 50 == 0
+        return {"path": path, "decision": "SCRAP_IMAGE" if bad else "ACCEPT_RAW", "detail": "fake", "dlq": bad}
+    return process
+
+def wait_drained(queue: LeaseQueue, total: int, every: float = 2.0) -> float:
+    t0 = time.time()
+    last = 0.0
+    while not queue.drained():
+        time.sleep(0.05)
+        if time.time() - last >= every:
+            last = time.time()
+            s = queue.stats()
+            print(f"  {s['images_done']:>8,}/{total:,} images | leases {s['leases']}")
+    return time.time() - t0
+
+def cmd_coordinator(args):
+    queue = LeaseQueue(args.db, args.dlq)
+    if queue.stats()["leases"]:
+        print(f"Resuming existing queue {args.db}")
+        total = queue.stats()["images_total"]
+    else:
+        paths = load_paths(args.images, args.manifest)
+        n = queue.load_manifest(paths, args.lease_size)
+        total = len(paths)
+        print(f"Loaded {total:,} images into {n:,} leases of {args.lease_size}")
+
+    server = QueueServer(queue, args.host, args.port)
+    server.serve_in_background()
+    print(f"Coordinator listening on {args.host}:{args.port} (DLQ -> {args.dlq})")
+
+    elapsed = wait_drained(queue, total)
+    server.shutdown()
+    s = queue.stats()
+    print(f"\nDrained in {elapsed:.2f}s | {s['images_done'] / max(elapsed, 1e-9):.2f} images/sec | {s}")
+
+def cmd_worker(args):
+    host, port = args.connect.rsplit(":", 1)
+    queue = RemoteQueue(host, int(port))
+    worker = args.id or f"{socket.gethostname()}-{os.getpid()}"
+    fn = fake_process_fn(args.fake_ocr) if args.fake_ocr else ocr_process_fn()
+    done = run_worker(queue, worker, fn, ttl=args.ttl, idle_exit_sec=args.idle_exit)
+    queue.close()
+    print(f"worker {worker}: {done} images")
+
+def spawn_workers(n: int, port: int, fake_ocr: float) -> list:
+    procs = []
+    for i in range(n):
+        cmd = [sys.executable, os.path.abspath(__file__), "worker", "--connect", f"127.0.0.1:{port}",
+               "--id", f"local-{i}", "--idle-exit", "1"]
+        if fake_ocr:
+            cmd += ["--fake-ocr", str(fake_ocr)]
+        procs.append(subprocess.Popen(cmd, stdout=subprocess.DEVNULL))
+    return procs
+
+def cmd_bench(args):
+    counts = [int(x) for x in args.workers.split(",")]
+    if args.fake_ocr:
+        paths = [f"synthetic/img-{i:06d}.png" for i in range(args.images)]
+    else:
+        paths = load_paths(args.images_dir, None)
+
+    print(f"\nBatch OCR scaling: {len(paths):,} images, lease size {args.lease_size}, "
+          f"{'fake OCR ' + str(args.fake_ocr) + 's/image' if args.fake_ocr else 'real OCR'}\n")
+    print(f"{'Workers':>8} {'Seconds':>9} {'Images/sec':>11} {'Speedup':>8} {'DLQ':>6}")
+    print("-" * 46)
+
+    base = None
+    for n in counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            dlq = os.path.join(tmp, "dlq.jsonl")
+            queue = LeaseQueue(os.path.join(tmp, "q.db"), dlq)
+            queue.load_manifest(paths, args.lease_size)
+            server = QueueServer(queue, "127.0.0.1", 0)
+            server.serve_in_background()
+
+            t0 = time.time()
+            procs = spawn_workers(n, server.server_address[1], args.fake_ocr)
+            while not queue.drained():
+                time.sleep(0.02)
+            elapsed = time.time() - t0
+            for p in procs:
+                p.wait()
+            server.shutdown()
+            server.server_close()
+
+            dead = sum(1 for _ in open(dlq)) if os.path.exists(dlq) else 0
+            rate = len(paths) / max(elapsed, 1e-9)
+            base = base or rate
+            print(f"{n:>8} {elapsed:>9.2f} {rate:>11.2f} {rate / base:>7.2f}x {dead:>6}")
+
+def main():
+    ap = argparse.ArgumentParser(description="Phase 2 - distributed batch OCR (coordinator / workers / DLQ)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    c = sub.add_parser("coordinator")
+    c.add_argument("--images", default=IMAGE_FOLDER)
+    c.add_argument("--manifest", help="file with one image path per line")
+    c.add_argument("--db", default=DB_PATH)
+    c.add_argument("--dlq", default=DLQ_PATH)
+    c.add_argument("--host", default="0.0.0.0")
+    c.add_argument("--port", type=int, default=PORT)
+    c.add_argument("--lease-size", type=int, default=LEASE_SIZE)
+
+    w = sub.add_parser("worker")
+    w.add_argument("--connect", default=f"127.0.0.1:{PORT}")
+    w.add_argument("--id")
+    w.add_argument("--ttl", type=float, default=LEASE_TTL_SEC)
+    w.add_argument("--idle-exit", type=float, default=10.0)
+    w.add_argument("--fake-ocr", type=float, default=0.0, help="sleep this long instead of running OCR")
+
+    b = sub.add_parser("bench")
+    b.add_argument("--workers", default="1,2,4,8")
+    b.add_argument("--images", type=int, default=2000)
+    b.add_argument("--images-dir", default=IMAGE_FOLDER)
+    b.add_argument("--lease-size", type=int, default=LEASE_SIZE)
+    b.add_argument("--fake-ocr", type=float, default=0.01)
+
+    args = ap.parse_args()
+    {"coordinator": cmd_coordinator, "worker": cmd_worker, "bench": cmd_bench}[args.cmd](args)
+
+if __name__ == "__main__":
+    main()
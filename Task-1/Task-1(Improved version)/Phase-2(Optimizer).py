@@ -0,0 +1,264 @@
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from PIL import Image
+from hybrid_router import IMAGE_FOLDER, ACCEPT_CONF, list_images, confidence_score, preprocess_cv
+from lane_scheduler import percentile, p95_response
+
+# from Phase-1
+SECONDS_PER_IMAGE = 0.6638
+OVERHEAD = 1.25
+
+# COSTS (rough)
+CPU_COST_PER_VCPU_HOUR = 0.04
+API_COST_PER_IMAGE = 0.01
+API_LATENCY_P95_SEC = 2.5
+P95_TAIL = 0.05           # share of images above the p95
+SECONDS_PER_DAY = 86400
+
+# search space
+WORKER_SHAPES = [4, 8, 16, 32, 64]                       # vCPU per worker
+ESCALATE_THRESHOLDS = [t / 1.0 for t in range(30, 86, 5)]  # ESCALATE_CONF candidates
+MAX_FLEET_GROWTH = 4      # search up to min_fleet * this when chasing p95
+HEADROOM_STEPS = [1.1, 1.25, 1.5, 2.0]   # extra fleet sizes kept for the frontier
+
+# images below ACCEPT that are not escalated get one more (heavier) local pass
+HEAVY_PASS_FACTOR = 1.5
+
+# targets
+TARGET_IMAGES_PER_DAY = 100000 * 60 * 24
+TARGET_P95_SEC = 5.0
+
+# measured profile stays outside the source tree unless FLEET_PROFILE_PATH says otherwise
+PROFILE_PATH = os.environ.get("FLEET_PROFILE_PATH") or os.path.join(tempfile.gettempdir(), "fleet_profile.json")
+
+# used only when no measured profile exists (32 vCPU @ 0.85 matches Phase-2)
+DEFAULT_EFFICIENCY = {1: 1.0, 4: 0.95, 8: 0.93, 16: 0.90, 32: 0.85, 64: 0.78}
+
+# measurement (needs tesseract + images)
+
+def _ocr_one(path: str):
+    t0 = time.time()
+    raw = confidence_score(Image.open(path))
+    retry = None
+    if raw < ACCEPT_CONF:
+        processed = preprocess_cv(path)
+        if processed is not None:
+            retry = confidence_score(processed)
+    return raw, retry, time.time() - t0
+
+def measure_latency_curve(paths, shapes):
+    # concurrency == vCPUs of one worker; shapes above this host's CPU count are extrapolated later
+    curve = {}
+    for v in shapes:
+        if v > (os.cpu_count() or 1):
+            continue
+        batch = (paths * math.ceil(2 * v / max(len(paths), 1)))[:max(2 * v, len(paths))]
+        t0 = time.time()
+        with ProcessPoolExecutor(max_workers=v) as pool:
+            lat = [r[2] for r in pool.map(_ocr_one, batch)]
+        wall = time.time() - t0
+        curve[v] = {
+            "images_per_sec_per_vcpu": len(batch) / max(wall, 1e-9) / v,
+            "p95_sec": percentile(lat, 0.95),
+        }
+        print(f"  {v:>3} vCPU: {curve[v]['images_per_sec_per_vcpu']:.3f} img/s/vCPU | p95 {curve[v]['p95_sec']:.3f}s")
+    return curve
+
+def measure(path: str = PROFILE_PATH):
+    image_list = list_images(IMAGE_FOLDER)
+    paths = [os.path.join(IMAGE_FOLDER, f) for f in image_list]
+    print(f"\nMeasuring {len(paths)} images")
+
+    confs = []
+    for p in paths:
+        raw, retry, _ = _ocr_one(p)
+        confs.append([raw, retry])
+
+    print("Latency curve:")
+    curve = measure_latency_curve(paths, [1] + WORKER_SHAPES)
+
+    with open(path, "w") as f:
+        json.dump({"confidences": confs, "latency_curve": curve}, f, indent=2)
+    print(f"Saved profile -> {path}")
+
+# model
+
+@dataclass
+class Profile:
+    confidences: list          # [[raw, retry_or_None], ...]
+    latency_curve: dict        # vcpu -> {"images_per_sec_per_vcpu", "p95_sec"}
+    measured: bool
+
+def default_profile(n: int = 500, seed: int = 11) -> Profile:
+    rnd = random.Random(seed)
+    confs = []
+    for _ in range(n):
+        raw = min(96.0, max(0.0, rnd.gauss(78, 15)))
+        retry = None if raw >= ACCEPT_CONF else min(96.0, max(0.0, raw + rnd.gauss(4, 8)))
+        confs.append([raw, retry])
+    base = 1.0 / (SECONDS_PER_IMAGE * OVERHEAD)
+    curve = {
+        v: {"images_per_sec_per_vcpu": base * eff, "p95_sec": SECONDS_PER_IMAGE * OVERHEAD * (2 - eff)}
+        for v, eff in DEFAULT_EFFICIENCY.items()
+    }
+    return Profile(confs, curve, measured=False)
+
+def load_profile(path: str = PROFILE_PATH) -> Profile:
+    if not os.path.exists(path):
+        return default_profile()
+    with open(path) as f:
+        data = json.load(f)
+    curve = {int(k): v for k, v in data["latency_curve"].items()}
+    return Profile(data["confidences"], curve, measured=True)
+
+def shape_point(profile: Profile, vcpus: int):
+    # nearest measured shape at or below; degrade efficiency past the measured range
+    known = sorted(profile.latency_curve)
+    below = [v for v in known if v <= vcpus] or known[:1]
+    pt = profile.latency_curve[below[-1]]
+    if below[-1] == vcpus:
+        return pt["images_per_sec_per_vcpu"], pt["p95_sec"], False
+    drop = DEFAULT_EFFICIENCY.get(vcpus, 0.75) / DEFAULT_EFFICIENCY.get(below[-1], 1.0)
+    return pt["images_per_sec_per_vcpu"] * drop, pt["p95_sec"] / drop, True
+
+def routing_mix(profile: Profile, escalate_conf: float):
+    # -> (escalation rate, mean local OCR passes per image, p95 passes per image)
+    n = max(len(profile.confidences), 1)
+    escalated = 0
+    passes = []
+    for raw, retry in profile.confidences:
+        p = 1.0
+        best = raw
+        if raw < ACCEPT_CONF:
+            p += 1
+            best = max(raw, retry if retry is not None else -1)
+        if best < ACCEPT_CONF:
+            if best < escalate_conf:
+                escalated += 1
+            else:
+                p += HEAVY_PASS_FACTOR
+        passes.append(p)
+    return escalated / n, sum(passes) / n, percentile(passes, 0.95)
+
+def api_p95_share(escalation_rate: float) -> float:
+    # escalated images own the whole p95 tail once they are >= 5% of traffic; below that
+    # ramp the API latency in linearly (conservative) instead of stepping it in at 5%
+    return API_LATENCY_P95_SEC * min(1.0, escalation_rate / P95_TAIL)
+
+@dataclass
+class Config:
+    vcpu_per_worker: int
+    workers: int
+    escalate_conf: float
+    escalation_rate: float
+    cost_per_day: float
+    p95_sec: float
+    utilization: float
+    extrapolated: bool
+
+def evaluate(profile: Profile, images_per_day: float, p95_target: float):
+    configs = []
+    arrival = images_per_day / SECONDS_PER_DAY
+    for t in ESCALATE_THRESHOLDS:
+        esc, passes, passes_p95 = routing_mix(profile, t)
+        local_rate = arrival * passes                     # OCR passes/sec
+        api_cost = images_per_day * esc * API_COST_PER_IMAGE
+        for v in WORKER_SHAPES:
+            per_vcpu, svc_p95, extrap = shape_point(profile, v)
+            mean_pass = 1.0 / max(per_vcpu, 1e-9)
+
+            def p95_for(w: int) -> float:
+                # queueing is per OCR pass; a p95 image runs its passes back to back
+                p95 = p95_response(w * v, local_rate, mean_pass, svc_p95 * passes_p95)
+                return p95 + api_p95_share(esc)
+
+            min_workers = max(1, math.ceil(local_rate / (per_vcpu * v)))
+            fleet = {min_workers}
+
+            # p95 only falls as the fleet grows -> binary search the smallest fleet meeting target
+            lo, hi = min_workers, min_workers * MAX_FLEET_GROWTH
+            if p95_for(hi) <= p95_target:
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    if p95_for(mid) <= p95_target:
+                        hi = mid
+                    else:
+                        lo = mid + 1
+                fleet.add(lo)
+            fleet.update(math.ceil(min_workers * h) for h in HEADROOM_STEPS)
+
+            for w in sorted(fleet):
+                cost = w * v * CPU_COST_PER_VCPU_HOUR * 24 + api_cost
+                rho = local_rate * mean_pass / (w * v)
+                configs.append(Config(v, w, t, esc, cost, p95_for(w), rho, extrap))
+    return configs
+
+def feasible(configs, p95_target: float):
+    # a saturated fleet (rho >= 1) or one past the SLO is never a real option
+    return [c for c in configs if c.utilization < 1.0 and c.p95_sec <= p95_target]
+
+def pareto(configs):
+    # non-dominated on (cost, p95, escalation rate)
+    keys = sorted(configs, key=lambda c: (c.cost_per_day, c.p95_sec, c.escalation_rate))
+    front = []
+    for c in keys:
+        dominated = any(
+            f.cost_per_day <= c.cost_per_day and f.p95_sec <= c.p95_sec and f.escalation_rate <= c.escalation_rate
+            for f in front
+        )
+        if not dominated:
+            front.append(c)
+    return front
+
+def cheapest(configs, p95_target: float):
+    ok = feasible(configs, p95_target)
+    return min(ok, key=lambda c: (c.cost_per_day, c.p95_sec)) if ok else None
+
+def fmt(c: Config) -> str:
+    x = "*" if c.extrapolated else " "
+    return (f"{c.vcpu_per_worker:>5}{x} {c.workers:>8,} {c.escalate_conf:>8.0f} {c.escalation_rate*100:>8.2f}% "
+            f"{c.p95_sec:>8.3f} ${c.cost_per_day:>14,.2f}")
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "measure":
+        measure()
+        return
+
+    images_per_day = float(sys.argv[1]) if len(sys.argv) > 1 else TARGET_IMAGES_PER_DAY
+    p95_target = float(sys.argv[2]) if len(sys.argv) > 2 else TARGET_P95_SEC
+
+    profile = load_profile()
+    print("\nPHASE 2 - Fleet cost optimizer (worker shape x fleet size x escalation threshold)\n")
+    print(f"Profile: {'measured ' + PROFILE_PATH if profile.measured else 'synthetic (run with: measure)'}")
+    print(f"  images in confidence sample = {len(profile.confidences)}")
+    print(f"Target: {images_per_day:,.0f} images/day | p95 <= {p95_target}s\n")
+
+    configs = evaluate(profile, images_per_day, p95_target)
+    ok = feasible(configs, p95_target)
+    best = cheapest(configs, p95_target)
+
+    header = f"{'vCPU':>6} {'Workers':>8} {'EscConf':>8} {'EscRate':>9} {'p95(s)':>8} {'Total $/day':>15}"
+    print(f"Pareto frontier (cost vs p95 vs escalation rate) over {len(ok):,} of {len(configs):,} configs"
+          f" (dropped: rho >= 1 or p95 > {p95_target}s):")
+    print(header)
+    print("-" * len(header))
+    for c in pareto(ok):
+        print(fmt(c))
+    print("(* = worker shape beyond measured range, extrapolated)")
+
+    print("\nCheapest configuration meeting target:")
+    if best is None:
+        print("  none - relax p95 or widen the search space")
+    else:
+        print(header)
+        print(fmt(best))
+
+if __name__ == "__main__":
+    main()
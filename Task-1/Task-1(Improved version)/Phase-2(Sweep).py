@@ -0,0 +1,155 @@
+import math
+import time
+import numpy as np
+
+# Phase-1 Timing summary
+SECONDS_PER_IMAGE = 0.6638
+OVERHEAD = 1.25
+
+# Costs(Rough Assumptions)
+CPU_COST_PER_VCPU_HOUR = 0.04
+API_COST_PER_IMAGE = 0.01
+SECONDS_PER_DAY = 86400
+
+VOLUMES = [
+    ("1/day", 1),
+    ("1/min", 1 * 60 * 24),
+    ("1,000/min", 1000 * 60 * 24),
+    ("100,000/min", 100000 * 60 * 24),
+]
+
+# flags() thresholds from Phase-2/Phase-3
+WORKER_WARN, WORKER_BREAK = 50, 500
+API_WARN, API_BREAK = 1000, 100000
+
+# sweep grid
+SWEEP_VOLUMES = np.unique(np.round(np.logspace(0, 10, 400)).astype(np.int64))   # images/day
+SWEEP_OVERHEAD = np.linspace(1.0, 2.0, 21)
+SWEEP_CPU_PRICE = np.linspace(0.01, 0.10, 19)       # $ per vCPU hour
+SWEEP_ESCALATION = np.linspace(0.005, 0.30, 60)     # escalated fraction
+CHUNK = 4_000_000                                   # grid cells per NumPy pass
+
+# scalar helpers (Phase-3) - kept for the cross-check
+
+def workers_needed(images_per_day: int) -> int:
+    sec = images_per_day * SECONDS_PER_IMAGE * OVERHEAD
+    return max(1, math.ceil(sec / SECONDS_PER_DAY))
+
+def library_cost_per_day(workers: int) -> float:
+    return workers * CPU_COST_PER_VCPU_HOUR * 24
+
+def api_cost_per_day(images_per_day: int, escalation_rate: float) -> float:
+    return images_per_day * escalation_rate * API_COST_PER_IMAGE
+
+# vectorized versions: every argument broadcasts
+
+def workers_needed_v(images_per_day, overhead=OVERHEAD, seconds_per_image=SECONDS_PER_IMAGE):
+    sec = np.asarray(images_per_day, dtype=np.float64) * seconds_per_image * overhead
+    return np.maximum(1, np.ceil(sec / SECONDS_PER_DAY)).astype(np.int64)
+
+def library_cost_per_day_v(workers, cpu_price=CPU_COST_PER_VCPU_HOUR):
+    return np.asarray(workers, dtype=np.float64) * cpu_price * 24
+
+def api_cost_per_day_v(images_per_day, escalation_rate=1.0, api_price=API_COST_PER_IMAGE):
+    return np.asarray(images_per_day, dtype=np.float64) * escalation_rate * api_price
+
+def flags_v(workers, api_cost):
+    # 0 = OK, 1 = WARN, 2 = BREAK, separately for fleet size and API spend
+    w = np.asarray(workers)
+    a = np.asarray(api_cost)
+    fleet = np.where(w >= WORKER_BREAK, 2, np.where(w >= WORKER_WARN, 1, 0)).astype(np.int8)
+    api = np.where(a >= API_BREAK, 2, np.where(a >= API_WARN, 1, 0)).astype(np.int8)
+    return fleet, api
+
+# inverse: smallest volume that trips a threshold (closed form, no volume grid needed)
+
+def volume_for_workers_v(workers, overhead=OVERHEAD, seconds_per_image=SECONDS_PER_IMAGE):
+    # ceil(V * k) >= W  <=>  V > (W - 1) / k
+    k = seconds_per_image * np.asarray(overhead, dtype=np.float64) / SECONDS_PER_DAY
+    return (np.floor((workers - 1) / k) + 1).astype(np.int64)
+
+def volume_for_api_cost_v(api_cost, escalation_rate=1.0, api_price=API_COST_PER_IMAGE):
+    return np.ceil(api_cost / (np.asarray(escalation_rate, dtype=np.float64) * api_price)).astype(np.int64)
+
+# break-even: first swept volume where API spend >= library spend
+
+def break_even_volumes(volumes, overhead, cpu_price, escalation):
+    """
+    -> int64 array shaped (len(overhead), len(cpu_price), len(escalation)); -1 = API never costs more.
+    Evaluated in chunks along escalation so the 4-D grid never has to fit in memory.
+    """
+    v = np.asarray(volumes, dtype=np.float64)[:, None, None, None]
+    o = np.asarray(overhead)[None, :, None, None]
+    p = np.asarray(cpu_price)[None, None, :, None]
+    esc = np.asarray(escalation)
+
+    lib = library_cost_per_day_v(workers_needed_v(v, o), p)          # (V, O, P, 1)
+    out = np.empty((len(overhead), len(cpu_price), len(esc)), dtype=np.int64)
+    per_e = lib.size
+    step = max(1, CHUNK // max(per_e, 1))
+    for i in range(0, len(esc), step):
+        e = esc[i:i + step][None, None, None, :]
+        cheaper_lib = api_cost_per_day_v(v, e) >= lib                 # (V, O, P, E)
+        hit = cheaper_lib.any(axis=0)
+        first = cheaper_lib.argmax(axis=0)
+        out[:, :, i:i + step] = np.where(hit, np.asarray(volumes)[first], -1)
+    return out
+
+def check_against_scalar():
+    for label, imgs_day in VOLUMES:
+        w = workers_needed(imgs_day)
+        assert int(workers_needed_v(imgs_day)) == w, label
+        assert float(library_cost_per_day_v(w)) == library_cost_per_day(w), label
+        assert float(api_cost_per_day_v(imgs_day, 0.1)) == api_cost_per_day(imgs_day, 0.1), label
+
+def fmt_vol(v) -> str:
+    if v < 0:
+        return "never"
+    for unit, div in (("B", 1e9), ("M", 1e6), ("k", 1e3)):
+        if v >= div:
+            return f"{v / div:.1f}{unit}"
+    return str(int(v))
+
+def main():
+    print("\nPHASE 2 - Vectorized fleet scaling sweep\n")
+    check_against_scalar()
+    print("Vectorized helpers match the scalar Phase-3 helpers on VOLUMES.\n")
+
+    cells = len(SWEEP_VOLUMES) * len(SWEEP_OVERHEAD) * len(SWEEP_CPU_PRICE) * len(SWEEP_ESCALATION)
+    print(f"Grid: {len(SWEEP_VOLUMES)} volumes x {len(SWEEP_OVERHEAD)} overheads x "
+          f"{len(SWEEP_CPU_PRICE)} CPU prices x {len(SWEEP_ESCALATION)} escalation rates = {cells:,} combinations")
+
+    t0 = time.time()
+    be = break_even_volumes(SWEEP_VOLUMES, SWEEP_OVERHEAD, SWEEP_CPU_PRICE, SWEEP_ESCALATION)
+    dt = time.time() - t0
+    print(f"Break-even sweep: {dt:.2f}s ({cells / max(dt, 1e-9) / 1e6:.1f}M combinations/sec)\n")
+
+    # break-even curve at the measured overhead, for a few CPU prices
+    oi = int(np.argmin(np.abs(SWEEP_OVERHEAD - OVERHEAD)))
+    price_cols = [int(np.argmin(np.abs(SWEEP_CPU_PRICE - p))) for p in (0.02, 0.04, 0.08)]
+    print(f"Break-even volume (images/day) where API spend >= library spend, overhead={SWEEP_OVERHEAD[oi]:.2f}")
+    print(f"{'Escalation':>11} " + " ".join(f"{'$' + format(SWEEP_CPU_PRICE[c], '.3f') + '/vCPU-h':>14}" for c in price_cols))
+    print("-" * (12 + 15 * len(price_cols)))
+    for ei in range(0, len(SWEEP_ESCALATION), 6):
+        row = " ".join(f"{fmt_vol(be[oi, c, ei]):>14}" for c in price_cols)
+        print(f"{SWEEP_ESCALATION[ei] * 100:>10.2f}% {row}")
+
+    # where each flags() threshold trips
+    print(f"\nVolume (images/day) where flags() trips, CPU ${CPU_COST_PER_VCPU_HOUR}/vCPU-h")
+    print(f"{'Overhead':>9} {'WARN fleet':>12} {'BREAK fleet':>12}")
+    for o in (1.0, OVERHEAD, 1.5, 2.0):
+        w_warn, w_break = volume_for_workers_v(np.array([WORKER_WARN, WORKER_BREAK]), o)
+        print(f"{o:>9.2f} {fmt_vol(w_warn):>12} {fmt_vol(w_break):>12}")
+
+    print(f"\n{'Escalation':>11} {'WARN API':>12} {'BREAK API':>12}")
+    for e in (0.01, 0.05, 0.10, 0.25, 1.0):
+        a_warn, a_break = volume_for_api_cost_v(np.array([API_WARN, API_BREAK]), e)
+        print(f"{e * 100:>10.1f}% {fmt_vol(a_warn):>12} {fmt_vol(a_break):>12}")
+
+    # sanity: trip volumes really flip flags_v
+    vw = volume_for_workers_v(WORKER_WARN)
+    fleet, _ = flags_v(workers_needed_v([vw - 1, vw]), 0)
+    assert fleet.tolist() == [0, 1]
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+from deskew import CACHE_PATH, GeometryCache
+from hybrid_router import IMAGE_FOLDER, list_images, route_image
+
+# corpus is routed twice: without the deskew stage, then with it
+def run_corpus(paths, deskew: bool, cache=None):
+    counts = {"retries": 0, "escalations": 0, "scrap": 0, "ocr_calls": 0, "corrected": 0}
+    t0 = time.time()
+    for p in paths:
+        r = route_image(p, deskew=deskew, cache=cache)
+        counts["ocr_calls"] += r.ocr_calls
+        if r.retry_conf is not None:
+            counts["retries"] += 1
+        if r.decision.startswith(("ESCALATE_AI", "ACCEPT_AI", "SCRAP")):
+            counts["escalations"] += 1
+        if r.scrap:
+            counts["scrap"] += 1
+        if r.geometry is not None and not r.geometry.is_identity():
+            counts["corrected"] += 1
+    counts["seconds"] = time.time() - t0
+    return counts
+
+def main():
+    print("\nPHASE 3 - Deskew / orientation stage before the first OCR pass\n")
+
+    paths = [os.path.join(IMAGE_FOLDER, f) for f in list_images(IMAGE_FOLDER)]
+    print(f"Images: {len(paths)}\n")
+
+    # cache file: argv[1], else deskew.CACHE_PATH (temp dir / GEOMETRY_CACHE_PATH), never the source tree
+    cache_path = sys.argv[1] if len(sys.argv) > 1 else CACHE_PATH
+    cache = GeometryCache(cache_path)
+    before = run_corpus(paths, deskew=False)
+    after = run_corpus(paths, deskew=True, cache=cache)
+    cache.save()
+
+    # reprocessing: geometry comes from the content-hash cache
+    hits0 = cache.hits
+    t0 = time.time()
+    for p in paths:
+        cache.get_or_detect(p)
+    lookup_sec = time.time() - t0
+
+    print(f"{'Metric':22} {'No deskew':>10} {'Deskew':>10} {'Prevented':>10}")
+    print("-" * 56)
+    for k in ("retries", "escalations", "scrap", "ocr_calls"):
+        print(f"{k:22} {before[k]:>10} {after[k]:>10} {before[k] - after[k]:>10}")
+    print(f"{'run time (sec)':22} {before['seconds']:>10.2f} {after['seconds']:>10.2f}")
+
+    print("\nGeometry:")
+    print("  frames corrected:", after["corrected"])
+    print("  detections (cache misses):", cache.misses, "(each with one OSD call, counted in ocr_calls)")
+    print("  cache file:", cache_path)
+    print("  reprocess cache hits:", cache.hits - hits0, f"({lookup_sec:.3f}s for {len(paths)} lookups)")
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,9 @@
 import os
 import time
-import cv2
-from PIL import Image
-import pytesseract
-from pytesseract import Output
-
-pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
-
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-TASK1_ROOT = os.path.abspath(os.path.join(BASE_DIR, ".."))
-IMAGE_FOLDER = os.path.join(TASK1_ROOT, "images")
-
-ACCEPT_CONF = 85.0
-ESCALATE_CONF = 60.0
-AI_RETRIES = 2   # AI fallback attempts
-
-def confidence_score(img) -> float:
-    data = pytesseract.image_to_data(img, output_type=Output.DICT)
-    confs = []
-    for c in data.get("conf", []):
-        try:
-            cf = float(c)
-            if cf >= 0:
-                confs.append(cf)
-        except:
-            pass
-    return sum(confs) / max(len(confs), 1)
-
-def preprocess_cv(image_path: str):
-    img = cv2.imread(image_path)
-    if img is None:
-        return None
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    gray = cv2.bilateralFilter(gray, 9, 75, 75)
-    processed = cv2.adaptiveThreshold(
-        gray, 255,
-        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-        cv2.THRESH_BINARY,
-        31, 11
-    )
-    return processed
+from hybrid_router import (
+    IMAGE_FOLDER, ACCEPT_CONF, ESCALATE_CONF, AI_RETRIES,
+    list_images, route_image, default_geometry_cache, format_route
+)
 
 def main():
     print("\nPHASE 3 - Hybrid OCR + retries + scrap detection\n")
@@ -47,10 +11,7 @@ def main():
     print(f"Escalate if best(conf) < {ESCALATE_CONF}")
     print(f"AI retries allowed = {AI_RETRIES}\n")
 
-    image_list = sorted([
-        f for f in os.listdir(IMAGE_FOLDER)
-        if f.lower().endswith((".jpg", ".jpeg", ".png"))
-    ])
+    image_list = list_images(IMAGE_FOLDER)
 
     latencies = []
     total = 0
@@ -66,59 +27,16 @@ def main():
         total += 1
 
         path = os.path.join(IMAGE_FOLDER, image_name)
+        r = route_image(path)
 
-        raw_img = Image.open(path)
-        raw_conf = confidence_score(raw_img)
-
-        retry_conf = None
-        ai_conf = None
-
-        # Step 1: raw
-        if raw_conf >= ACCEPT_CONF:
-            decision = "ACCEPT_RAW"
-
-        else:
-            # Step 2: retry with preprocess
-            processed = preprocess_cv(path)
-            if processed is not None:
-                retry_conf = confidence_score(processed)
-
-            best_local = max(raw_conf, retry_conf if retry_conf is not None else -1)
-
-            if best_local >= ACCEPT_CONF:
-                decision = "ACCEPT_RETRY"
-
-            elif best_local < ESCALATE_CONF:
-                
-                decision = "ESCALATE_AI"
-
-                best_ai = best_local
-                for attempt in range(1, AI_RETRIES + 1):
-                    if processed is None:
-                        break
-                    tmp_conf = confidence_score(processed)
-                    best_ai = max(best_ai, tmp_conf)
-                    ai_conf = tmp_conf
-
-                    if best_ai >= ACCEPT_CONF:
-                        decision = f"ACCEPT_AI_ATTEMPT_{attempt}"
-                        break
-
-                if best_ai < ACCEPT_CONF:
-                    scrap += 1
-                    decision = "SCRAP_IMAGE (send to DLQ/manual review)"
-                    print(f" {image_name} looks unusable even after retries.")
-
-            else:
-                decision = "ACCEPT_WEAK (borderline but usable)"
+        if r.scrap:
+            scrap += 1
+            print(f" {image_name} looks unusable even after retries.")
 
         t1 = time.time()
         latencies.append(t1 - t0)
 
-        raw_s = f"{raw_conf:7.2f}"
-        retry_s = f"{retry_conf:7.2f}" if retry_conf is not None else "   -   "
-        ai_s = f"{ai_conf:7.2f}" if ai_conf is not None else "   -   "
-        print(f"{image_name:30} {raw_s} {retry_s} {ai_s} {decision}")
+        print(format_route(r))
 
     elapsed_all = time.time() - start_all
     avg_latency = sum(latencies) / max(len(latencies), 1)
@@ -135,5 +53,7 @@ def main():
     print("  throughput (images/sec):", round(throughput, 2))
     print("  scrap images:", scrap)
 
+    default_geometry_cache().save()
+
 if __name__ == "__main__":
     main()
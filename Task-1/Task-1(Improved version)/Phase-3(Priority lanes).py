@@ -0,0 +1,78 @@
+import os
+import random
+import time
+from hybrid_router import IMAGE_FOLDER, list_images, route_image, default_geometry_cache
+from lane_scheduler import (
+    LANE_INTERACTIVE, LANE_BULK, DEFAULT_LANES, LaneScheduler, run,
+    percentile, workers_for_sla
+)
+
+# backfill = corpus repeated; interactive uploads arrive while it runs
+BULK_REPEAT = 20
+INTERACTIVE_UPLOADS = 10
+INTERACTIVE_EVERY_SEC = 2.0   # mean gap between uploads (poisson)
+SEED = 7
+
+def main():
+    print("\nPHASE 3 - Priority lanes (interactive vs bulk) in front of the hybrid router\n")
+
+    image_list = list_images(IMAGE_FOLDER)
+    if not image_list:
+        print("No images found.")
+        return
+    paths = [os.path.join(IMAGE_FOLDER, f) for f in image_list]
+
+    print("Lanes:")
+    for l in DEFAULT_LANES:
+        print(f"  {l.name:12} weight={l.weight} SLA p95={l.sla_p95_sec:g}s planning rate={l.arrival_rate:.3f} img/s")
+
+    sched = LaneScheduler(DEFAULT_LANES)
+    sched.submit_batch(LANE_BULK, paths * BULK_REPEAT)
+
+    rnd = random.Random(SEED)
+    arrivals = []
+    t = 0.0
+    for _ in range(INTERACTIVE_UPLOADS):
+        t += rnd.expovariate(1.0 / INTERACTIVE_EVERY_SEC)
+        arrivals.append((t, LANE_INTERACTIVE, rnd.choice(paths)))
+
+    print(f"\nBackfill: {len(paths) * BULK_REPEAT} images | interactive uploads: {INTERACTIVE_UPLOADS}\n")
+
+    decisions = {}
+    def process(job):
+        r = route_image(job.path)
+        decisions[r.decision] = decisions.get(r.decision, 0) + 1
+
+    start_all = time.time()
+    run(sched, process, arrivals)
+    elapsed_all = time.time() - start_all
+
+    total = sum(sched.stats[l.name].completed for l in DEFAULT_LANES)
+    all_service = [s for l in DEFAULT_LANES for s in sched.stats[l.name].service_times]
+    mean_service = sum(all_service) / max(len(all_service), 1)
+    p95_service = percentile(all_service, 0.95)
+
+    print("Performance Summary:")
+    print("  total images:", total)
+    print("  run time (sec):", round(elapsed_all, 2))
+    print("  throughput (images/sec):", round(total / max(elapsed_all, 1e-9), 2))
+    print("  OCR service time avg/p95 (sec):", round(mean_service, 4), "/", round(p95_service, 4))
+    print("  bulk preemptions (image boundaries):", sched.preemptions)
+
+    print(f"\n{'Lane':12} {'Done':>6} {'p50(s)':>8} {'p95(s)':>8} {'SLA(s)':>8} {'MaxQ':>6} {'AvgQ':>8} {'Workers@SLA':>12}")
+    print("-" * 76)
+    for l in DEFAULT_LANES:
+        s = sched.lane_summary(l.name)
+        w = workers_for_sla(l.arrival_rate, mean_service, p95_service, l.sla_p95_sec)
+        w_s = "unreachable" if w is None else str(w)
+        print(f"{l.name:12} {s['completed']:>6} {s['p50']:>8.3f} {s['p95']:>8.3f} {l.sla_p95_sec:>8g} "
+              f"{s['max_depth']:>6} {s['avg_depth']:>8.1f} {w_s:>12}")
+
+    default_geometry_cache().save()
+
+    print("\nDecisions:")
+    for d, n in sorted(decisions.items()):
+        print(f"  {d}: {n}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+# batch_queue.py
+# Lease-based work queue for batch OCR (the queue / workers / DLQ from the Phase-2 orchestration layer).
+# - coordinator shards the image manifest into leases (fixed-size batches of images)
+# - workers acquire a lease, heartbeat while working, complete it with per-image results
+# - expired leases go back to the pool; leases that keep expiring and unusable images land in the DLQ file
+# - SQLite holds the state; QueueServer/RemoteQueue put a small JSON-lines TCP protocol in front of it
+import json
+import os
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+from typing import Callable, List, Optional
+
+LEASE_SIZE = 16            # images per lease
+LEASE_TTL_SEC = 60.0       # lease expires unless heartbeated
+MAX_LEASE_ATTEMPTS = 3     # lease handed out this many times without completing -> DLQ
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    lease_id    INTEGER PRIMARY KEY,
+    paths       TEXT NOT NULL,
+    size        INTEGER NOT NULL,
+    state       TEXT NOT NULL DEFAULT 'ready',
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    owner       TEXT,
+    expires_at  REAL
+);
+CREATE INDEX IF NOT EXISTS leases_state ON leases(state, lease_id);
+CREATE TABLE IF NOT EXISTS results (
+    path        TEXT PRIMARY KEY,
+    lease_id    INTEGER NOT NULL,
+    worker      TEXT NOT NULL,
+    decision    TEXT NOT NULL,
+    detail      TEXT,
+    finished_at REAL NOT NULL
+);
+"""
+
+class LeaseQueue:
+    def __init__(self, db_path: str, dlq_path: str):
+        self.db_path = db_path
+        self.dlq_path = dlq_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+
+    # coordinator side
+
+    def load_manifest(self, paths: List[str], lease_size: int = LEASE_SIZE) -> int:
+        rows = [
+            (json.dumps(paths[i:i + lease_size]), len(paths[i:i + lease_size]))
+            for i in range(0, len(paths), lease_size)
+        ]
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            self._db.executemany("INSERT INTO leases(paths, size) VALUES (?, ?)", rows)
+            self._db.execute("COMMIT")
+        return len(rows)
+
+    def stats(self) -> dict:
+        with self._lock:
+            by_state = dict(self._db.execute("SELECT state, COUNT(*) FROM leases GROUP BY state").fetchall())
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM leases").fetchone()[0]
+            images = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return {"leases": by_state, "images_total": total, "images_done": images}
+
+    def drained(self) -> bool:
+        s = self.stats()["leases"]
+        return not s.get("ready") and not s.get("leased")
+
+    # worker side
+
+    def acquire(self, worker: str, ttl: float = LEASE_TTL_SEC) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                while True:
+                    row = self._db.execute(
+                        "SELECT lease_id, paths, attempts FROM leases "
+                        "WHERE state = 'ready' OR (state = 'leased' AND expires_at < ?) "
+                        "ORDER BY lease_id LIMIT 1", (now,)
+                    ).fetchone()
+                    if row is None:
+                        self._db.execute("COMMIT")
+                        return None
+                    lease_id, paths, attempts = row
+                    if attempts >= MAX_LEASE_ATTEMPTS:
+                        # keeps expiring -> poison lease
+                        self._db.execute("UPDATE leases SET state = 'dead', owner = NULL WHERE lease_id = ?", (lease_id,))
+                        self._dead_letter(json.loads(paths), lease_id, "lease expired too many times")
+                        continue
+                    self._db.execute(
+                        "UPDATE leases SET state = 'leased', owner = ?, expires_at = ?, attempts = attempts + 1 "
+                        "WHERE lease_id = ?", (worker, now + ttl, lease_id)
+                    )
+                    self._db.execute("COMMIT")
+                    return {"lease_id": lease_id, "paths": json.loads(paths), "expires_at": now + ttl}
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def heartbeat(self, lease_id: int, worker: str, ttl: float = LEASE_TTL_SEC) -> bool:
+        with self._lock:
+            cur = self._db.execute(
+                "UPDATE leases SET expires_at = ? WHERE lease_id = ? AND owner = ? AND state = 'leased'",
+                (time.time() + ttl, lease_id, worker)
+            )
+        return cur.rowcount == 1
+
+    def complete(self, lease_id: int, worker: str, results: List[dict]) -> bool:
+        """results: [{"path", "decision", "detail", "dlq": bool}]; False if the lease was lost."""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            cur = self._db.execute(
+                "UPDATE leases SET state = 'done', expires_at = NULL "
+                "WHERE lease_id = ? AND owner = ? AND state = 'leased'", (lease_id, worker)
+            )
+            if cur.rowcount != 1:
+                self._db.execute("ROLLBACK")
+                return False
+            self._db.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                [(r["path"], lease_id, worker, r["decision"], r.get("detail"), now) for r in results]
+            )
+            self._db.execute("COMMIT")
+            bad = [r for r in results if r.get("dlq")]
+            for r in bad:
+                self._dead_letter([r["path"]], lease_id, r.get("detail") or r["decision"], worker)
+        return True
+
+    def _dead_letter(self, paths: List[str], lease_id: int, reason: str, worker: Optional[str] = None) -> None:
+        lines = "".join(
+            json.dumps({"path": p, "lease_id": lease_id, "worker": worker, "reason": reason, "ts": time.time()}) + "\n"
+            for p in paths
+        )
+        # single O_APPEND write per call so concurrent writers don't interleave lines
+        fd = os.open(self.dlq_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, lines.encode("utf-8"))
+        finally:
+            os.close(fd)
+
+# TCP front-end (one JSON object per line each way)
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        q: LeaseQueue = self.server.queue
+        for line in self.rfile:
+            try:
+                msg = json.loads(line)
+                op = msg.get("op")
+                if op == "acquire":
+                    resp = {"lease": q.acquire(msg["worker"], msg.get("ttl", LEASE_TTL_SEC))}
+                elif op == "heartbeat":
+                    resp = {"ok": q.heartbeat(msg["lease_id"], msg["worker"], msg.get("ttl", LEASE_TTL_SEC))}
+                elif op == "complete":
+                    resp = {"ok": q.complete(msg["lease_id"], msg["worker"], msg["results"])}
+                elif op == "stats":
+                    resp = q.stats()
+                else:
+                    resp = {"error": f"unknown op: {op}"}
+            except Exception as e:
+                resp = {"error": str(e)}
+            self.wfile.write((json.dumps(resp) + "\n").encode("utf-8"))
+
+class QueueServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, queue: LeaseQueue, host: str = "0.0.0.0", port: int = 7070):
+        super().__init__((host, port), _Handler)
+        self.queue = queue
+
+    def serve_in_background(self) -> threading.Thread:
+        t = threading.Thread(target=self.serve_forever, daemon=True)
+        t.start()
+        return t
+
+class RemoteQueue:
+    """Same worker-side API as LeaseQueue, over TCP to a QueueServer."""
+    def __init__(self, host: str, port: int, timeout: float = 30.0):
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._r = self._sock.makefile("rb")
+        self._lock = threading.Lock()
+
+    def _call(self, **msg) -> dict:
+        with self._lock:
+            self._sock.sendall((json.dumps(msg) + "\n").encode("utf-8"))
+            line = self._r.readline()
+        if not line:
+            raise ConnectionError("queue server closed the connection")
+        resp = json.loads(line)
+        if "error" in resp:
+            raise RuntimeError(resp["error"])
+        return resp
+
+    def acquire(self, worker: str, ttl: float = LEASE_TTL_SEC) -> Optional[dict]:
+        return self._call(op="acquire", worker=worker, ttl=ttl)["lease"]
+
+    def heartbeat(self, lease_id: int, worker: str, ttl: float = LEASE_TTL_SEC) -> bool:
+        return self._call(op="heartbeat", lease_id=lease_id, worker=worker, ttl=ttl)["ok"]
+
+    def complete(self, lease_id: int, worker: str, results: List[dict]) -> bool:
+        return self._call(op="complete", lease_id=lease_id, worker=worker, results=results)["ok"]
+
+    def stats(self) -> dict:
+        return self._call(op="stats")
+
+    def close(self) -> None:
+        self._sock.close()
+
+# worker loop
+
+def run_worker(queue, worker: str, process_fn: Callable[[str], dict], ttl: float = LEASE_TTL_SEC,
+               idle_exit_sec: float = 5.0, poll_sec: float = 0.5) -> int:
+    """
+    Pull leases until the queue stays empty for idle_exit_sec.
+    process_fn(path) -> {"path", "decision", "detail", "dlq"}; exceptions dead-letter that image.
+    """
+    done = 0
+    idle_since = None
+    while True:
+        lease = queue.acquire(worker, ttl)
+        if lease is None:
+            idle_since = idle_since or time.time()
+            if time.time() - idle_since >= idle_exit_sec:
+                return done
+            time.sleep(poll_sec)
+            continue
+        idle_since = None
+
+        results = []
+        renew_at = time.time() + ttl / 3
+        lost = False
+        for path in lease["paths"]:
+            try:
+                results.append(process_fn(path))
+            except Exception as e:
+                results.append({"path": path, "decision": "ERROR", "detail": repr(e), "dlq": True})
+            if time.time() >= renew_at:
+                if not queue.heartbeat(lease["lease_id"], worker, ttl):
+                    lost = True   # someone else owns it now; drop our partial work
+                    break
+                renew_at = time.time() + ttl / 3
+
+        if not lost and queue.complete(lease["lease_id"], worker, results):
+            done += len(results)
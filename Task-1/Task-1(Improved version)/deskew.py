@@ -0,0 +1,172 @@
+# deskew.py
+# Fast orientation + skew detection on a downscaled copy, with geometry cached per content hash.
+# - text-line angle from projection profiles (all candidate angles scored in one NumPy pass)
+# - page on its side from the same sweep; upside-down needs glyph shape, so that one bit
+#   comes from a single tesseract OSD call on the small, already-levelled copy
+import hashlib
+import json
+import os
+import re
+import tempfile
+from dataclasses import dataclass, asdict
+from typing import Dict, Optional
+import cv2
+import numpy as np
+import pytesseract
+
+DETECT_MAX_SIDE = 600       # downscale before detection
+MAX_INK_SAMPLES = 20000     # ink pixels used for the projection search
+COARSE_STEP_DEG = 1.0
+FINE_STEP_DEG = 0.1
+MIN_SKEW_DEG = 0.3          # below this the frame is left alone
+
+# outside the source tree unless the caller passes a path (or sets GEOMETRY_CACHE_PATH)
+CACHE_PATH = os.environ.get("GEOMETRY_CACHE_PATH") or os.path.join(tempfile.gettempdir(), "geometry_cache.json")
+
+@dataclass
+class Geometry:
+    quarter_turns: int      # clockwise 90-degree turns to apply (0..3)
+    skew_deg: float         # residual rotation applied after the quarter turns
+
+    def is_identity(self) -> bool:
+        return self.quarter_turns == 0 and abs(self.skew_deg) < MIN_SKEW_DEG
+
+def content_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def downscale(gray: np.ndarray, max_side: int = DETECT_MAX_SIDE) -> np.ndarray:
+    h, w = gray.shape[:2]
+    scale = max_side / max(h, w)
+    if scale >= 1:
+        return gray
+    return cv2.resize(gray, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+
+def ink_points(gray: np.ndarray, seed: int = 0) -> np.ndarray:
+    _, ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    ys, xs = np.nonzero(ink)
+    pts = np.stack([xs, ys], axis=1).astype(np.float32)
+    if len(pts) > MAX_INK_SAMPLES:
+        idx = np.random.default_rng(seed).choice(len(pts), MAX_INK_SAMPLES, replace=False)
+        pts = pts[idx]
+    return pts
+
+def profile_scores(pts: np.ndarray, angles_deg: np.ndarray) -> np.ndarray:
+    # row-projection sharpness (sum of squared bin counts) for every candidate angle at once
+    if len(pts) == 0:
+        return np.zeros(len(angles_deg))
+    pts = pts - pts.mean(axis=0)
+    t = np.deg2rad(angles_deg)[:, None]
+    rows = pts[:, 1][None, :] * np.cos(t) - pts[:, 0][None, :] * np.sin(t)
+    bins = np.round(rows).astype(np.int64)
+    bins -= bins.min(axis=1, keepdims=True)
+    width = int(bins.max()) + 1
+    flat = bins + np.arange(len(angles_deg))[:, None] * width
+    hist = np.bincount(flat.ravel(), minlength=len(angles_deg) * width).reshape(len(angles_deg), width)
+    return (hist.astype(np.float64) ** 2).sum(axis=1)
+
+def text_line_angle(pts: np.ndarray) -> float:
+    # text-line direction in [-90, 90): coarse sweep then a fine pass around the winner
+    coarse = np.arange(-90.0, 90.0, COARSE_STEP_DEG)
+    best = coarse[int(np.argmax(profile_scores(pts, coarse)))]
+    fine = np.arange(best - COARSE_STEP_DEG, best + COARSE_STEP_DEG + 1e-9, FINE_STEP_DEG)
+    return float(fine[int(np.argmax(profile_scores(pts, fine)))])
+
+def rotate(img: np.ndarray, quarter_turns: int, skew_deg: float) -> np.ndarray:
+    q = quarter_turns % 4
+    if q == 1:
+        img = cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
+    elif q == 2:
+        img = cv2.rotate(img, cv2.ROTATE_180)
+    elif q == 3:
+        img = cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
+
+    if abs(skew_deg) < MIN_SKEW_DEG:
+        return img
+    h, w = img.shape[:2]
+    m = cv2.getRotationMatrix2D((w / 2, h / 2), skew_deg, 1.0)
+    # expand the canvas so corners are not clipped
+    cos, sin = abs(m[0, 0]), abs(m[0, 1])
+    nw, nh = int(h * sin + w * cos), int(h * cos + w * sin)
+    m[0, 2] += nw / 2 - w / 2
+    m[1, 2] += nh / 2 - h / 2
+    border = 255 if img.ndim == 2 else (255, 255, 255)
+    return cv2.warpAffine(img, m, (nw, nh), flags=cv2.INTER_LINEAR, borderValue=border)
+
+def osd_quarter_turns(gray: np.ndarray) -> int:
+    # clockwise quarter turns tesseract OSD asks for; 0 when OSD can't decide (too little text)
+    try:
+        osd = pytesseract.image_to_osd(gray)
+    except pytesseract.TesseractError:
+        return 0
+    m = re.search(r"Rotate:\s+(\d+)", osd)
+    return (int(m.group(1)) // 90) % 4 if m else 0
+
+def detect_geometry(gray: np.ndarray, resolve_flip: bool = True) -> Geometry:
+    small = downscale(gray)
+    angle = text_line_angle(ink_points(small))
+
+    # lines near vertical -> the page is on its side
+    quarter = 0
+    if angle >= 45:
+        quarter, angle = 1, angle - 90
+    elif angle < -45:
+        quarter, angle = 3, angle + 90
+
+    # image coords have y down, so a line at +a degrees is undone by a +a rotation in cv2
+    geom = Geometry(quarter, round(angle, 2))
+    if resolve_flip:
+        level = rotate(small, geom.quarter_turns, geom.skew_deg)
+        geom.quarter_turns = (geom.quarter_turns + osd_quarter_turns(level)) % 4
+    return geom
+
+class GeometryCache:
+    """
+    content sha256 -> Geometry, persisted as JSON so reprocessing skips detection.
+    osd_calls counts the tesseract OSD passes detection made (one per miss when resolve_flip).
+    """
+    def __init__(self, path: Optional[str] = CACHE_PATH, autosave_every: int = 100, resolve_flip: bool = True):
+        self.path = path
+        self.autosave_every = autosave_every
+        self.resolve_flip = resolve_flip
+        self._geo: Dict[str, Geometry] = {}
+        self._dirty = 0
+        self.hits = 0
+        self.misses = 0
+        self.osd_calls = 0
+        if path and os.path.exists(path):
+            with open(path) as f:
+                for k, v in json.load(f).items():
+                    self._geo[k] = Geometry(**v)
+
+    def get_or_detect(self, image_path: str) -> Optional[Geometry]:
+        key = content_hash(image_path)
+        geom = self._geo.get(key)
+        if geom is not None:
+            self.hits += 1
+            return geom
+
+        gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            return None
+        self.misses += 1
+        geom = detect_geometry(gray, self.resolve_flip)
+        if self.resolve_flip:
+            self.osd_calls += 1
+        self._geo[key] = geom
+        self._dirty += 1
+        if self._dirty >= self.autosave_every:
+            self.save()
+        return geom
+
+    def save(self) -> None:
+        if not self.path or not self._dirty:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({k: asdict(g) for k, g in self._geo.items()}, f)
+        os.replace(tmp, self.path)
+        self._dirty = 0
@@ -0,0 +1,150 @@
+# hybrid_router.py
+# Phase-3 routing (raw -> retry -> AI) shared by the Phase-3 scripts.
+import os
+from dataclasses import dataclass
+from typing import Optional
+import cv2
+from PIL import Image
+import pytesseract
+from pytesseract import Output
+from deskew import Geometry, GeometryCache, rotate
+
+pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TASK1_ROOT = os.path.abspath(os.path.join(BASE_DIR, ".."))
+IMAGE_FOLDER = os.path.join(TASK1_ROOT, "images")
+
+ACCEPT_CONF = 85.0
+ESCALATE_CONF = 60.0
+AI_RETRIES = 2   # AI fallback attempts
+
+def list_images(folder: str = IMAGE_FOLDER) -> list:
+    return sorted([
+        f for f in os.listdir(folder)
+        if f.lower().endswith((".jpg", ".jpeg", ".png"))
+    ])
+
+def confidence_score(img) -> float:
+    data = pytesseract.image_to_data(img, output_type=Output.DICT)
+    confs = []
+    for c in data.get("conf", []):
+        try:
+            cf = float(c)
+            if cf >= 0:
+                confs.append(cf)
+        except:
+            pass
+    return sum(confs) / max(len(confs), 1)
+
+def preprocess_cv(image_path: str):
+    img = cv2.imread(image_path)
+    if img is None:
+        return None
+    return preprocess_array(img)
+
+def preprocess_array(img):
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    gray = cv2.bilateralFilter(gray, 9, 75, 75)
+    processed = cv2.adaptiveThreshold(
+        gray, 255,
+        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        cv2.THRESH_BINARY,
+        31, 11
+    )
+    return processed
+
+@dataclass
+class RouteResult:
+    image_name: str
+    raw_conf: float
+    retry_conf: Optional[float]
+    ai_conf: Optional[float]
+    decision: str
+    scrap: bool = False
+    ocr_calls: int = 0
+    geometry: Optional[Geometry] = None
+
+_default_cache: Optional[GeometryCache] = None
+
+def default_geometry_cache() -> GeometryCache:
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = GeometryCache()
+    return _default_cache
+
+def route_image(path: str, deskew: bool = True, cache: Optional[GeometryCache] = None) -> RouteResult:
+    image_name = os.path.basename(path)
+
+    # Step 0: level the frame once, before any OCR pass
+    geom = None
+    upright = None
+    osd_calls = 0
+    if deskew:
+        cache = cache or default_geometry_cache()
+        before = cache.osd_calls
+        geom = cache.get_or_detect(path)
+        osd_calls = cache.osd_calls - before   # the OSD pass is an OCR call too, on cache misses only
+        if geom is not None and not geom.is_identity():
+            img = cv2.imread(path)
+            if img is not None:
+                upright = rotate(img, geom.quarter_turns, geom.skew_deg)
+
+    ocr_calls = osd_calls + 1
+    if upright is None:
+        raw_img = Image.open(path)
+    else:
+        raw_img = cv2.cvtColor(upright, cv2.COLOR_BGR2RGB)
+    raw_conf = confidence_score(raw_img)
+
+    retry_conf = None
+    ai_conf = None
+    scrap = False
+
+    # Step 1: raw
+    if raw_conf >= ACCEPT_CONF:
+        decision = "ACCEPT_RAW"
+
+    else:
+        # Step 2: retry with preprocess
+        processed = preprocess_cv(path) if upright is None else preprocess_array(upright)
+        if processed is not None:
+            retry_conf = confidence_score(processed)
+            ocr_calls += 1
+
+        best_local = max(raw_conf, retry_conf if retry_conf is not None else -1)
+
+        if best_local >= ACCEPT_CONF:
+            decision = "ACCEPT_RETRY"
+
+        elif best_local < ESCALATE_CONF:
+
+            decision = "ESCALATE_AI"
+
+            best_ai = best_local
+            for attempt in range(1, AI_RETRIES + 1):
+                if processed is None:
+                    break
+                tmp_conf = confidence_score(processed)
+                ocr_calls += 1
+                best_ai = max(best_ai, tmp_conf)
+                ai_conf = tmp_conf
+
+                if best_ai >= ACCEPT_CONF:
+                    decision = f"ACCEPT_AI_ATTEMPT_{attempt}"
+                    break
+
+            if best_ai < ACCEPT_CONF:
+                scrap = True
+                decision = "SCRAP_IMAGE (send to DLQ/manual review)"
+
+        else:
+            decision = "ACCEPT_WEAK (borderline but usable)"
+
+    return RouteResult(image_name, raw_conf, retry_conf, ai_conf, decision, scrap, ocr_calls, geom)
+
+def format_route(r: RouteResult) -> str:
+    raw_s = f"{r.raw_conf:7.2f}"
+    retry_s = f"{r.retry_conf:7.2f}" if r.retry_conf is not None else "   -   "
+    ai_s = f"{r.ai_conf:7.2f}" if r.ai_conf is not None else "   -   "
+    return f"{r.image_name:30} {raw_s} {retry_s} {ai_s} {r.decision}"
@@ -0,0 +1,202 @@
+# lane_scheduler.py
+# Priority lanes in front of the Phase-3 router.
+# - interactive (latency sensitive) and bulk (backfill) lanes
+# - smooth weighted round robin between non-empty lanes
+# - one job = one image, so bulk work yields at every image boundary
+import math
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional
+
+LANE_INTERACTIVE = "interactive"
+LANE_BULK = "bulk"
+
+@dataclass
+class Lane:
+    name: str
+    weight: int                 # share of dequeues while both lanes have work
+    sla_p95_sec: float          # end-to-end (queue + OCR) target
+    arrival_rate: float = 0.0   # planning rate (images/sec) used for sizing
+
+@dataclass
+class Job:
+    job_id: int
+    lane: str
+    path: str
+    enqueued_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def latency(self) -> float:
+        return (self.finished_at or 0.0) - self.enqueued_at
+
+    @property
+    def service_time(self) -> float:
+        return (self.finished_at or 0.0) - (self.started_at or 0.0)
+
+DEFAULT_LANES = [
+    Lane(LANE_INTERACTIVE, weight=8, sla_p95_sec=2.0, arrival_rate=5.0),
+    Lane(LANE_BULK, weight=1, sla_p95_sec=4 * 3600.0, arrival_rate=50_000 / 86400),
+]
+
+def percentile(values: List[float], p: float) -> float:
+    # same nearest-rank style as the Phase-3 "simple p95"
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[int(p * (len(s) - 1))]
+
+@dataclass
+class LaneStats:
+    submitted: int = 0
+    completed: int = 0
+    max_depth: int = 0
+    depth_samples: List[int] = field(default_factory=list)
+    latencies: List[float] = field(default_factory=list)
+    service_times: List[float] = field(default_factory=list)
+
+class LaneScheduler:
+    def __init__(self, lanes: Iterable[Lane] = DEFAULT_LANES, clock: Callable[[], float] = time.time):
+        self.lanes: Dict[str, Lane] = {l.name: l for l in lanes}
+        self.clock = clock
+        self._q: Dict[str, deque] = {name: deque() for name in self.lanes}
+        self._current: Dict[str, int] = {name: 0 for name in self.lanes}
+        self.stats: Dict[str, LaneStats] = {name: LaneStats() for name in self.lanes}
+        self._next_id = 0
+        self._last_lane: Optional[str] = None
+        self.preemptions = 0
+
+    def submit(self, lane: str, path: str, now: Optional[float] = None) -> Job:
+        if lane not in self.lanes:
+            raise ValueError(f"unknown lane: {lane}")
+        self._next_id += 1
+        job = Job(self._next_id, lane, path, self.clock() if now is None else now)
+        self._q[lane].append(job)
+        st = self.stats[lane]
+        st.submitted += 1
+        st.max_depth = max(st.max_depth, len(self._q[lane]))
+        return job
+
+    def submit_batch(self, lane: str, paths: Iterable[str], now: Optional[float] = None) -> int:
+        # a backfill is queued image by image so it can be preempted between images
+        now = self.clock() if now is None else now
+        n = 0
+        for p in paths:
+            self.submit(lane, p, now)
+            n += 1
+        return n
+
+    def depth(self, lane: str) -> int:
+        return len(self._q[lane])
+
+    def pending(self) -> int:
+        return sum(len(q) for q in self._q.values())
+
+    def next_job(self) -> Optional[Job]:
+        active = [name for name, q in self._q.items() if q]
+        if not active:
+            return None
+
+        for name in self.lanes:
+            self.stats[name].depth_samples.append(len(self._q[name]))
+
+        # smooth weighted round robin: only non-empty lanes earn credit
+        total = 0
+        best = None
+        for name in active:
+            w = self.lanes[name].weight
+            self._current[name] += w
+            total += w
+            if best is None or self._current[name] > self._current[best]:
+                best = name
+        self._current[best] -= total
+
+        # bulk was running and still has work, but another lane takes the worker
+        if self._last_lane == LANE_BULK and best != LANE_BULK and self._q[LANE_BULK]:
+            self.preemptions += 1
+        self._last_lane = best
+
+        job = self._q[best].popleft()
+        job.started_at = self.clock()
+        return job
+
+    def complete(self, job: Job) -> None:
+        job.finished_at = self.clock()
+        st = self.stats[job.lane]
+        st.completed += 1
+        st.latencies.append(job.latency)
+        st.service_times.append(job.service_time)
+
+    def lane_summary(self, lane: str) -> dict:
+        st = self.stats[lane]
+        samples = st.depth_samples
+        return {
+            "submitted": st.submitted,
+            "completed": st.completed,
+            "queued": self.depth(lane),
+            "p50": percentile(st.latencies, 0.50),
+            "p95": percentile(st.latencies, 0.95),
+            "max_depth": st.max_depth,
+            "avg_depth": sum(samples) / max(len(samples), 1),
+        }
+
+def run(sched: LaneScheduler, process_fn: Callable[[Job], None], arrivals: List[tuple] = None,
+        sleep: Callable[[float], None] = time.sleep) -> None:
+    """
+    Drive one worker until the queues and the arrival script are empty.
+    arrivals: [(at_sec_from_start, lane, path)] admitted at image boundaries.
+    """
+    pending = deque(sorted(arrivals or [], key=lambda a: a[0]))
+    start = sched.clock()
+
+    while pending or sched.pending():
+        now = sched.clock()
+        while pending and start + pending[0][0] <= now:
+            at, lane, path = pending.popleft()
+            sched.submit(lane, path, start + at)
+
+        job = sched.next_job()
+        if job is None:
+            # idle until the next arrival
+            sleep(max(0.0, start + pending[0][0] - now))
+            continue
+
+        process_fn(job)
+        sched.complete(job)
+
+# Sizing: M/M/c (Erlang C) per lane
+
+def erlang_c(workers: int, offered_load: float) -> float:
+    # probability an arriving image has to wait (workers > offered_load)
+    b = 1.0
+    for k in range(1, workers + 1):
+        b = offered_load * b / (k + offered_load * b)
+    rho = offered_load / workers
+    return b / (1 - rho + rho * b)
+
+def p95_response(workers: int, arrival_rate: float, mean_service: float, p95_service: float,
+                 q: float = 0.95) -> float:
+    mu = 1.0 / max(mean_service, 1e-9)
+    a = arrival_rate * mean_service
+    if workers <= a:
+        return math.inf
+    c = erlang_c(workers, a)
+    tail = 1.0 - q
+    wait = 0.0 if c <= tail else math.log(c / tail) / (workers * mu - arrival_rate)
+    return wait + p95_service
+
+def workers_for_sla(arrival_rate: float, mean_service: float, p95_service: float,
+                    sla_p95_sec: float, max_workers: int = 100_000) -> Optional[int]:
+    """Smallest worker count whose modelled p95 stays within the lane SLA (None if unreachable)."""
+    if arrival_rate <= 0:
+        return 0
+    if p95_service > sla_p95_sec:
+        return None
+    w = max(1, math.floor(arrival_rate * mean_service) + 1)
+    while w <= max_workers:
+        if p95_response(w, arrival_rate, mean_service, p95_service) <= sla_p95_sec:
+            return w
+        w += 1
+    return None
@@ -0,0 +1,139 @@
+import json
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from batch_queue import MAX_LEASE_ATTEMPTS, LeaseQueue, QueueServer, RemoteQueue, run_worker
+
+TTL = 0.4   # short lease so expiry shows up within a test
+
+
+def fake_ocr(path: str, crash_on=()) -> dict:
+    # "poison" images kill the worker process outright, like a crash inside tesseract
+    if any(c in path for c in crash_on):
+        os._exit(1)
+    if "boom" in path:
+        raise ValueError("unreadable image")
+    bad = "bad" in path
+    return {"path": path, "decision": "SCRAP_IMAGE" if bad else "ACCEPT_RAW", "detail": "fake", "dlq": bad}
+
+
+def worker_main(port: int, worker: str, crash_on, ttl: float, done_q) -> None:
+    queue = RemoteQueue("127.0.0.1", port)
+    done = run_worker(queue, worker, lambda p: fake_ocr(p, crash_on), ttl=ttl, idle_exit_sec=3 * TTL, poll_sec=0.02)
+    queue.close()
+    done_q.put((worker, done))
+
+
+class TestLeaseQueueWorkers(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.tmp.name, "q.db")
+        self.dlq = os.path.join(self.tmp.name, "dlq.jsonl")
+        self.queue = LeaseQueue(self.db, self.dlq)
+        self.server = QueueServer(self.queue, "127.0.0.1", 0)
+        self.server.serve_in_background()
+        self.port = self.server.server_address[1]
+        self.done_q = multiprocessing.Queue()
+        self.procs = []
+        self.started = 0
+
+    def tearDown(self):
+        for p in self.procs:
+            if p.is_alive():
+                p.terminate()
+            p.join()
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def spawn(self, crash_on=(), ttl: float = TTL) -> multiprocessing.Process:
+        p = multiprocessing.Process(target=worker_main,
+                                    args=(self.port, f"w{self.started}", tuple(crash_on), ttl, self.done_q))
+        self.started += 1
+        p.start()
+        self.procs.append(p)
+        return p
+
+    def supervise(self, workers: int, crash_on=(), ttl: float = TTL, timeout: float = 30.0) -> int:
+        # keep `workers` processes alive until the queue drains, restarting any that die; -> deaths
+        deaths = 0
+        live = [self.spawn(crash_on, ttl) for _ in range(workers)]
+        deadline = time.time() + timeout
+        while not self.queue.drained():
+            self.assertLess(time.time(), deadline, self.queue.stats())
+            for p in list(live):
+                if p.exitcode not in (None, 0):
+                    deaths += 1
+                    live.remove(p)
+                    live.append(self.spawn(crash_on, ttl))
+            time.sleep(0.02)
+        for p in self.procs:
+            p.join(timeout)
+        return deaths
+
+    def completed(self) -> dict:
+        out = {}
+        while len(out) < sum(1 for p in self.procs if p.exitcode == 0):
+            worker, done = self.done_q.get(timeout=10)
+            out[worker] = done
+        return out
+
+    def rows(self, sql: str):
+        db = sqlite3.connect(self.db)
+        try:
+            return db.execute(sql).fetchall()
+        finally:
+            db.close()
+
+    def dead_letters(self) -> list:
+        if not os.path.exists(self.dlq):
+            return []
+        with open(self.dlq) as f:
+            return [json.loads(line) for line in f]
+
+    def test_each_lease_completed_exactly_once_across_workers(self):
+        paths = [f"img-{i:03d}.png" for i in range(60)] + ["img-bad.png", "img-boom.png"]
+        self.queue.load_manifest(paths, 4)
+        self.assertEqual(self.supervise(3, ttl=30.0), 0)   # no lease may expire here
+        done = self.completed()
+        self.assertEqual(sum(done.values()), len(paths))   # a lease counted twice would overshoot
+        self.assertEqual(sorted(p for (p,) in self.rows("SELECT path FROM results")), sorted(paths))
+        self.assertEqual(self.rows("SELECT DISTINCT state, attempts FROM leases"), [("done", 1)])
+        self.assertEqual(sorted(d["path"] for d in self.dead_letters()), ["img-bad.png", "img-boom.png"])
+        self.assertTrue(all(d["worker"] in done for d in self.dead_letters()))
+
+    def test_lease_of_dead_worker_expires_and_is_released(self):
+        paths = [f"img-{i:03d}.png" for i in range(20)] + ["img-crash.png"] + [f"img-{i:03d}.png" for i in range(20, 24)]
+        self.queue.load_manifest(paths, 5)
+        doomed = self.spawn(crash_on=("crash",))
+        doomed.join(10)
+        self.assertEqual(doomed.exitcode, 1)   # completed leases 1-4, died partway through lease 5
+        self.assertEqual(self.rows("SELECT state, owner FROM leases WHERE lease_id = 5"), [("leased", "w0")])
+        self.assertEqual(self.supervise(2), 0)
+        done = self.completed()
+        self.assertEqual(sum(done.values()), 5)
+        self.assertEqual(sorted(p for (p,) in self.rows("SELECT path FROM results")), sorted(paths))
+        (state, attempts, owner), = self.rows("SELECT state, attempts, owner FROM leases WHERE lease_id = 5")
+        self.assertEqual((state, attempts), ("done", 2))
+        self.assertIn(owner, done)
+        self.assertEqual(self.dead_letters(), [])
+
+    def test_lease_that_keeps_killing_workers_goes_to_dlq(self):
+        paths = [f"img-{i:03d}.png" for i in range(12)] + ["img-poison.png"] + [f"img-{i:03d}.png" for i in range(12, 15)]
+        self.queue.load_manifest(paths, 4)
+        self.assertEqual(self.supervise(2, crash_on=("poison",)), MAX_LEASE_ATTEMPTS)
+        self.assertEqual(self.rows("SELECT lease_id, COUNT(*) FROM results GROUP BY lease_id"), [(1, 4), (2, 4), (3, 4)])
+        self.assertEqual(self.rows("SELECT state, attempts FROM leases WHERE lease_id = 4"), [("dead", MAX_LEASE_ATTEMPTS)])
+        self.assertEqual(self.rows("SELECT DISTINCT state FROM leases WHERE lease_id != 4"), [("done",)])
+        dead = self.dead_letters()
+        self.assertEqual([d["path"] for d in dead], paths[12:])
+        self.assertTrue(all(d["reason"] == "lease expired too many times" for d in dead))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,329 @@
+# async_router_v2.py
+# Asyncio front-end for Router: placement comes from an async service, routing stays Router's code.
+# - async placement service: anything with `async get_snapshot() -> PlacementSnapshot`
+#   (LocalPlacementServer is an in-process stand-in with injectable latency and failures)
+# - AsyncPlacementCache: PlacementCache's TTL / refresh-ahead / max-stale rules on the event loop;
+#   concurrent lookups during a refresh await one shared fetch task (single-flight)
+# - per-call deadlines: a request that can't get a usable snapshot in time fails closed with the same
+#   "DENY: placement unavailable and cache stale" reason the sync path uses; the fetch keeps going
+# - one event loop, no thread per request: AsyncRouter fetches the snapshot, then runs Router's
+#   synchronous routing against it without yielding in between
+import asyncio
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+from common_infra_v2 import (
+    HOME_CACHE_SIZE, HRW_MODE, PLACEMENT_CACHE_TTL_SEC, PLACEMENT_MAX_STALE_SEC, PLACEMENT_REFRESH_AHEAD_SEC,
+    CellHealth, Dependencies, HotUsers, Location, PlacementService, PlacementSnapshot, RouteGroup, Router, User,
+    deps_ok_for, residency_allows,
+)
+from degraded_mode_v2 import make_demo_placement
+
+ROUTE_DEADLINE_SEC = 0.25       # default per-call budget for waiting on placement
+PLACEMENT_DENY = "DENY: placement unavailable and cache stale"
+_DEADLINE = object()            # resolves a waiter whose deadline passed first
+
+def _expire(w: "asyncio.Future") -> None:
+    if not w.done():
+        w.set_result(_DEADLINE)
+
+class LocalPlacementServer:
+    """
+    In-process stand-in for a remote placement service. Every fetch sleeps for `latency` seconds
+    (a number, or a callable drawn per fetch) and then returns svc's current snapshot, or raises
+    ConnectionError while `down` is set.
+    """
+    def __init__(self, svc: PlacementService, latency: Union[float, Callable[[], float]] = 0.0):
+        self.svc = svc
+        self.latency = latency
+        self.down = False
+        self.fetches = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def get_snapshot(self) -> PlacementSnapshot:
+        self.fetches += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            delay = self.latency() if callable(self.latency) else self.latency
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.down:
+                raise ConnectionError("placement server unavailable")
+            return self.svc.get_snapshot()
+        finally:
+            self.in_flight -= 1
+
+class AsyncPlacementCache:
+    """
+    PlacementCache for the event loop. A usable snapshot is returned without awaiting anything; close
+    to expiry (or while serving stale) a background task refreshes it. With nothing servable, callers
+    wait on the single in-flight fetch for at most their deadline. Timeouts and failed fetches fail
+    closed; a caller giving up never cancels the fetch the others are waiting on.
+    """
+    def __init__(self, fetch: Callable[[], Any], ttl: float = PLACEMENT_CACHE_TTL_SEC,
+                 refresh_ahead: float = PLACEMENT_REFRESH_AHEAD_SEC, max_stale: float = PLACEMENT_MAX_STALE_SEC,
+                 clock: Callable[[], float] = time.time):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.refresh_ahead = min(refresh_ahead, ttl)
+        self.max_stale = max_stale
+        self._clock = clock
+        self._snap: Optional[PlacementSnapshot] = None
+        self._at = 0.0
+        self._inflight: Optional[asyncio.Task] = None
+        self._waiters: List[asyncio.Future] = []
+        self.hits = 0
+        self.stale_serves = 0
+        self.max_stale_age = 0.0
+        self.refreshes = 0
+        self.coalesced = 0
+        self.refresh_failures = 0
+        self.sync_fetches = 0
+        self.deadline_exceeded = 0
+        self.denials = 0
+
+    @property
+    def snapshot(self) -> Optional[PlacementSnapshot]:
+        return self._snap
+
+    def age(self) -> float:
+        return self._clock() - self._at
+
+    def put(self, snap: PlacementSnapshot) -> None:
+        if self._snap is None or snap.version >= self._snap.version:
+            self._snap = snap
+        self._at = self._clock()
+
+    async def _run_refresh(self) -> Optional[PlacementSnapshot]:
+        # never raises: a background refresh has nobody to hand the exception to
+        snap = None
+        try:
+            snap = await self._fetch()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.refresh_failures += 1
+        else:
+            self.put(snap)
+            self.refreshes += 1
+        finally:
+            self._inflight = None
+            waiters, self._waiters = self._waiters, []
+            for w in waiters:
+                if not w.done():
+                    w.set_result(snap)
+        return snap
+
+    def refresh(self) -> asyncio.Task:
+        """Start (or join) the single in-flight fetch."""
+        if self._inflight is not None:
+            self.coalesced += 1
+            return self._inflight
+        self._inflight = asyncio.get_running_loop().create_task(self._run_refresh())
+        return self._inflight
+
+    def get_cached(self, placement_ok: bool = True) -> Tuple[Optional[PlacementSnapshot], str]:
+        """The servable snapshot, if any, without waiting; a refresh is started when one is due."""
+        snap = self._snap
+        age = self.age()
+        if snap is not None and age <= self.ttl:
+            if placement_ok and age >= self.ttl - self.refresh_ahead:
+                self._refresh_soon()
+            self.hits += 1
+            return snap, "OK: placement fresh" if placement_ok else "OK: placement cached"
+        if snap is not None and age <= self.ttl + self.max_stale:
+            if placement_ok:
+                self._refresh_soon()
+            self.stale_serves += 1
+            self.max_stale_age = max(self.max_stale_age, age)
+            return snap, f"OK: placement stale ({age:.0f}s old)"
+        return None, PLACEMENT_DENY
+
+    def _refresh_soon(self) -> None:
+        # sync callers may run outside the loop; they just don't trigger refreshes
+        try:
+            self.refresh()
+        except RuntimeError:
+            pass
+
+    async def get(self, placement_ok: bool = True,
+                  deadline: Optional[float] = ROUTE_DEADLINE_SEC) -> Tuple[Optional[PlacementSnapshot], str]:
+        snap, msg = self.get_cached(placement_ok)
+        if snap is not None:
+            return snap, msg
+        if placement_ok:
+            # a private future per waiter, resolved by the fetch or by its own deadline timer: giving up
+            # is O(1) and never touches the shared fetch (shield()/wait_for() cost a task callback each)
+            loop = asyncio.get_running_loop()
+            w = loop.create_future()
+            self._waiters.append(w)
+            self.refresh()
+            timer = loop.call_later(deadline, _expire, w) if deadline is not None else None
+            snap = await w
+            if timer is not None:
+                timer.cancel()
+            if snap is _DEADLINE:
+                self.deadline_exceeded += 1
+                snap = None
+            if snap is not None:
+                self.sync_fetches += 1
+                return snap, "OK: placement fresh"
+        self.denials += 1
+        return None, PLACEMENT_DENY
+
+    def close(self) -> None:
+        if self._inflight is not None:
+            self._inflight.cancel()
+            self._inflight = None
+        for w in self._waiters:
+            w.cancel()
+        self._waiters = []
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self._snap.version if self._snap else None,
+            "age_sec": self.age() if self._snap else None,
+            "hits": self.hits,
+            "stale_serves": self.stale_serves,
+            "max_stale_age_sec": self.max_stale_age,
+            "refreshes": self.refreshes,
+            "coalesced": self.coalesced,
+            "refresh_failures": self.refresh_failures,
+            "sync_fetches": self.sync_fetches,
+            "deadline_exceeded": self.deadline_exceeded,
+            "denials": self.denials,
+        }
+
+class AsyncRouter(Router):
+    """
+    Router over an async placement service. The async methods mirror Router's: each awaits a snapshot
+    (bounded by `deadline`, per call or the router default), pins it, and runs the synchronous routing
+    against it. Requests denied on dependencies or served read-local never touch placement. The sync
+    methods still work and see whatever the cache holds.
+    """
+    def __init__(self, placement_svc, hash_mode: str = HRW_MODE, home_cache_size: int = HOME_CACHE_SIZE,
+                 hot_users: Optional[HotUsers] = None, clock: Callable[[], float] = time.time,
+                 deadline: float = ROUTE_DEADLINE_SEC, cache: Optional[AsyncPlacementCache] = None):
+        self.svc = placement_svc
+        self.placement = cache or AsyncPlacementCache(placement_svc.get_snapshot, clock=clock)
+        self.deadline = deadline
+        self._pinned: Optional[Tuple[Optional[PlacementSnapshot], str]] = None
+        self._init_routing(hash_mode, home_cache_size, hot_users, clock)
+        self._unsubscribe = None
+
+    def close(self) -> None:
+        self.placement.close()
+
+    def _snapshot(self, deps: Dependencies) -> Tuple[Optional[PlacementSnapshot], str]:
+        if self._pinned is not None:
+            return self._pinned
+        return self.placement.get_cached(deps.placement_ok)
+
+    async def snapshot(self, deps: Dependencies, deadline: Optional[float] = None) -> Tuple[Optional[PlacementSnapshot], str]:
+        return await self.placement.get(deps.placement_ok, self.deadline if deadline is None else deadline)
+
+    async def _pinned_call(self, deps: Dependencies, deadline: Optional[float], fn, *args):
+        pinned = await self.snapshot(deps, deadline)
+        # no await between pinning and routing: no other request can see this pin
+        self._pinned = pinned
+        try:
+            return fn(self, *args)
+        finally:
+            self._pinned = None
+
+    async def resolve_home_async(self, user_id: str, deps: Dependencies, key: Optional[str] = None,
+                                 deadline: Optional[float] = None) -> Tuple[Optional[str], Optional[Location], Optional[int], str]:
+        return await self._pinned_call(deps, deadline, Router.resolve_home, user_id, deps, key)
+
+    async def read_shards_async(self, user_id: str, deps: Dependencies,
+                                deadline: Optional[float] = None) -> Tuple[Tuple[str, ...], str]:
+        return await self._pinned_call(deps, deadline, Router.read_shards, user_id, deps)
+
+    async def route_read_async(self, user: User, op: str, serving_region: str, deps: Dependencies,
+                               deadline: Optional[float] = None) -> Tuple[bool, str]:
+        if not deps_ok_for(op, deps)[0] or residency_allows(user, serving_region, op):
+            return Router.route_read(self, user, op, serving_region, deps)
+        return await self._pinned_call(deps, deadline, Router.route_read, user, op, serving_region, deps)
+
+    async def route_write_async(self, user: User, op: str, deps: Dependencies, health: CellHealth,
+                                key: Optional[str] = None, deadline: Optional[float] = None
+                                ) -> Tuple[str, str, Optional[str], Optional[int]]:
+        if not deps_ok_for(op, deps)[0]:
+            return Router.route_write(self, user, op, deps, health, key)
+        return await self._pinned_call(deps, deadline, Router.route_write, user, op, deps, health, key)
+
+    async def route_write_many_async(self, users: Sequence[User], op: str, deps: Dependencies, health: CellHealth,
+                                     keys: Optional[Sequence[str]] = None, deadline: Optional[float] = None
+                                     ) -> Dict[Tuple[Optional[str], Optional[str]], RouteGroup]:
+        if not deps_ok_for(op, deps)[0]:
+            return Router.route_write_many(self, users, op, deps, health, keys)
+        return await self._pinned_call(deps, deadline, Router.route_write_many, users, op, deps, health, keys)
+
+    async def route_read_many_async(self, users: Sequence[User], op: str, serving_region: str, deps: Dependencies,
+                                    deadline: Optional[float] = None
+                                    ) -> Dict[Tuple[Optional[str], Optional[str]], RouteGroup]:
+        if not deps_ok_for(op, deps)[0] or all(residency_allows(u, serving_region, op) for u in users):
+            return Router.route_read_many(self, users, op, serving_region, deps)
+        return await self._pinned_call(deps, deadline, Router.route_read_many, users, op, serving_region, deps)
+
+async def _burst(router: AsyncRouter, n: int, deps: Dependencies, health: CellHealth,
+                 deadline: Optional[float] = None) -> Tuple[float, Dict[str, int]]:
+    users = [User(f"user-{i}", "us" if i % 2 else "eu") for i in range(n)]
+    t0 = time.perf_counter()
+    res = await asyncio.gather(*(router.route_write_async(u, "low_value_action", deps, health, deadline=deadline)
+                                 for u in users))
+    elapsed = time.perf_counter() - t0
+    out: Dict[str, int] = {}
+    for decision, reason, _, _ in res:
+        k = decision if decision != "FAIL" else reason
+        out[k] = out.get(k, 0) + 1
+    return elapsed, out
+
+async def _demo(n: int, latency: float) -> None:
+    now = [1000.0]
+    server = LocalPlacementServer(PlacementService(make_demo_placement()), latency)
+    router = AsyncRouter(server, clock=lambda: now[0])
+    deps, health = Dependencies(), CellHealth()
+    threads = threading.active_count()
+    expire = PLACEMENT_CACHE_TTL_SEC + PLACEMENT_MAX_STALE_SEC + 1
+
+    print(f"\n{'Phase':40} {'requests':>9} {'fetches':>8} {'elapsed':>9} {'req/s':>10}  outcomes")
+    print("-" * 120)
+
+    async def phase(name: str) -> None:
+        before = server.fetches
+        elapsed, out = await _burst(router, n, deps, health)
+        print(f"{name:40} {n:>9,} {server.fetches - before:>8} {elapsed * 1e3:>7.1f}ms {n / elapsed:>10,.0f}  {out}")
+
+    await phase("cold cache: every request waits")
+    await phase("warm cache")
+    now[0] += PLACEMENT_CACHE_TTL_SEC - 1
+    await phase("refresh-ahead window")
+    await asyncio.sleep(2 * latency)
+    now[0] += expire
+    server.latency = 2 * router.deadline
+    await phase("expired, fetch slower than the deadline")
+    await asyncio.sleep(2 * router.deadline)      # the fetch outlived its waiters and refilled the cache
+    server.latency = latency
+    await phase("after the slow fetch lands")
+    now[0] += expire
+    server.down = True
+    await phase("expired, placement server down")
+
+    print(f"\nThreads: {threads} before, {threading.active_count()} after | "
+          f"max concurrent fetches at the server: {server.max_in_flight} | deadline {router.deadline * 1e3:g} ms")
+    print(f"Placement cache: {router.placement_stats()}")
+    router.close()
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+    print("\nAsync router: concurrent route_write against a local placement server "
+          f"({latency * 1e3:g} ms per fetch)")
+    asyncio.run(_demo(n, latency))
+
+if __name__ == "__main__":
+    main()
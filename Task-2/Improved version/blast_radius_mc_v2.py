@@ -0,0 +1,209 @@
+# blast_radius_mc_v2.py
+# Monte Carlo blast radius over the real placement map (blast_radius_v2 assumes uniform cells).
+# - users per shard come from the caller (e.g. HRW counts / Zipf load from shard_sim_v2), users per
+#   cell follow the snapshot's shard -> cell map, so uneven placement and hot shards show up
+# - every scenario samples correlated failures: region, AZ (all of its cells), single cells, a bad
+#   deploy wave across several cells at once, and dependency outages per region or global
+# - scenarios are drawn in batches as boolean matrices; impact per region is a matrix product
+# - "down": the user's cell is down; "degraded": a dependency outage in the user's region blocks
+#   part of OP_MIX (deps_ok_for decides which ops); "lost" = share of the op mix that fails
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+import numpy as np
+from common_infra_v2 import (
+    ACTIVE_SHARDS, DEP_FLAGS, PlacementService, PlacementSnapshot, deps_from_mask, deps_ok_for,
+)
+from blast_radius_v2 import REGION_DISTRIBUTION, TOTAL_USERS
+from shard_sim_v2 import shard_ids, simulate
+
+MC_SCENARIOS = 1_000_000
+MC_BATCH = 50_000              # scenarios per batch: ~50 MB of draws at 100 cells
+AZS_PER_REGION = 3
+TAIL_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+CVAR_LEVEL = 0.99              # expected shortfall: mean impact of the worst 1% of scenarios
+
+# request mix used to turn dependency outages into lost requests
+OP_MIX = {
+    "view_public": 0.30,
+    "view_profile_basic": 0.25,
+    "low_value_action": 0.20,
+    "view_pii": 0.08,
+    "transfer": 0.06,
+    "high_value_action": 0.04,
+    "issue_token": 0.03,
+    "change_permissions": 0.02,
+    "export_data": 0.01,
+    "rotate_keys": 0.01,
+}
+
+@dataclass
+class FailureModel:
+    """Per-scenario outage probabilities (one scenario = one incident window, e.g. a day)."""
+    p_region: float = 0.0005
+    p_az: float = 0.002
+    p_cell: float = 0.005
+    p_deploy: float = 0.01        # a bad deploy escapes canary...
+    deploy_cells: int = 4         # ...and takes down this many random cells, any region
+    p_dep: Dict[str, float] = field(default_factory=lambda: {
+        "auth": 0.001, "policy": 0.002, "risk": 0.003, "audit": 0.002, "kms": 0.001, "placement": 0.002})
+    p_dep_global: float = 0.0002  # per dependency: down in every region at once
+
+@dataclass
+class Topology:
+    regions: List[str]
+    cells: List[str]
+    cell_region: "np.ndarray"     # cell -> region index
+    cell_az: "np.ndarray"         # cell -> AZ index
+    azs: List[str]
+    users: "np.ndarray"           # users per cell
+    load: "np.ndarray"            # traffic share per cell
+
+def default_az_of(snap: PlacementSnapshot) -> Dict[str, str]:
+    # cells of a region spread round-robin over AZS_PER_REGION zones
+    by_region: Dict[str, List[str]] = {}
+    for loc in snap.placement.values():
+        cells = by_region.setdefault(loc["region"], [])
+        if loc["cell"] not in cells:
+            cells.append(loc["cell"])
+    return {cell: f"{region}-az{i % AZS_PER_REGION + 1}"
+            for region, cells in by_region.items() for i, cell in enumerate(sorted(cells))}
+
+def build_topology(snap: PlacementSnapshot, shard_users: Dict[str, float],
+                   shard_load: Optional[Dict[str, float]] = None, az_of: Optional[Dict[str, str]] = None) -> Topology:
+    """Users (and traffic) per cell from per-shard counts and the snapshot's placement."""
+    az_of = az_of or default_az_of(snap)
+    cells = sorted({snap.placement[sid]["cell"] for sid in snap.shards})
+    regions = sorted({snap.placement[sid]["region"] for sid in snap.shards})
+    azs = sorted({az_of[c] for c in cells})
+    region_of = {snap.placement[sid]["cell"]: snap.placement[sid]["region"] for sid in snap.shards}
+    users = np.zeros(len(cells))
+    load = np.zeros(len(cells))
+    col = {c: i for i, c in enumerate(cells)}
+    for sid in snap.shards:
+        i = col[snap.placement[sid]["cell"]]
+        users[i] += shard_users.get(sid, 0.0)
+        load[i] += (shard_load or shard_users).get(sid, 0.0)
+    return Topology(regions, cells, np.array([regions.index(region_of[c]) for c in cells]),
+                    np.array([azs.index(az_of[c]) for c in cells]), azs, users, load / max(load.sum(), 1e-300))
+
+def blocked_share_table(mix: Dict[str, float] = OP_MIX) -> "np.ndarray":
+    """Dependency-health mask -> share of the op mix deps_ok_for denies."""
+    total = sum(mix.values())
+    out = np.zeros(1 << len(DEP_FLAGS))
+    for mask in range(len(out)):
+        deps = deps_from_mask(mask)
+        out[mask] = sum(w for op, w in mix.items() if not deps_ok_for(op, deps)[0]) / total
+    return out
+
+def simulate_scenarios(topo: Topology, model: FailureModel, scenarios: int = MC_SCENARIOS, seed: int = 7,
+                       batch: int = MC_BATCH, mix: Dict[str, float] = OP_MIX) -> Dict[str, "np.ndarray"]:
+    """Per scenario: users down / degraded / impacted, requests lost (users and traffic share)."""
+    rng = np.random.default_rng(seed)
+    n_cells, n_regions = len(topo.cells), len(topo.regions)
+    onehot = np.zeros((n_cells, n_regions))
+    onehot[np.arange(n_cells), topo.cell_region] = 1.0
+    users_by = topo.users[:, None] * onehot        # cell -> users counted in its region
+    load_by = topo.load[:, None] * onehot
+    region_users, region_load = users_by.sum(axis=0), load_by.sum(axis=0)
+    blocked_table = blocked_share_table(mix)
+    p_dep = np.array([model.p_dep.get(name, 0.0) for name in DEP_FLAGS])
+    bits = 1 << np.arange(len(DEP_FLAGS))
+    k = min(model.deploy_cells, n_cells)
+
+    out = {name: np.empty(scenarios) for name in ("down", "degraded", "impacted", "lost", "load_lost")}
+    for a in range(0, scenarios, batch):
+        b = min(batch, scenarios - a)
+        down = rng.random((b, n_cells)) < model.p_cell
+        down |= (rng.random((b, len(topo.azs))) < model.p_az)[:, topo.cell_az]
+        down |= (rng.random((b, n_regions)) < model.p_region)[:, topo.cell_region]
+        wave = np.flatnonzero(rng.random(b) < model.p_deploy)
+        if len(wave) and k:
+            hit = np.argpartition(rng.random((len(wave), n_cells)), k - 1, axis=1)[:, :k]
+            down[wave[:, None], hit] = True
+        dep_down = rng.random((b, n_regions, len(DEP_FLAGS))) < p_dep
+        dep_down |= (rng.random((b, len(DEP_FLAGS))) < model.p_dep_global)[:, None, :]
+        blocked = blocked_table[(~dep_down * bits).sum(axis=2)]          # (b, regions)
+
+        df = down.astype(np.float64)
+        users_down = df @ users_by                                          # (b, regions)
+        load_down = df @ load_by
+        users_up = region_users - users_down
+        degraded = users_up * (blocked > 0)
+        out["down"][a:a + b] = users_down.sum(axis=1)
+        out["degraded"][a:a + b] = degraded.sum(axis=1)
+        out["impacted"][a:a + b] = out["down"][a:a + b] + out["degraded"][a:a + b]
+        out["lost"][a:a + b] = (users_down + users_up * blocked).sum(axis=1)
+        out["load_lost"][a:a + b] = (load_down + (region_load - load_down) * blocked).sum(axis=1)
+    return out
+
+def tail_summary(x: "np.ndarray") -> dict:
+    """Distribution and tail of one impact metric over all scenarios."""
+    q = np.quantile(x, TAIL_QUANTILES)
+    worst = np.sort(x)[int(len(x) * CVAR_LEVEL):]
+    return {
+        "mean": float(x.mean()),
+        "p_any": float((x > 0).mean()),
+        "q": dict(zip(TAIL_QUANTILES, q.tolist())),
+        "cvar": float(worst.mean()) if len(worst) else float(x.max()),
+        "max": float(x.max()),
+    }
+
+def make_placement(shards: List[str], cells_per_region: int) -> Dict[str, Dict[str, str]]:
+    # shards split across regions by REGION_DISTRIBUTION, round-robin over each region's cells
+    placement = {}
+    regions = list(REGION_DISTRIBUTION)
+    cut = np.cumsum([REGION_DISTRIBUTION[r] for r in regions]) * len(shards)
+    for i, sid in enumerate(shards):
+        r = regions[min(int(np.searchsorted(cut, i, side="right")), len(regions) - 1)]
+        placement[sid] = {"region": r, "cell": f"{r}-cell-{i % cells_per_region + 1}"}
+    return placement
+
+def main():
+    scenarios = int(sys.argv[1]) if len(sys.argv) > 1 else MC_SCENARIOS
+    n_shards = int(sys.argv[2]) if len(sys.argv) > 2 else len(ACTIVE_SHARDS)
+    cells_per_region = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    users = int(sys.argv[4]) if len(sys.argv) > 4 else TOTAL_USERS
+
+    shards = shard_ids(n_shards)
+    svc = PlacementService(make_placement(shards, cells_per_region), shards=shards)
+    snap = svc.get_snapshot()
+    sim = simulate(users, shards, ids="synthetic")
+    topo = build_topology(snap, dict(zip(shards, sim["counts"].tolist())), dict(zip(shards, sim["load"].tolist())))
+
+    t0 = time.perf_counter()
+    res = simulate_scenarios(topo, FailureModel(), scenarios)
+    elapsed = time.perf_counter() - t0
+
+    print("\nBlast radius (Monte Carlo over the placement map)\n")
+    print(f"Users: {users:,} | Shards: {n_shards} | Cells: {len(topo.cells)} ({cells_per_region}/region) "
+          f"| AZs: {len(topo.azs)} | Scenarios: {scenarios:,} in {elapsed:.1f}s")
+    print("Users per shard: HRW counts; traffic: Zipf load per shard (shard_sim_v2)\n")
+
+    print(f"{'Region':8} {'Users':>10} {'Uniform cell est.':>18} {'Smallest cell':>14} {'Largest cell':>13} "
+          f"{'Largest cell traffic %':>23}")
+    print("-" * 90)
+    for ri, region in enumerate(topo.regions):
+        mask = topo.cell_region == ri
+        cu = topo.users[mask]
+        # blast_radius_v2's estimate: the region's share of users spread evenly over its cells
+        uniform = users * REGION_DISTRIBUTION.get(region, 0.0) / len(cu)
+        print(f"{region:8} {int(cu.sum()):>10,} {int(uniform):>18,} {int(cu.min()):>14,} "
+              f"{int(cu.max()):>13,} {topo.load[mask].max() * 100:>22.2f}%")
+
+    head = "".join(f"{'p' + format(q * 100, 'g'):>10}" for q in TAIL_QUANTILES)
+    print(f"\n{'Impact per scenario':22} {'P(>0)':>7} {'mean':>10}{head} {'CVaR99':>10} {'max':>10}")
+    print("-" * 110)
+    rows = (("users down", res["down"], users), ("users degraded", res["degraded"], users),
+            ("users impacted", res["impacted"], users), ("user-requests lost", res["lost"], users),
+            ("traffic lost (Zipf)", res["load_lost"], 1.0))
+    for name, x, total in rows:
+        st = tail_summary(x)
+        cols = "".join(f"{v / total:>10.3%}" for v in st["q"].values())
+        print(f"{name:22} {st['p_any']:>7.2%} {st['mean'] / total:>10.3%}{cols} {st['cvar'] / total:>10.3%} "
+              f"{st['max'] / total:>10.3%}")
+    print("\nShares of all users (traffic for the Zipf row). CVaR99 = mean of the worst 1% of scenarios.")
+
+if __name__ == "__main__":
+    main()
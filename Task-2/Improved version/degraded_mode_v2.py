@@ -31,7 +31,8 @@ class Evaluator:
         if not ok:
             return False, why
 
-        decision, route_msg, shard, pv = self.router.route_write(user, op, deps, health)
+        # the idempotency key picks the sub-shard when the user has been split (HotUsers)
+        decision, route_msg, shard, pv = self.router.route_write(user, op, deps, health, key=idem_key)
         if decision == "FAIL":
             return False, route_msg
 
@@ -0,0 +1,121 @@
+# drain_bench_v2.py
+import random
+import sys
+import time
+from common_infra_v2 import (
+    ACTIVE_SHARDS, CellHealth, DrainReport, DrainScheduler, PlacementService, Router, WriteEvent, WriteQueue,
+    hrw_shard_for_user,
+)
+
+WRITE_RTT_SEC = 0.001        # simulated round trip per write call to a shard
+WRITE_ROW_SEC = 0.000005     # simulated per-row cost inside a bulk write
+LEGACY_BUDGET_SEC = 3.0      # the per-user drain is too slow to run to empty; project from this much
+HEAVY_SHARE = 0.3            # share of the backlog owned by one noisy user
+
+def make_placement() -> dict:
+    return {s: {"region": "us", "cell": f"us-cell-{i % 2 + 1}"} for i, s in enumerate(ACTIVE_SHARDS)}
+
+def fill(queue: WriteQueue, events: int, users: int, version: int, tag: str = "k") -> None:
+    rng = random.Random(3)
+    heavy = int(events * HEAVY_SHARE)
+    ids = ["heavy"] * heavy + [f"user-{rng.randrange(users)}" for _ in range(events - heavy)]
+    homes = {uid: hrw_shard_for_user(uid, ACTIVE_SHARDS) for uid in set(ids)}
+    now = time.time()
+    for i, uid in enumerate(ids):
+        queue.enqueue(WriteEvent(uid, "low_value_action", "x" * 64, f"{tag}{i}", now, homes[uid], version))
+
+def run_legacy(queue: WriteQueue):
+    # pre-scheduler behaviour: walk users one by one, one write call per event
+    def write_one(ev):
+        time.sleep(WRITE_RTT_SEC + WRITE_ROW_SEC)
+
+    total = len(queue)
+    processed = 0
+    t0 = time.perf_counter()
+    while queue.users() and time.perf_counter() - t0 < LEGACY_BUDGET_SEC:
+        for uid in queue.users():
+            processed += queue.drain(uid, time.time(), write_one)[0]
+            if time.perf_counter() - t0 >= LEGACY_BUDGET_SEC:
+                break
+    elapsed = time.perf_counter() - t0
+    rate = processed / elapsed
+    return processed, rate, elapsed + (total - processed) / rate, None
+
+def run_scheduler(queue: WriteQueue, svc: PlacementService):
+    light_done = {}
+    t0 = time.perf_counter()
+
+    def bulk_write(shard, events):
+        time.sleep(WRITE_RTT_SEC + WRITE_ROW_SEC * len(events))
+        now = time.perf_counter() - t0
+        for ev in events:
+            if ev.user_id != "heavy":
+                light_done[ev.user_id] = now
+
+    health = CellHealth(cell_ok={"us-cell-1": True, "us-cell-2": True})
+    report = DrainScheduler(queue, svc.get_snapshot).run(bulk_write, health)
+    return report.processed, report.throughput, report.time_to_empty_sec, max(light_done.values())
+
+def run_reroute(events: int, users: int):
+    # outage: backlog queued at 4 placement versions (the last quarter is a client retry storm
+    # of the third), then one shard is drained of weight (HRW homes move) and half the
+    # shards are moved to the other cell
+    svc = PlacementService(make_placement())
+    queue = WriteQueue()
+    for v, tag in enumerate(("a", "b", "c", "c")):
+        fill(queue, events // 4, users, svc.get_snapshot().version, tag)
+        svc.move_shard(ACTIVE_SHARDS[v], "us", "us-cell-2")
+    svc.set_weight(ACTIVE_SHARDS[0], 0.0)
+    for s in ACTIVE_SHARDS[::2]:
+        svc.move_shard(s, "us", "us-cell-1")
+    snap = svc.get_snapshot()
+    all_events = [ev for uid in queue.users() for ev in queue.user_queue(uid)]
+
+    # per event: a delta lookup and a home-shard resolve (cold router cache)
+    router = Router(svc, subscribe=False)
+    t0 = time.perf_counter()
+    moved = 0
+    for ev in all_events:
+        svc.delta_since(ev.placement_version)
+        moved += router.home_shard(ev.user_id, snap) != ev.target_shard
+    per_event = time.perf_counter() - t0
+
+    router = Router(svc, subscribe=False)
+    report = DrainReport()
+    t0 = time.perf_counter()
+    DrainScheduler(queue, router=router)._prepare(snap, report)
+    bulk = time.perf_counter() - t0
+    return len(all_events), per_event, bulk, report, moved
+
+def main():
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+
+    svc = PlacementService(make_placement())
+    print("\nWriteQueue drain after cell recovery\n")
+    print(f"Backlog: {events:,} events, {users:,} users + 1 heavy user ({HEAVY_SHARE:.0%} of events)")
+    print(f"Simulated shard write: {WRITE_RTT_SEC * 1e3:g} ms/call + {WRITE_ROW_SEC * 1e6:g} us/row\n")
+    print(f"{'Drain':12} {'Processed':>10} {'Events/s':>10} {'Time to empty s':>16} {'Last light user done s':>23}")
+    print("-" * 75)
+    for name in ("per-user", "scheduler"):
+        queue = WriteQueue()
+        fill(queue, events, users, svc.get_snapshot().version)
+        if name == "per-user":
+            processed, rate, tte, light = run_legacy(queue)
+        else:
+            processed, rate, tte, light = run_scheduler(queue, svc)
+        light_s = f"{light:.2f}" if light is not None else "-"
+        note = " (projected)" if processed < events else ""
+        print(f"{name:12} {processed:>10,} {rate:>10,.0f} {tte:>16.1f} {light_s:>23}{note}")
+
+    n, per_event, bulk, report, moved = run_reroute(events, users)
+    print(f"\nRe-route {n:,} queued events after placement changed during the outage "
+          f"(queued at 4 versions; weight change + {len(ACTIVE_SHARDS) // 2} shard moves)\n")
+    print(f"{'Re-route':22} {'Seconds':>8} {'us/event':>9} {'Version groups':>15} {'Rerouted':>9} {'Moved cell':>11} {'Coalesced':>10}")
+    print("-" * 90)
+    print(f"{'per event lookup':22} {per_event:>8.2f} {per_event / n * 1e6:>9.2f} {'-':>15} {moved:>9,} {'-':>11} {'-':>10}")
+    print(f"{'bulk per version delta':22} {bulk:>8.2f} {bulk / n * 1e6:>9.2f} {report.reroute_batches:>15} "
+          f"{report.rerouted:>9,} {report.moved:>11,} {report.coalesced:>10,}")
+
+if __name__ == "__main__":
+    main()
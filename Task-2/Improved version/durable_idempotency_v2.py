@@ -0,0 +1,448 @@
+# durable_idempotency_v2.py
+# On-disk IdempotencyStore backend: dedup state survives restarts (when clients retry the most).
+# - group commit: each flush appends every pending row to one redo log with a single write (+fsync)
+# - rows live in one SQLite file per HRW home shard (same engine as Router); the log is checkpointed
+#   into them in large per-shard transactions and then truncated
+# - rows are compact: raw 32-byte payload hash, minified JSON response (zlib above ZLIB_MIN_BYTES)
+# - a Bloom filter per shard file answers "never recorded" without touching SQLite
+# - the shard layout is pinned in layout.json: reopening with different shards/weights is refused,
+#   since rows would be looked up in the wrong file and dedup silently missed
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from common_infra_v2 import (
+    ACTIVE_SHARDS, HOME_CACHE_SIZE, HRW_MODE, HrwEngine, IdemEntry, IdemKey, IdempotencyStore,
+    MemoryIdempotencyBackend, payload_hash
+)
+
+COMMIT_DELAY_SEC = 0.0      # extra wait to grow a group; 0 = commit as soon as the previous one lands
+FSYNC = False               # False: survives process crashes; True: also power loss (fsync per group)
+CHECKPOINT_ROWS = 50_000    # logged rows kept in memory before they are written into the shard files
+CHECKPOINT_SEC = 5.0        # ... or this long after the first of them was logged
+EXPIRE_EVERY_SEC = 60.0     # per-call expiry is batched into one background DELETE per interval
+ZLIB_MIN_BYTES = 256        # responses at least this long are deflated
+LOG_NAME = "idem.log"
+LAYOUT_NAME = "layout.json" # shard list / HRW mode / weights the shard files were written with
+BLOOM_BITS = 1 << 22        # per shard file (512 KB): ~1% false positives up to ~400k keys per shard
+BLOOM_HASHES = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS idem (
+    user_id  TEXT NOT NULL,
+    op       TEXT NOT NULL,
+    idem_key TEXT NOT NULL,
+    ph       BLOB NOT NULL,
+    resp     BLOB NOT NULL,
+    ts       REAL NOT NULL,
+    PRIMARY KEY (user_id, op, idem_key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idem_ts ON idem(ts);
+"""
+
+# compact encodings
+
+def pack_ph(ph: str) -> bytes:
+    # payload_hash() hex -> 32 raw bytes; anything else kept verbatim behind a marker byte
+    if len(ph) == 64:
+        try:
+            raw = bytes.fromhex(ph)
+        except ValueError:
+            raw = None
+        if raw is not None and raw.hex() == ph:
+            return b"\x00" + raw
+    return b"\x01" + ph.encode("utf-8")
+
+def unpack_ph(b: bytes) -> str:
+    return b[1:].hex() if b[:1] == b"\x00" else b[1:].decode("utf-8")
+
+def pack_response(resp) -> bytes:
+    # responses must be JSON-serializable (tuples come back as lists; put() normalizes up front)
+    raw = json.dumps(resp, separators=(",", ":")).encode("utf-8")
+    if len(raw) >= ZLIB_MIN_BYTES:
+        z = zlib.compress(raw, 6)
+        if len(z) < len(raw):
+            return b"z" + z
+    return b"j" + raw
+
+def unpack_response(b: bytes):
+    raw = zlib.decompress(b[1:]) if b[:1] == b"z" else b[1:]
+    return json.loads(raw)
+
+def normalize_response(resp):
+    # what any read path will hand back: the JSON round trip shard files and the log go through
+    return json.loads(json.dumps(resp, separators=(",", ":")))
+
+class KeyFilter:
+    """Bloom filter over idempotency keys; no false negatives, so a miss skips the disk lookup."""
+    def __init__(self, bits: int = BLOOM_BITS, hashes: int = BLOOM_HASHES):
+        if bits & (bits - 1):
+            raise ValueError("bits must be a power of two")
+        self._bits = bytearray(bits // 8)
+        self._mask = bits - 1
+        self._k = hashes
+
+    def _positions(self, k: IdemKey) -> List[int]:
+        d = hashlib.blake2b("\x1f".join(k).encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(d[:8], "little")
+        h2 = int.from_bytes(d[8:], "little") | 1
+        return [(h1 + i * h2) & self._mask for i in range(self._k)]
+
+    def add(self, k: IdemKey) -> None:
+        # not atomic: callers serialize adds
+        bits = self._bits
+        for p in self._positions(k):
+            bits[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, k: IdemKey) -> bool:
+        bits = self._bits
+        return all(bits[p >> 3] >> (p & 7) & 1 for p in self._positions(k))
+
+class _ShardDb:
+    def __init__(self, path: str, synchronous: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(f"PRAGMA synchronous={synchronous}")
+        self.db.executescript(SCHEMA)
+        # one key scan per shard at open; after that the filter is kept current by put()
+        self.keys = KeyFilter()
+        for row in self.db.execute("SELECT user_id, op, idem_key FROM idem"):
+            self.keys.add(row)
+
+class SqliteIdempotencyBackend:
+    """
+    Backend for IdempotencyStore (same get/put/expire/__len__/close interface as
+    MemoryIdempotencyBackend). put() is readable immediately; the flusher thread logs
+    everything pending with one append, so concurrent writers share a commit however
+    many shards they touch. durable=True makes put() wait until its row is logged.
+    Reads check, in order: pending, being logged, logged-not-checkpointed, shard file.
+    """
+    def __init__(self, directory: str, shards=ACTIVE_SHARDS, hash_mode: str = HRW_MODE, weights=None,
+                 durable: bool = True, fsync: bool = FSYNC, commit_delay: float = COMMIT_DELAY_SEC,
+                 checkpoint_rows: int = CHECKPOINT_ROWS, checkpoint_sec: float = CHECKPOINT_SEC):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.engine = HrwEngine(shards, hash_mode, weights)
+        self._home = lru_cache(maxsize=HOME_CACHE_SIZE)(self.engine.index_for)
+        self.durable = durable
+        self.fsync = fsync
+        self.commit_delay = commit_delay
+        self.checkpoint_rows = checkpoint_rows
+        self.checkpoint_sec = checkpoint_sec
+        self._synchronous = "FULL" if fsync else "NORMAL"
+
+        self._check_layout()
+        self._dbs: Dict[int, _ShardDb] = {}
+        self._open_lock = threading.Lock()
+        for path in glob.glob(os.path.join(directory, "idem-*.db")):
+            sid = os.path.basename(path)[len("idem-"):-len(".db")]
+            if sid in self.engine.shards:
+                self._db(self.engine.shards.index(sid))
+
+        self._cv = threading.Condition()
+        self._pending: Dict[IdemKey, Tuple[IdemEntry, int]] = {}   # written, not yet logged
+        self._inflight: Dict[IdemKey, Tuple[IdemEntry, int]] = {}  # being logged right now
+        self._logged: Dict[IdemKey, Tuple[IdemEntry, int]] = {}    # in the log, not yet in a shard file
+        self._logged_at = 0.0
+        self._gen = 0            # group currently filling
+        self._flushed_gen = -1   # last group in the log
+        self._expire_at: Optional[Tuple[float, int]] = None
+        self._last_expire = 0.0
+        self._closed = False
+        self.group_commits = 0
+        self.rows_logged = 0
+        self.checkpoints = 0
+        self.recovered = 0
+
+        self._log_path = os.path.join(directory, LOG_NAME)
+        self._recover()
+        self._log = os.open(self._log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._flusher = threading.Thread(target=self._flush_loop, name="idem-flusher", daemon=True)
+        self._flusher.start()
+
+    def _check_layout(self) -> None:
+        eng = self.engine
+        layout = {"shards": list(eng.shards), "hash_mode": eng.mode,
+                  "weights": list(eng.weights) if eng.weights else None}
+        path = os.path.join(self.directory, LAYOUT_NAME)
+        if os.path.exists(path):
+            with open(path) as f:
+                stored = json.load(f)
+            if stored != layout:
+                raise ValueError(
+                    f"{self.directory} was written with a different shard layout "
+                    f"({len(stored['shards'])} shards, mode {stored['hash_mode']}, "
+                    f"{'weighted' if stored['weights'] else 'unweighted'}); open it with that layout")
+            return
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(layout, f)
+        os.replace(tmp, path)
+
+    def _db(self, idx: int) -> _ShardDb:
+        db = self._dbs.get(idx)
+        if db is None:
+            with self._open_lock:
+                db = self._dbs.get(idx)
+                if db is None:
+                    path = os.path.join(self.directory, f"idem-{self.engine.shards[idx]}.db")
+                    db = self._dbs[idx] = _ShardDb(path, self._synchronous)
+        return db
+
+    def shard_for(self, user_id: str) -> str:
+        return self.engine.shards[self._home(user_id)]
+
+    # backend interface
+
+    def get(self, k: IdemKey) -> Optional[IdemEntry]:
+        # each map is only emptied after the next stage holds the row
+        hit = self._pending.get(k) or self._inflight.get(k) or self._logged.get(k)
+        if hit is not None:
+            return hit[0]
+        db = self._db(self._home(k[0]))
+        if k not in db.keys:
+            return None
+        with db.lock:
+            row = db.db.execute(
+                "SELECT ph, resp, ts FROM idem WHERE user_id = ? AND op = ? AND idem_key = ?", k
+            ).fetchone()
+        if row is None:
+            return None
+        return unpack_ph(row[0]), unpack_response(row[1]), row[2]
+
+    def put(self, k: IdemKey, entry: IdemEntry) -> None:
+        # normalized here so pending, the log and the shard files all return the same value
+        ph, resp, ts = entry
+        entry = (ph, normalize_response(resp), ts)
+        idx = self._home(k[0])
+        db = self._db(idx)
+        with self._cv:
+            if self._closed:
+                raise RuntimeError("backend is closed")
+            self._pending[k] = (entry, idx)
+            db.keys.add(k)
+            gen = self._gen
+            self._cv.notify_all()
+            if self.durable:
+                while self._flushed_gen < gen:
+                    self._cv.wait()
+
+    def expire(self, now: float, ttl_sec: int, budget: Optional[int] = None) -> int:
+        if budget is None:
+            return self._delete_expired(now - ttl_sec)
+        # per-call path: lookups already ignore expired rows, so just nudge the flusher now and then
+        if now - self._last_expire >= EXPIRE_EVERY_SEC:
+            self._last_expire = now
+            with self._cv:
+                self._expire_at = (now, ttl_sec)
+                self._cv.notify_all()
+        return 0
+
+    def __len__(self) -> int:
+        # rows in shard files plus rows not checkpointed yet (a re-recorded key may count twice)
+        n = len(self._pending) + len(self._inflight) + len(self._logged)
+        for db in list(self._dbs.values()):
+            with db.lock:
+                n += db.db.execute("SELECT COUNT(*) FROM idem").fetchone()[0]
+        return n
+
+    def flush(self) -> None:
+        # wait until everything put so far is in the log
+        with self._cv:
+            gen = self._gen if self._pending else self._gen - 1
+            self._cv.notify_all()
+            while self._flushed_gen < gen:
+                self._cv.wait()
+
+    def close(self) -> None:
+        with self._cv:
+            self._closed = True
+            self._cv.notify_all()
+        self._flusher.join()
+        os.close(self._log)
+        for db in self._dbs.values():
+            db.db.close()
+
+    def stats(self) -> dict:
+        return {
+            "group_commits": self.group_commits,
+            "rows_logged": self.rows_logged,
+            "rows_per_commit": self.rows_logged / self.group_commits if self.group_commits else 0.0,
+            "checkpoints": self.checkpoints,
+            "recovered": self.recovered,
+            "shard_files": len(self._dbs),
+        }
+
+    # log + checkpoint
+
+    def _recover(self) -> None:
+        # rows logged before a crash/restart that never reached their shard file
+        if not os.path.exists(self._log_path):
+            return
+        with open(self._log_path, "rb") as f:
+            for line in f:
+                try:
+                    user_id, op, idem_key, ph, resp, ts = json.loads(line)
+                except ValueError:
+                    break  # torn tail from a crash mid-append
+                k = (user_id, op, idem_key)
+                idx = self._home(user_id)
+                self._logged[k] = ((ph, resp, ts), idx)
+                self._db(idx).keys.add(k)
+        self.recovered = len(self._logged)
+        if self._logged:
+            self._checkpoint()
+        else:
+            os.truncate(self._log_path, 0)
+
+    def _append_log(self, batch: Dict[IdemKey, Tuple[IdemEntry, int]]) -> None:
+        data = "".join(
+            json.dumps([user_id, op, idem_key, ph, resp, ts], separators=(",", ":")) + "\n"
+            for (user_id, op, idem_key), ((ph, resp, ts), _) in batch.items()
+        ).encode("utf-8")
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self._log, view):]
+        if self.fsync:
+            os.fsync(self._log)
+        self.group_commits += 1
+        self.rows_logged += len(batch)
+
+    def _checkpoint(self) -> None:
+        # only the flusher appends to the log, so nothing new lands while this runs
+        by_shard: Dict[int, List[tuple]] = {}
+        for (user_id, op, idem_key), ((ph, resp, ts), idx) in self._logged.items():
+            by_shard.setdefault(idx, []).append(
+                (user_id, op, idem_key, pack_ph(ph), pack_response(resp), ts))
+        for idx, rows in by_shard.items():
+            db = self._db(idx)
+            with db.lock:
+                db.db.execute("BEGIN IMMEDIATE")
+                db.db.executemany("INSERT OR REPLACE INTO idem VALUES (?, ?, ?, ?, ?, ?)", rows)
+                db.db.execute("COMMIT")
+        # a crash before this point replays the log: INSERT OR REPLACE makes that harmless
+        os.truncate(self._log_path, 0)
+        with self._cv:
+            self._logged = {}
+        self.checkpoints += 1
+
+    def _flush_loop(self) -> None:
+        while True:
+            with self._cv:
+                while not self._pending and not self._closed and self._expire_at is None:
+                    if self._logged:
+                        left = self._logged_at + self.checkpoint_sec - time.time()
+                        if left <= 0:
+                            break
+                        self._cv.wait(left)
+                    else:
+                        self._cv.wait()
+                if self.commit_delay and self._pending and not self._closed:
+                    self._cv.wait(self.commit_delay)
+                batch = self._pending
+                self._pending = {}
+                self._inflight = batch
+                gen = self._gen
+                self._gen += 1
+                expire_at, self._expire_at = self._expire_at, None
+                closing = self._closed
+
+            if batch:
+                self._append_log(batch)
+            with self._cv:
+                if batch:
+                    if not self._logged:
+                        self._logged_at = time.time()
+                    self._logged.update(batch)
+                self._inflight = {}
+                self._flushed_gen = gen
+                self._cv.notify_all()
+
+            if self._logged and (closing or len(self._logged) >= self.checkpoint_rows
+                                 or time.time() - self._logged_at >= self.checkpoint_sec):
+                self._checkpoint()
+            if expire_at is not None:
+                self._delete_expired(expire_at[0] - expire_at[1])
+            if closing and not self._pending:
+                return
+
+    def _delete_expired(self, cutoff: float) -> int:
+        removed = 0
+        for db in list(self._dbs.values()):
+            with db.lock:
+                removed += db.db.execute("DELETE FROM idem WHERE ts < ?", (cutoff,)).rowcount
+        return removed
+
+# benchmark + restart check
+
+def run_writers(store: IdempotencyStore, writers: int, per_writer: int, tag: str) -> float:
+    resp = {"status": "ok", "op": "transfer", "home_shard": "shard-001"}
+    ph = payload_hash("payload")
+
+    def work(w: int):
+        for i in range(per_writer):
+            store.get_or_record(f"user-{w}-{i % 5000}", "transfer", f"{tag}-{w}-{i}", ph, lambda: resp, time.time())
+
+    threads = [threading.Thread(target=work, args=(w,)) for w in range(writers)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return writers * per_writer / (time.perf_counter() - t0)
+
+def main():
+    writers = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    per_writer = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000
+
+    print("\nDurable idempotency store (group-commit log + one SQLite file per HRW home shard)\n")
+    print(f"{'Backend':44} {'Writers':>8} {'Writes/sec':>12} {'Rows/commit':>12}")
+    print("-" * 80)
+
+    mem = IdempotencyStore(MemoryIdempotencyBackend())
+    print(f"{'memory (not durable)':44} {writers:>8} {run_writers(mem, writers, per_writer, 'm'):>12,.0f} {'-':>12}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "grouped")
+        runs = [
+            ("fsync per write (1 writer)", 1, dict(fsync=True), os.path.join(tmp, "single")),
+            ("group commit, fsync (power-loss safe)", writers, dict(fsync=True), os.path.join(tmp, "fsync")),
+            ("group commit, no fsync (crash safe)", writers, dict(), path),
+            ("write-behind (durable=False)", writers, dict(durable=False), os.path.join(tmp, "async")),
+        ]
+        for label, w, kwargs, directory in runs:
+            backend = SqliteIdempotencyBackend(directory, **kwargs)
+            n = min(per_writer, 300) if w == 1 else per_writer
+            rate = run_writers(IdempotencyStore(backend), w, n, "g")
+            backend.flush()
+            print(f"{label:44} {w:>8} {rate:>12,.0f} {backend.stats()['rows_per_commit']:>12.1f}")
+            backend.close()
+
+        # restart: a new backend on the same directory must replay what the old one recorded
+        reopened = IdempotencyStore(SqliteIdempotencyBackend(path))
+        ph = payload_hash("payload")
+        sample = [(w, i) for w in range(0, writers, max(1, writers // 8)) for i in range(0, per_writer, max(1, per_writer // 50))]
+        replays = sum(
+            1 for w, i in sample
+            if reopened.get_or_record(f"user-{w}-{i % 5000}", "transfer", f"g-{w}-{i}", ph, lambda: None, time.time())[2]
+            == "ALLOW: idempotent replay (cached response)"
+        )
+        rows = len(reopened)
+        files = reopened.backend.stats()["shard_files"]
+        reopened.close()
+        size = sum(os.path.getsize(p) for p in glob.glob(os.path.join(path, "idem-*")))
+        print(f"\nAfter restart: {replays}/{len(sample)} sampled keys replayed from disk | "
+              f"{rows:,} rows in {files} shard files | {size / max(rows, 1):.0f} bytes/row on disk")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+# hrw_bench_v2.py
+import sys
+import time
+from common_infra_v2 import ACTIVE_SHARDS, HrwEngine, hrw_shard_for_user
+
+def rate(fn, users) -> float:
+    t0 = time.perf_counter()
+    fn(users)
+    return len(users) / max(time.perf_counter() - t0, 1e-9)
+
+def main():
+    scalar_n = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    batch_n = int(sys.argv[2]) if len(sys.argv) > 2 else 2_000_000
+
+    legacy = HrwEngine(ACTIVE_SHARDS, "legacy")
+    fast = HrwEngine(ACTIVE_SHARDS, "fast")
+
+    users = [f"user-{i}" for i in range(scalar_n)]
+    ref = [hrw_shard_for_user(u, ACTIVE_SHARDS) for u in users]
+    same = sum(1 for u, r in zip(users, ref) if legacy.shard_for(u) == r)
+
+    print("\nHRW lookup benchmark\n")
+    print(f"Shards: {len(ACTIVE_SHARDS)} | scalar users: {scalar_n:,} | batch users: {batch_n:,}")
+    print(f"Legacy engine matches hrw_shard_for_user: {same:,}/{scalar_n:,}\n")
+
+    rows = [
+        ("hrw_shard_for_user (reference)", lambda us: [hrw_shard_for_user(u, ACTIVE_SHARDS) for u in us], users),
+        ("HrwEngine legacy, scalar", lambda us: [legacy.index_for(u) for u in us], users),
+        ("HrwEngine fast, scalar", lambda us: [fast.index_for(u) for u in us], users),
+    ]
+    big = [f"user-{i}" for i in range(batch_n)]
+    rows.append(("HrwEngine fast, NumPy batch", fast.indices_for, big))
+
+    base = None
+    print(f"{'Path':34} {'Lookups/sec':>14} {'Speedup':>9}")
+    print("-" * 60)
+    for name, fn, us in rows:
+        r = rate(fn, us)
+        base = base or r
+        print(f"{name:34} {r:>14,.0f} {r / base:>8.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+# latency_model_v2.py
+# Stochastic latency per route, replacing the fixed-ms dictionary of "latency analysis(1).py".
+# - every hop is a distribution: lognormal fitted to (p50, p99), or resampled from measured values
+# - DNS cache, TLS resumption and read-cache hit ratios are configurable
+# - the route mix (read-local / home-read / home-write, same or cross region, queued, denied) comes
+#   from Router.route_read_many / route_write_many over a sampled request stream
+# - dependency calls follow REQUIRES: auth first, the rest in parallel; an attempt that errors or
+#   runs past the timeout is retried with jittered backoff, and a dependency that stays down after
+#   the retries is judged by deps_ok_for (Tier-2 fails closed, Tier-1 may degrade)
+# - every route is sampled as whole arrays (no per-request Python), millions of samples per route
+import math
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from common_infra_v2 import (
+    ACTIVE_SHARDS, DEP_FLAGS, REQUIRES, CellHealth, Dependencies, PlacementService, Router, User, deps_from_mask,
+    deps_ok_for,
+)
+from blast_radius_mc_v2 import OP_MIX, make_placement
+from blast_radius_v2 import REGION_DISTRIBUTION
+
+LATENCY_SAMPLES = 1_000_000    # samples per route
+ROUTE_REQUESTS = 200_000       # requests pushed through the Router to measure the route mix
+AWAY_SHARE = 0.05              # requests served outside the user's residency region (travel, failover)
+LATENCY_QUANTILES = (0.5, 0.95, 0.99, 0.999)
+Z99 = 2.3263478740408408       # standard normal 99th percentile
+
+READ_OPS = {"view_public", "view_profile_basic", "view_pii", "export_data"}
+ROUTES = ("read_local", "read_home_local", "read_home_remote", "write_home_local", "write_home_remote",
+          "write_queued", "denied")
+
+# totals of the matching scenarios in "latency analysis(1).py"
+STATIC_MS = {"read_local": 70, "read_home_local": 113, "read_home_remote": 228, "write_home_remote": 228}
+
+@dataclass(frozen=True)
+class Hop:
+    """One hop's latency: lognormal through (p50, p99), or resampled from measured values."""
+    p50_ms: float = 0.0
+    p99_ms: float = 0.0
+    samples: Optional[Tuple[float, ...]] = None
+
+    def draw(self, rng, n: int) -> "np.ndarray":
+        if self.samples is not None:
+            return rng.choice(np.asarray(self.samples, dtype=np.float64), n)
+        if self.p99_ms <= self.p50_ms or self.p50_ms <= 0:
+            return np.full(n, float(self.p50_ms))
+        return rng.lognormal(math.log(self.p50_ms), math.log(self.p99_ms / self.p50_ms) / Z99, n)
+
+def _hops() -> Dict[str, Hop]:
+    # p50s from "latency analysis(1).py"; p99s are the tails it had no way to express
+    return {
+        "DNS": Hop(20, 120),
+        "TLS": Hop(30, 90),
+        "TLS_Resumed": Hop(8, 25),
+        "API_Gateway": Hop(10, 40),
+        "Cache_Hit": Hop(2, 8),
+        "Cache_Miss": Hop(5, 20),
+        "Storage_Read": Hop(40, 200),
+        "Storage_Write": Hop(60, 300),
+        "Cross_Region_Network": Hop(120, 260),
+        "Queue_Append": Hop(1, 5),
+    }
+
+def _dep_hops() -> Dict[str, Hop]:
+    return {"auth": Hop(8, 40), "policy": Hop(5, 25), "risk": Hop(15, 90), "audit": Hop(6, 30),
+            "kms": Hop(10, 60), "placement": Hop(3, 12)}
+
+@dataclass
+class LatencyConfig:
+    hops: Dict[str, Hop] = field(default_factory=_hops)
+    dep_hops: Dict[str, Hop] = field(default_factory=_dep_hops)
+    dep_error: Dict[str, float] = field(default_factory=lambda: {   # error rate per attempt
+        "auth": 0.001, "policy": 0.001, "risk": 0.005, "audit": 0.001, "kms": 0.001, "placement": 0.001})
+    dep_timeout_ms: float = 100.0   # an attempt slower than this is abandoned and retried
+    dep_retries: int = 2
+    dep_backoff_ms: float = 20.0    # full jitter: uniform(0, backoff * 2^attempt)
+    dns_hit: float = 0.8            # resolver/client DNS cache
+    tls_resumed: float = 0.7        # TLS session resumption
+    cache_hit: float = 0.85         # regional read cache
+
+def allow_table(ops: Sequence[str]) -> "np.ndarray":
+    """(op, dependency-health mask) -> deps_ok_for allows it."""
+    return np.array([[deps_ok_for(op, deps_from_mask(m))[0] for m in range(1 << len(DEP_FLAGS))] for op in ops])
+
+def dep_call(rng, n: int, hop: Hop, error: float, cfg: LatencyConfig) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+    """n calls with timeout + retries -> (latency ms, still failed after retries, attempts)."""
+    lat = np.zeros(n)
+    attempts = np.zeros(n, dtype=np.int32)
+    pending = np.arange(n)
+    for attempt in range(cfg.dep_retries + 1):
+        if not len(pending):
+            break
+        attempts[pending] += 1
+        took = hop.draw(rng, len(pending))
+        failed = (rng.random(len(pending)) < error) | (took > cfg.dep_timeout_ms)
+        lat[pending] += np.where(failed, cfg.dep_timeout_ms, took)
+        pending = pending[failed]
+        if attempt < cfg.dep_retries and len(pending):
+            lat[pending] += rng.random(len(pending)) * cfg.dep_backoff_ms * (1 << attempt)
+    failed_all = np.zeros(n, dtype=bool)
+    failed_all[pending] = True
+    return lat, failed_all, attempts
+
+def sample_route(route: str, ops: Dict[str, int], n: int, cfg: LatencyConfig, rng) -> Dict[str, "np.ndarray"]:
+    """n requests down one route, ops drawn by their share of it -> latency, allowed, dependency attempts."""
+    names = sorted(ops)
+    op_idx = rng.choice(len(names), n, p=np.array([ops[o] for o in names], dtype=np.float64) / sum(ops.values()))
+    h = cfg.hops
+
+    lat = np.where(rng.random(n) < cfg.dns_hit, 0.0, h["DNS"].draw(rng, n))
+    lat += np.where(rng.random(n) < cfg.tls_resumed, h["TLS_Resumed"].draw(rng, n), h["TLS"].draw(rng, n))
+    lat += h["API_Gateway"].draw(rng, n)
+    if route == "denied":
+        return {"latency": lat, "allowed": np.zeros(n, dtype=bool), "attempts": np.zeros(n, dtype=np.int32)}
+
+    # dependencies: auth, then the others in parallel (skipped when auth failed)
+    required = np.array([[dep in REQUIRES.get(op, {"auth", "policy"}) for dep in DEP_FLAGS] for op in names])
+    healthy = np.full(n, (1 << len(DEP_FLAGS)) - 1, dtype=np.int64)
+    attempts = np.zeros(n, dtype=np.int32)
+    parallel = np.zeros(n)
+    auth_failed = np.zeros(n, dtype=bool)
+    for bit, dep in enumerate(DEP_FLAGS):
+        rows = np.flatnonzero(required[op_idx, bit] & ~auth_failed)
+        if not len(rows):
+            continue
+        d_lat, d_failed, d_att = dep_call(rng, len(rows), cfg.dep_hops[dep], cfg.dep_error.get(dep, 0.0), cfg)
+        attempts[rows] += d_att
+        healthy[rows[d_failed]] &= ~(1 << bit)
+        if dep == "auth":
+            lat[rows] += d_lat
+            auth_failed[rows[d_failed]] = True
+        else:
+            parallel[rows] = np.maximum(parallel[rows], d_lat)
+    lat += parallel
+    allowed = allow_table(names)[op_idx, healthy]
+
+    body = np.zeros(n)
+    if route.startswith("read"):
+        hit = rng.random(n) < cfg.cache_hit
+        body += np.where(hit, h["Cache_Hit"].draw(rng, n), h["Cache_Miss"].draw(rng, n) + h["Storage_Read"].draw(rng, n))
+    elif route == "write_queued":
+        body += h["Queue_Append"].draw(rng, n)
+    else:
+        body += h["Storage_Write"].draw(rng, n)
+    if route.endswith("_remote"):
+        body += h["Cross_Region_Network"].draw(rng, n)
+    lat += np.where(allowed, body, 0.0)
+    return {"latency": lat, "allowed": allowed, "attempts": attempts}
+
+def route_mix(router: Router, users: Sequence[User], requests: int = ROUTE_REQUESTS, away: float = AWAY_SHARE,
+              op_mix: Dict[str, float] = OP_MIX, deps: Optional[Dependencies] = None, health=None,
+              seed: int = 11) -> Dict[str, Counter]:
+    """Route -> op counts, from the Router's batched decisions over a sampled request stream."""
+    rng = random.Random(seed)
+    deps = deps or Dependencies()
+    health = health or CellHealth(cell_ok={})
+    regions = sorted({u.residency for u in users})
+    ops, weights = list(op_mix), list(op_mix.values())
+    batches: Dict[Tuple[str, str], List[User]] = defaultdict(list)
+    for _ in range(requests):
+        user = users[rng.randrange(len(users))]
+        region = user.residency
+        if rng.random() < away and len(regions) > 1:
+            region = rng.choice([r for r in regions if r != user.residency])
+        batches[(rng.choices(ops, weights)[0], region)].append(user)
+
+    mix: Dict[str, Counter] = defaultdict(Counter)
+    for (op, region), batch in batches.items():
+        if op in READ_OPS:
+            for (shard, _), g in router.route_read_many(batch, op, region, deps).items():
+                if g.decision != "ALLOW":
+                    route = "denied"
+                elif shard is None:
+                    route = "read_local"
+                else:
+                    route = "read_home_local" if g.region == region else "read_home_remote"
+                mix[route][op] += len(g.users)
+        else:
+            for g in router.route_write_many(batch, op, deps, health).values():
+                if g.decision == "WRITE_HOME":
+                    route = "write_home_local" if g.region == region else "write_home_remote"
+                else:
+                    route = {"QUEUE": "write_queued"}.get(g.decision, "denied")
+                mix[route][op] += len(g.users)
+    return dict(mix)
+
+def weighted_quantiles(values: "np.ndarray", weights: "np.ndarray", qs: Sequence[float]) -> List[float]:
+    order = np.argsort(values)
+    cum = np.cumsum(weights[order])
+    return [float(values[order][min(np.searchsorted(cum, q * cum[-1]), len(cum) - 1)]) for q in qs]
+
+def simulate_routes(mix: Dict[str, Counter], samples: int = LATENCY_SAMPLES, cfg: Optional[LatencyConfig] = None,
+                    seed: int = 5) -> Dict[str, dict]:
+    """Per route (and "all", weighted by the mix): share, quantiles, mean, error rate, dependency attempts."""
+    cfg = cfg or LatencyConfig()
+    rng = np.random.default_rng(seed)
+    total = sum(sum(c.values()) for c in mix.values())
+    out = {}
+    lats, wts, errs = [], [], []
+    for route in ROUTES:
+        if route not in mix:
+            continue
+        share = sum(mix[route].values()) / total
+        r = sample_route(route, mix[route], samples, cfg, rng)
+        lat = r["latency"]
+        out[route] = {
+            "share": share,
+            "q": dict(zip(LATENCY_QUANTILES, np.quantile(lat, LATENCY_QUANTILES).tolist())),
+            "mean": float(lat.mean()),
+            "errors": float(1.0 - r["allowed"].mean()),
+            "attempts": float(r["attempts"].mean()),
+        }
+        lats.append(lat)
+        wts.append(np.full(samples, share / samples))
+        errs.append(out[route]["errors"] * share)
+    lat, w = np.concatenate(lats), np.concatenate(wts)
+    out["all"] = {
+        "share": 1.0,
+        "q": dict(zip(LATENCY_QUANTILES, weighted_quantiles(lat, w, LATENCY_QUANTILES))),
+        "mean": float((lat * w).sum() / w.sum()),
+        "errors": float(sum(errs)),
+        "attempts": float(sum(out[r]["attempts"] * out[r]["share"] for r in ROUTES if r in out)),
+    }
+    return out
+
+def main():
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else LATENCY_SAMPLES
+    n_users = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+    cache_hit = float(sys.argv[3]) if len(sys.argv) > 3 else LatencyConfig().cache_hit
+
+    svc = PlacementService(make_placement(ACTIVE_SHARDS, 2))
+    router = Router(svc, hash_mode="fast")
+    rng = random.Random(3)
+    regions, shares = list(REGION_DISTRIBUTION), list(REGION_DISTRIBUTION.values())
+    users = [User(f"user-{i}", rng.choices(regions, shares)[0]) for i in range(n_users)]
+    mix = route_mix(router, users)
+
+    t0 = time.perf_counter()
+    res = simulate_routes(mix, samples, LatencyConfig(cache_hit=cache_hit))
+    elapsed = time.perf_counter() - t0
+
+    print("\nLatency model (per-hop distributions, Router route mix)\n")
+    print(f"Samples: {samples:,}/route ({samples * (len(res) - 1) / elapsed / 1e6:.1f}M/s) | route mix from "
+          f"{ROUTE_REQUESTS:,} routed requests, {AWAY_SHARE:.0%} served away from home | cache hit {cache_hit:.0%}\n")
+    head = "".join(f"{'p' + format(q * 100, 'g'):>9}" for q in LATENCY_QUANTILES)
+    print(f"{'Route':18} {'Share':>7} {'Static':>7} {'Mean':>7}{head} {'Errors':>8} {'Dep calls':>10}")
+    print("-" * 100)
+    for route in [r for r in ROUTES if r in res] + ["all"]:
+        st = res[route]
+        static = f"{STATIC_MS[route]}" if route in STATIC_MS else "-"
+        cols = "".join(f"{v:>9.1f}" for v in st["q"].values())
+        print(f"{route:18} {st['share']:>7.2%} {static:>7} {st['mean']:>7.1f}{cols} {st['errors']:>8.3%} "
+              f"{st['attempts']:>10.2f}")
+    print("\nms; Static = the fixed total in latency analysis(1).py; Dep calls = dependency attempts per request")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# limiter_bench_v2.py
+import gc
+import multiprocessing
+import os
+import random
+import sys
+import time
+from common_infra_v2 import CoarseProtections, ShardedCoarseProtections, HIGH_RISK_WINDOW_SEC
+
+INSERT_SPAN_SEC = 10.0     # the first check of every user lands inside this span
+STEADY_CHECKS = 2_000_000
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def make_limiter(name: str):
+    if name.endswith("-sharded"):
+        return ShardedCoarseProtections(backend=name[:-len("-sharded")])
+    return CoarseProtections(name)
+
+def run_one(name: str, n: int) -> dict:
+    # keys and the replay trace exist before the baseline, so the delta is limiter state only
+    keys = [f"user-{i}" for i in range(n)]
+    rng = random.Random(7)
+    steady = [keys[rng.randrange(n)] for _ in range(STEADY_CHECKS)]
+    gc.collect()
+    base = rss_bytes()
+
+    cp = make_limiter(name)
+    step = INSERT_SPAN_SEC / n
+    t0 = time.perf_counter()
+    for i, k in enumerate(keys):
+        cp.check(k, "transfer" if i % 10 == 0 else "low_value_action", i * step)
+    insert_sec = time.perf_counter() - t0
+    mem = rss_bytes() - base
+
+    now = INSERT_SPAN_SEC
+    t0 = time.perf_counter()
+    for k in steady:
+        cp.check(k, "low_value_action", now)
+    steady_sec = time.perf_counter() - t0
+
+    before = cp.tracked_keys()
+    cp.expire(INSERT_SPAN_SEC + HIGH_RISK_WINDOW_SEC + 1)
+    return {
+        "name": name, "users": n, "mem": mem,
+        "insert_rate": n / insert_sec, "steady_rate": STEADY_CHECKS / steady_sec,
+        "keys_before": before, "keys_after": cp.tracked_keys(),
+    }
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000
+    # per-user deques need ~0.8 KB each: 10M of them doesn't fit a small box, so project from fewer
+    deque_users = int(sys.argv[2]) if len(sys.argv) > 2 else min(users, 1_000_000)
+
+    print("\nCoarse rate limiter benchmark\n")
+    print(f"Users: {users:,} (deque backend: {deque_users:,}) | steady-state checks: {STEADY_CHECKS:,}\n")
+    at = f"MB @{users / 1e6:g}M"
+    print(f"{'Backend':14} {'Users':>11} {'MB':>8} {'B/user':>7} {at:>9} {'Insert/s':>11} {'Steady/s':>11} {'Keys: live -> idle':>22}")
+    print("-" * 100)
+
+    ctx = multiprocessing.get_context("fork") if hasattr(os, "fork") else multiprocessing.get_context()
+    for name, n in (("deque", deque_users), ("log", users), ("log-sharded", users), ("gcra", users)):
+        # one fresh process per backend so RSS deltas don't bleed into each other
+        with ctx.Pool(1) as pool:
+            r = pool.apply(run_one, (name, n))
+        per_user = r["mem"] / n
+        print(f"{name:14} {n:>11,} {r['mem'] / 1e6:>8.1f} {per_user:>7.0f} {per_user * users / 1e6:>9.0f} "
+              f"{r['insert_rate']:>11,.0f} {r['steady_rate']:>11,.0f} "
+              f"{format(r['keys_before'], ',') + ' -> ' + format(r['keys_after'], ','):>22}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+# loadgen_v2.py
+# Load generator and regression benchmark for degraded_mode_v2.Evaluator.write.
+# - requests: Zipf-distributed users, op mix weighted by OP_TIER tier, a share of idempotent retries
+# - capacity: closed loop, as fast as the stack goes; then open loop at a target rate, with latency
+#   measured from each request's scheduled start (a stall delays everything queued behind it)
+# - a failure script flips dependencies and cells mid-run and drains the WriteQueue on recovery
+# - per-component time: rate limiting, routing, idempotency and queueing are wrapped with timers
+# - "save" writes loadgen_baseline_v2.json; "check" (default) compares against it and exits 1 on a
+#   regression beyond REGRESSION_TOLERANCE
+import hashlib
+import json
+import os
+import platform
+import re
+import sys
+import time
+from array import array
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from common_infra_v2 import OP_TIER, CellHealth, Dependencies, PlacementService, Router, User
+from degraded_mode_v2 import Evaluator, make_demo_placement
+
+LOADGEN_RATE = 5_000            # open-loop target, requests/sec
+LOADGEN_DURATION_SEC = 10.0
+LOADGEN_USERS = 100_000
+CAPACITY_REQUESTS = 50_000      # closed-loop requests used to measure capacity
+CAPACITY_REPEATS = 3            # closed-loop runs; the fastest (after calibration) is kept
+ZIPF_S = 1.1
+RETRY_SHARE = 0.05              # requests that resend the user's previous idempotency key
+TIER_WEIGHT = {"TIER_0": 0.50, "TIER_1": 0.35, "TIER_2": 0.15}  # split evenly across the ops of a tier
+REGRESSION_TOLERANCE = 0.25       # after calibration, run-to-run noise here is ~15%
+CALIBRATION_REPEATS = 5
+GATED_METRICS = ("capacity_rps", "service_us.p99")
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "loadgen_baseline_v2.json")
+COMPONENTS = ("rate_limit", "routing", "idempotency", "queue")
+
+@dataclass(frozen=True)
+class Request:
+    user: User
+    op: str
+    payload: str
+    idem_key: str
+
+@dataclass(frozen=True)
+class FailureEvent:
+    at_sec: float      # offset from the start of the run
+    kind: str          # "dep" | "cell" | "drain"
+    name: str = ""     # dependency flag (e.g. "risk") or cell
+    ok: bool = True
+
+def default_script(duration: float) -> List[FailureEvent]:
+    d = duration
+    return [
+        FailureEvent(0.20 * d, "dep", "risk", False),
+        FailureEvent(0.35 * d, "dep", "risk", True),
+        FailureEvent(0.45 * d, "cell", "us-cell-1", False),
+        FailureEvent(0.65 * d, "cell", "us-cell-1", True),
+        FailureEvent(0.65 * d, "drain"),
+        FailureEvent(0.80 * d, "dep", "policy", False),
+        FailureEvent(0.90 * d, "dep", "policy", True),
+    ]
+
+def op_mix() -> Dict[str, float]:
+    tiers = Counter(OP_TIER.values())
+    return {op: TIER_WEIGHT.get(tier, 0.0) / tiers[tier] for op, tier in OP_TIER.items()}
+
+def make_requests(n: int, users: int = LOADGEN_USERS, seed: int = 9) -> List[Request]:
+    """Zipf users (rank 1 hottest), tier-weighted ops; built up front so generation isn't timed."""
+    rng = np.random.default_rng(seed)
+    p = np.arange(1, users + 1, dtype=np.float64) ** -ZIPF_S
+    ranks = rng.choice(users, n, p=p / p.sum())
+    mix = op_mix()
+    ops = list(mix)
+    op_idx = rng.choice(len(ops), n, p=np.array(list(mix.values())) / sum(mix.values()))
+    retry = rng.random(n) < RETRY_SHARE
+    regions = ("us", "eu")
+    people: Dict[int, User] = {}
+    last: Dict[int, Request] = {}
+    out = []
+    for i, (r, o, again) in enumerate(zip(ranks.tolist(), op_idx.tolist(), retry.tolist())):
+        if again and r in last:
+            out.append(last[r])
+            continue
+        user = people.get(r)
+        if user is None:
+            user = people[r] = User(f"user-{r}", regions[r % 2])
+        req = last[r] = Request(user, ops[o], f'{{"n":{i}}}', f"k-{i}")
+        out.append(req)
+    return out
+
+class ComponentTimer:
+    """Wraps a method on an instance so every call adds its wall time to totals[name]."""
+    def __init__(self):
+        self.totals: Dict[str, float] = {name: 0.0 for name in COMPONENTS}
+        self.totals["drain"] = 0.0
+
+    def wrap(self, obj, method: str, name: str) -> None:
+        fn = getattr(obj, method)
+        totals, clock = self.totals, time.perf_counter
+
+        def timed(*args, **kwargs):
+            t0 = clock()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                totals[name] += clock() - t0
+
+        setattr(obj, method, timed)
+
+    def reset(self) -> None:
+        for name in self.totals:
+            self.totals[name] = 0.0
+
+def make_evaluator() -> Tuple[Evaluator, ComponentTimer]:
+    ev = Evaluator(Router(PlacementService(make_demo_placement())))
+    timer = ComponentTimer()
+    timer.wrap(ev.coarse, "check", "rate_limit")
+    timer.wrap(ev.router, "route_write", "routing")
+    timer.wrap(ev.idem, "get_or_record", "idempotency")
+    timer.wrap(ev.queue, "enqueue", "queue")
+    return ev, timer
+
+_PAREN = re.compile(r" \([^)]*\)")
+
+def outcome(ok: bool, msg: str) -> str:
+    if ok:
+        return "queued" if msg.endswith("QUEUED") else "executed"
+    # "DENY: home cell down (us-cell-1) for Tier-2" -> "DENY: home cell down for Tier-2"
+    return _PAREN.sub("", msg)
+
+def _apply(event: FailureEvent, ev: Evaluator, deps: Dependencies, health: CellHealth, timer: ComponentTimer) -> None:
+    if event.kind == "dep":
+        setattr(deps, f"{event.name}_ok", event.ok)
+    elif event.kind == "cell":
+        health.cell_ok[event.name] = event.ok
+    elif event.kind == "drain":
+        t0 = time.perf_counter()
+        for uid in ev.queue.users():
+            ev.drain(uid)
+        timer.totals["drain"] += time.perf_counter() - t0
+
+def run(ev: Evaluator, timer: ComponentTimer, reqs: Sequence[Request], rate: Optional[float] = None,
+        script: Sequence[FailureEvent] = (), clock: Callable[[], float] = time.perf_counter,
+        sleep: Callable[[float], None] = time.sleep) -> dict:
+    """
+    rate=None: closed loop (next request when the last returns). Otherwise open loop: request i is
+    due at i / rate and its latency counts from then, so time spent behind schedule is included.
+    """
+    deps = Dependencies()
+    health = CellHealth(cell_ok={})
+    events = sorted(script, key=lambda e: e.at_sec)
+    timer.reset()
+    latency = array("d")
+    service = array("d")
+    outcomes: Counter = Counter()
+    nxt = 0
+    t0 = clock()
+    for i, req in enumerate(reqs):
+        due = t0 + i / rate if rate else clock()
+        now = clock()
+        if now < due:
+            sleep(due - now)
+        offset = (due if rate else clock()) - t0
+        while nxt < len(events) and events[nxt].at_sec <= offset:
+            _apply(events[nxt], ev, deps, health, timer)
+            nxt += 1
+        start = clock()
+        ok, msg = ev.write(req.user, req.op, req.payload, req.idem_key, deps, health)
+        end = clock()
+        service.append(end - start)
+        latency.append(end - (due if rate else start))
+        outcomes[outcome(ok, msg)] += 1
+    elapsed = clock() - t0
+    n = len(reqs)
+    comp = {name: total / n for name, total in timer.totals.items() if name != "drain"}
+    comp["other"] = max(0.0, sum(service) / n - sum(comp.values()))
+    return {
+        "requests": n, "elapsed": elapsed, "throughput": n / elapsed,
+        "latency": np.frombuffer(latency), "service": np.frombuffer(service),
+        "component": comp, "drain_sec": timer.totals["drain"], "outcomes": outcomes,
+    }
+
+def percentiles(x: "np.ndarray") -> Dict[str, float]:
+    q = np.quantile(x, (0.5, 0.9, 0.99, 0.999))
+    return {"p50": float(q[0]), "p90": float(q[1]), "p99": float(q[2]), "p99.9": float(q[3]), "max": float(x.max())}
+
+def histogram(x: "np.ndarray", width: int = 40) -> List[str]:
+    # power-of-two microsecond buckets
+    us = np.maximum(x * 1e6, 1.0)
+    b = np.floor(np.log2(us)).astype(int)
+    counts = np.bincount(b - b.min())
+    top = counts.max()
+    lines = []
+    for i, c in enumerate(counts):
+        lo = 1 << (b.min() + i)
+        lines.append(f"{_fmt_us(lo):>8} - {_fmt_us(lo * 2):<8} {c:>9,} {'#' * max(1 if c else 0, round(c / top * width))}")
+    return lines
+
+def _fmt_us(us: float) -> str:
+    return f"{us / 1e6:.3g}s" if us >= 1e6 else f"{us / 1e3:.3g}ms" if us >= 1e3 else f"{us:.3g}us"
+
+def calibrate(repeats: int = CALIBRATION_REPEATS) -> float:
+    """Seconds for a fixed hash + dict workload (best of N): how fast this machine is right now."""
+    best = float("inf")
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        d = {}
+        for i in range(20_000):
+            d[hashlib.sha256(f"user-{i}".encode()).digest()[:8]] = i
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def summary(capacity: dict, open_loop: dict, rate: float, calibration: float) -> dict:
+    return {
+        "calibration_sec": calibration,
+        "capacity_rps": capacity["throughput"],
+        "service_us": {k: v * 1e6 for k, v in percentiles(capacity["service"]).items()},
+        "component_us": {k: v * 1e6 for k, v in capacity["component"].items()},
+        "open_loop": {"rate": rate, "throughput": open_loop["throughput"],
+                      "latency_us": {k: v * 1e6 for k, v in percentiles(open_loop["latency"]).items()}},
+        "python": platform.python_version(),
+        "machine": f"{platform.machine()} x{os.cpu_count()}",
+    }
+
+def compare(current: dict, baseline: dict, tolerance: float = REGRESSION_TOLERANCE) -> List[Tuple[str, float, float, Optional[bool]]]:
+    """
+    (metric, expected, current, regressed) for capacity, service p50/p99 and per-component time. Expected
+    values are the baseline scaled by the calibration ratio, so a slower machine (or a noisy neighbour)
+    isn't reported as a regression. Only GATED_METRICS are judged (regressed is None for the rest): the
+    p50 and the 1-3us components swing by 30%+ on noise alone and are there to say where time went.
+    """
+    speed = current["calibration_sec"] / baseline["calibration_sec"]
+    rows = [("capacity_rps", baseline["capacity_rps"] / speed, current["capacity_rps"])]
+    rows += [(f"service_us.{k}", baseline["service_us"][k] * speed, current["service_us"][k]) for k in ("p50", "p99")]
+    rows += [(f"component_us.{k}", v * speed, current["component_us"].get(k, 0.0))
+             for k, v in baseline["component_us"].items()]
+    out = []
+    for name, expect, cur in rows:
+        if name not in GATED_METRICS:
+            out.append((name, expect, cur, None))
+        elif name == "capacity_rps":
+            out.append((name, expect, cur, cur < expect * (1 - tolerance)))
+        else:
+            out.append((name, expect, cur, cur > expect * (1 + tolerance)))
+    return out
+
+def main():
+    rate = float(sys.argv[1]) if len(sys.argv) > 1 else LOADGEN_RATE
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else LOADGEN_DURATION_SEC
+    mode = sys.argv[3] if len(sys.argv) > 3 else "check"
+    if mode not in ("check", "save"):
+        raise SystemExit("mode must be 'check' or 'save'")
+
+    reqs = make_requests(CAPACITY_REQUESTS + int(rate * duration))
+    script = default_script(duration)
+    # calibrate next to each closed-loop run: this machine's speed drifts between runs
+    capacity, calibration = max(((run(*make_evaluator(), reqs[:CAPACITY_REQUESTS]), calibrate())
+                                 for _ in range(CAPACITY_REPEATS)), key=lambda rc: rc[0]["throughput"] * rc[1])
+    ev, timer = make_evaluator()
+    open_loop = run(ev, timer, reqs[CAPACITY_REQUESTS:], rate, script)
+
+    print("\nEvaluator load test (degraded_mode_v2)\n")
+    print(f"Users: {LOADGEN_USERS:,} Zipf s={ZIPF_S} | ops: OP_TIER weighted {TIER_WEIGHT} | "
+          f"{RETRY_SHARE:.0%} idempotent retries")
+    print(f"Closed loop: {capacity['requests']:,} requests, best of {CAPACITY_REPEATS} -> "
+          f"{capacity['throughput']:,.0f} decisions/s")
+    print(f"Open loop:   {rate:,.0f}/s target for {duration:g}s -> {open_loop['throughput']:,.0f}/s achieved\n")
+
+    print(f"{'Component (us/request)':24} {'closed':>8} {'share':>7} {'open':>8} {'share':>7}")
+    closed_total, open_total = sum(capacity["component"].values()), sum(open_loop["component"].values())
+    for name, v in capacity["component"].items():
+        o = open_loop["component"][name]
+        print(f"{name:24} {v * 1e6:>8.2f} {v / closed_total:>7.1%} {o * 1e6:>8.2f} {o / open_total:>7.1%}")
+
+    print(f"\n{'Latency':22} {'p50':>9} {'p90':>9} {'p99':>9} {'p99.9':>9} {'max':>9}")
+    for name, x in (("service (closed loop)", capacity["service"]), ("open loop from due", open_loop["latency"])):
+        st = percentiles(x)
+        print(f"{name:22} " + " ".join(f"{_fmt_us(v * 1e6):>9}" for v in st.values()))
+
+    print("\nOpen-loop latency histogram")
+    for line in histogram(open_loop["latency"]):
+        print("  " + line)
+
+    print("\nFailure script: " + ", ".join(
+        f"{e.at_sec:g}s drain queue" if e.kind == "drain" else f"{e.at_sec:g}s {e.name} {'up' if e.ok else 'DOWN'}"
+        for e in script))
+    print(f"Queue drain on recovery: {open_loop['drain_sec'] * 1e3:.1f} ms")
+    print(f"\n{'Outcome (open loop)':52} {'requests':>9}")
+    for name, c in open_loop["outcomes"].most_common():
+        print(f"{name[:52]:52} {c:>9,}")
+
+    current = summary(capacity, open_loop, rate, calibration)
+    if mode == "save":
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to {os.path.basename(BASELINE_FILE)}")
+        return
+    if not os.path.exists(BASELINE_FILE):
+        print(f"\nNo baseline yet: run with mode 'save' to create {os.path.basename(BASELINE_FILE)}")
+        return
+    with open(BASELINE_FILE) as f:
+        baseline = json.load(f)
+    rows = compare(current, baseline)
+    print(f"\nAgainst baseline ({baseline['machine']}, Python {baseline['python']}; tolerance {REGRESSION_TOLERANCE:.0%}; "
+          f"machine speed x{baseline['calibration_sec'] / calibration:.2f} of baseline)")
+    print(f"{'Metric':26} {'expected':>10} {'current':>10} {'change':>8}")
+    for name, b, c, bad in rows:
+        print(f"{name:26} {b:>10.2f} {c:>10.2f} {(c / b - 1) if b else 0.0:>+8.1%}{'  REGRESSION' if bad else '' if bad is not None else '  (info)'}")
+    if any(bad for *_, bad in rows):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
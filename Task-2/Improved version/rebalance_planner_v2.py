@@ -0,0 +1,478 @@
+# rebalance_planner_v2.py
+# Shard-set growth (64 -> 256), reweighting and cell evacuation as a sequence of placement versions.
+# - HRW changes are ramped through weights: new shards join at weight 0 and ramp up, removed
+#   shards ramp down to 0 before they leave the set, so each version moves a bounded slice of users
+# - shards whose weights ramp together keep their relative order, so every user's best shard per
+#   group is fixed; a user moves at most once per ramp and the plan moves what a direct switch would
+# - who moves is computed exactly for every user in one vectorized pass (fast HRW): per weight
+#   group, the winning shard and its score; every version is then an argmax over groups
+# - order: grow, then shrink, then evacuate (new shards absorb most of a cell's users first,
+#   so fewer bytes are left to copy out of it)
+# - transfers inside a version run at most one outgoing and one incoming copy per cell at a time,
+#   busiest cells first; bound_sec (busiest cell's bytes / bandwidth) is the floor for any schedule
+# Fast-mode HRW only: legacy sha256 scoring has no vectorized form, so plan_rebalance refuses
+# hash_mode="legacy" (the Router default) instead of planning moves that router would not make.
+import heapq
+import math
+import os
+import sys
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from multiprocessing import get_context
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from common_infra_v2 import (
+    ACTIVE_SHARDS, DEFAULT_SHARD_WEIGHT, HRW_MODE, HrwEngine, PlacementService, PlacementSnapshot, mix64_np, shard_seed64,
+)
+from shard_sim_v2 import SIM_CHUNK_USERS, chunk_hashes, shard_ids
+
+CELL_BANDWIDTH_BPS = 1.25e9        # migration bandwidth per cell and direction (10 Gbit/s)
+USER_BYTES_MEAN = 1 << 20          # modelled bytes per user (exponential around this mean)
+PLAN_MAX_STEP_SEC = 1800.0         # copy time per placement version on the busiest cell
+PLAN_SAMPLE_USERS = 200_000        # users used to size the ramp steps (the exact pass counts everyone)
+PLAN_BISECT_ITERS = 30
+BYTES_SALT = 0xB17E5B17E5B17E5B
+
+@dataclass
+class Transfer:
+    src: str            # source shard
+    dst: str            # destination shard (== src for a shard move)
+    src_cell: str
+    dst_cell: str
+    users: int
+    bytes: float
+    start_sec: float = 0.0
+    end_sec: float = 0.0
+
+@dataclass
+class PlanStep:
+    version: int                # placement version this step publishes
+    kind: str                   # add_shards | ramp_up | ramp_down | remove_shards | move_shards
+    shards: Tuple[str, ...]     # HRW shard set after the step
+    weights: Dict[str, float] = field(default_factory=dict)            # weights set by this step
+    moves: Dict[str, Dict[str, str]] = field(default_factory=dict)     # shard -> new location
+    users_moved: int = 0
+    bytes_moved: float = 0.0
+    transfers: List[Transfer] = field(default_factory=list)
+    duration_sec: float = 0.0   # makespan of the transfer schedule
+    bound_sec: float = 0.0      # busiest cell direction's bytes / bandwidth
+
+@dataclass
+class RebalancePlan:
+    from_version: int
+    users: int
+    steps: List[PlanStep]
+    direct_users_moved: int     # users whose final home differs from their current one
+    direct_bytes_moved: float
+    shard_bytes_before: Dict[str, float]
+    shard_bytes_after: Dict[str, float]
+
+    @property
+    def users_moved(self) -> int:
+        return sum(s.users_moved for s in self.steps if s.kind != "move_shards")
+
+    @property
+    def bytes_moved(self) -> float:
+        return sum(s.bytes_moved for s in self.steps)
+
+    @property
+    def duration_sec(self) -> float:
+        return sum(s.duration_sec for s in self.steps)
+
+    def apply(self, svc: PlacementService) -> List[int]:
+        """Publish every step in order; returns the versions published."""
+        if svc.get_snapshot().version != self.from_version:
+            raise ValueError(f"plan was made at version {self.from_version}, placement is at {svc.get_snapshot().version}")
+        versions = []
+        for step in self.steps:
+            if step.kind in ("add_shards", "remove_shards"):
+                svc.set_shards(step.shards, step.moves, weights=step.weights)
+            elif step.kind == "move_shards":
+                svc.move_shards(step.moves)
+            else:
+                svc.set_weights(step.weights)
+            versions.append(svc.get_snapshot().version)
+        return versions
+
+def user_bytes(hashes) -> "np.ndarray":
+    # deterministic per user, independent of the HRW score bits
+    u = ((mix64_np(hashes ^ np.uint64(BYTES_SALT)) >> np.uint64(11)).astype(np.float64) + 0.5) / float(1 << 53)
+    return -np.log(u) * USER_BYTES_MEAN
+
+# Weight groups: shards with the same weight at every boundary. Inside a group the winner is the
+# plain (unweighted) HRW winner, so each group costs one integer pass over its shards.
+
+def weight_groups(shards: Sequence[str], boundaries: Sequence[Dict[str, float]]) -> List[List[int]]:
+    groups: Dict[Tuple[float, ...], List[int]] = {}
+    for i, sid in enumerate(shards):
+        key = tuple(b.get(sid, DEFAULT_SHARD_WEIGHT) for b in boundaries)
+        groups.setdefault(key, []).append(i)
+    return list(groups.values())
+
+_state: dict = {}
+
+def _init_worker(shards: Sequence[str], groups: List[List[int]], weights, ids: str, record: bool) -> None:
+    # weights: (boundaries, groups) float array
+    _state.update(
+        engines=[HrwEngine([shards[i] for i in g], "fast") for g in groups],
+        members=[np.array(g, dtype=np.int32) for g in groups],
+        weights=weights, n=len(shards), ids=ids, record=record,
+    )
+
+def group_winners(hashes, engines, members):
+    """Per group: global shard index of the winner and its -ln(u) (the weighted score is w / that)."""
+    idx = np.empty((len(engines), len(hashes)), dtype=np.int32)
+    neg_log_u = np.empty((len(engines), len(hashes)), dtype=np.float64)
+    for g, (eng, mem) in enumerate(zip(engines, members)):
+        local = eng.indices_for_hashes(hashes)
+        seeds = np.array([shard_seed64(sid) for sid in eng.shards], dtype=np.uint64)
+        best = mix64_np(hashes ^ seeds[local])
+        u = ((best >> np.uint64(11)).astype(np.float64) + 0.5) / float(1 << 53)
+        neg_log_u[g] = -np.log(u)
+        idx[g] = mem[local]
+    return idx, neg_log_u
+
+def assign(idx, neg_log_u, group_weights) -> "np.ndarray":
+    # same formula as HrwEngine's weighted path; equal to it up to 53-bit score ties
+    scores = np.asarray(group_weights, dtype=np.float64)[:, None] / neg_log_u
+    return idx[scores.argmax(axis=0), np.arange(idx.shape[1])]
+
+def diff_chunk(task: Tuple[int, int]):
+    """Users [start, end): per step (src, dst) user/byte flow matrices, bytes per shard before and after."""
+    start, end = task
+    st = _state
+    n = st["n"]
+    h = chunk_hashes(start, end, st["ids"])
+    b = user_bytes(h)
+    idx, neg_log_u = group_winners(h, st["engines"], st["members"])
+    homes = [assign(idx, neg_log_u, w) for w in st["weights"]]
+    users, byts, moved = [], [], []
+    for k in range(1, len(homes)):
+        src, dst = homes[k - 1], homes[k]
+        m = src != dst
+        code = src[m].astype(np.int64) * n + dst[m]
+        users.append(np.bincount(code, minlength=n * n).reshape(n, n))
+        byts.append(np.bincount(code, weights=b[m], minlength=n * n).reshape(n, n))
+        if st["record"]:
+            moved.append((np.flatnonzero(m) + start, src[m], dst[m]))
+    direct = homes[0] != homes[-1]
+    before = np.bincount(homes[0], weights=b, minlength=n)
+    after = np.bincount(homes[-1], weights=b, minlength=n)
+    return users, byts, int(direct.sum()), float(b[direct].sum()), before, after, moved
+
+def diff_users(users: int, shards: Sequence[str], boundaries: Sequence[Dict[str, float]], ids: str = "exact",
+               workers: int = 1, chunk: int = SIM_CHUNK_USERS,
+               on_moves: Optional[Callable[[int, "np.ndarray", "np.ndarray", "np.ndarray"], None]] = None) -> dict:
+    """
+    Exact user diff between consecutive weight boundaries over `shards`, streamed in chunks.
+    on_moves(step, user_indices, src_idx, dst_idx) sees every moved user ("user-{i}" for ids="exact").
+    """
+    n = len(shards)
+    groups = weight_groups(shards, boundaries)
+    weights = np.array([[b.get(shards[g[0]], DEFAULT_SHARD_WEIGHT) for g in groups] for b in boundaries])
+    if (weights.max(axis=1) <= 0).any():
+        raise ValueError("every boundary needs a shard with weight > 0")
+    steps = len(boundaries) - 1
+    res = {
+        "users": [np.zeros((n, n), dtype=np.int64) for _ in range(steps)],
+        "bytes": [np.zeros((n, n)) for _ in range(steps)],
+        "direct_users": 0, "direct_bytes": 0.0, "before": np.zeros(n), "after": np.zeros(n),
+    }
+
+    def merge(part):
+        u, by, du, db, before, after, moved = part
+        for k in range(steps):
+            res["users"][k] += u[k]
+            res["bytes"][k] += by[k]
+        res["direct_users"] += du
+        res["direct_bytes"] += db
+        res["before"] += before
+        res["after"] += after
+        for k, (who, src, dst) in enumerate(moved):
+            on_moves(k, who, src, dst)
+
+    tasks = [(a, min(a + chunk, users)) for a in range(0, users, chunk)]
+    init = (list(shards), groups, weights, ids, on_moves is not None)
+    if workers <= 1 or on_moves is not None:
+        _init_worker(*init)
+        for t in tasks:
+            merge(diff_chunk(t))
+    else:
+        ctx = get_context("fork") if hasattr(os, "fork") else get_context()
+        with ctx.Pool(workers, initializer=_init_worker, initargs=init) as pool:
+            for part in pool.imap_unordered(diff_chunk, tasks):
+                merge(part)
+    return res
+
+
+# Sizing: a ramp is cut into versions that each move about the same bytes, enough of them that
+# the busiest cell's share of one version fits in max_step_sec.
+
+def _lerp(a: Dict[str, float], b: Dict[str, float], t: float) -> Dict[str, float]:
+    return {sid: b[sid] if t >= 1.0 else a[sid] + (b[sid] - a[sid]) * t for sid in a}
+
+def ramp_points(shards: Sequence[str], w0: Dict[str, float], w1: Dict[str, float], cell_of: Dict[str, str],
+                bandwidth: Callable[[str], float], max_step_sec: float, sample, scale: float) -> List[float]:
+    """Ramp positions t (last = 1.0) that split the w0 -> w1 ramp into equal-byte versions."""
+    h, b = sample
+    groups = weight_groups(shards, [w0, w1])
+    idx, neg_log_u = group_winners(h, [HrwEngine([shards[i] for i in g], "fast") for g in groups],
+                                   [np.array(g, dtype=np.int32) for g in groups])
+    g0 = [w0[shards[g[0]]] for g in groups]
+    g1 = [w1[shards[g[0]]] for g in groups]
+    home0 = assign(idx, neg_log_u, g0)
+
+    def moved_bytes(t: float) -> float:
+        return float(b[assign(idx, neg_log_u, [a + (c - a) * t for a, c in zip(g0, g1)]) != home0].sum())
+
+    home1 = assign(idx, neg_log_u, g1)
+    m = home0 != home1
+    total = float(b[m].sum())
+    if total == 0:
+        return [1.0]
+    cells = np.array([cell_of[sid] for sid in shards])
+    busiest = 0.0
+    for side in (cells[home0[m]], cells[home1[m]]):
+        for c in np.unique(side):
+            busiest = max(busiest, float(b[m][side == c].sum()) * scale / bandwidth(c))
+    steps = max(1, math.ceil(busiest / max_step_sec))
+    points = []
+    for k in range(1, steps):
+        lo, hi = 0.0, 1.0
+        for _ in range(PLAN_BISECT_ITERS):
+            mid = (lo + hi) / 2
+            if moved_bytes(mid) < total * k / steps:
+                lo = mid
+            else:
+                hi = mid
+        points.append(hi)
+    return points + [1.0]
+
+def schedule_transfers(transfers: List[Transfer], bandwidth: Callable[[str], float]) -> Tuple[float, float]:
+    """
+    Sets start/end on every transfer: one outgoing and one incoming copy per cell at a time, each at
+    the slower cell's bandwidth; free cell pairs with the most bytes left go first. -> (makespan, bound)
+    """
+    out_left: Dict[str, float] = defaultdict(float)
+    in_left: Dict[str, float] = defaultdict(float)
+    queues: Dict[Tuple[str, str], List[Transfer]] = defaultdict(list)
+    for t in sorted(transfers, key=lambda t: t.bytes):   # pop() takes the largest
+        out_left[t.src_cell] += t.bytes
+        in_left[t.dst_cell] += t.bytes
+        queues[(t.src_cell, t.dst_cell)].append(t)
+    bound = max([v / bandwidth(c) for c, v in out_left.items()] + [v / bandwidth(c) for c, v in in_left.items()],
+                default=0.0)
+    out_busy, in_busy = set(), set()
+    running: List[Tuple[float, int, Transfer]] = []
+    now = makespan = 0.0
+    seq = 0
+    while queues or running:
+        pairs = sorted(queues, key=lambda p: -max(out_left[p[0]] / bandwidth(p[0]), in_left[p[1]] / bandwidth(p[1])))
+        for src, dst in pairs:
+            if src in out_busy or dst in in_busy:
+                continue
+            q = queues[(src, dst)]
+            t = q.pop()
+            if not q:
+                del queues[(src, dst)]
+            t.start_sec, t.end_sec = now, now + t.bytes / min(bandwidth(src), bandwidth(dst))
+            out_left[src] -= t.bytes
+            in_left[dst] -= t.bytes
+            out_busy.add(src)
+            in_busy.add(dst)
+            heapq.heappush(running, (t.end_sec, seq, t))
+            seq += 1
+        now, _, t = heapq.heappop(running)
+        makespan = max(makespan, now)
+        out_busy.discard(t.src_cell)
+        in_busy.discard(t.dst_cell)
+    return makespan, bound
+
+def place_new_shards(new: Sequence[str], placement: Dict[str, Dict[str, str]], shards: Iterable[str],
+                     avoid: Iterable[str] = ()) -> Dict[str, Dict[str, str]]:
+    """New shards onto the cells holding the fewest shards (skipping `avoid`)."""
+    avoid = set(avoid)
+    count: Dict[Tuple[str, str], int] = {}
+    for loc in placement.values():
+        if loc["cell"] not in avoid:
+            count.setdefault((loc["region"], loc["cell"]), 0)
+    for sid in shards:
+        loc = placement[sid]
+        if loc["cell"] not in avoid:
+            count[(loc["region"], loc["cell"])] += 1
+    if not count:
+        raise ValueError("no cell left to place new shards on")
+    out = {}
+    for sid in new:
+        region, cell = min(count, key=lambda rc: (count[rc], rc))
+        count[(region, cell)] += 1
+        out[sid] = {"region": region, "cell": cell}
+    return out
+
+def plan_rebalance(snap: PlacementSnapshot, users: int, target_shards: Optional[Sequence[str]] = None,
+                   target_weights: Optional[Dict[str, float]] = None, evacuate: Iterable[str] = (),
+                   placement: Optional[Dict[str, Dict[str, str]]] = None, ids: str = "exact",
+                   bandwidth: Optional[Dict[str, float]] = None, max_step_sec: float = PLAN_MAX_STEP_SEC,
+                   workers: int = 1, chunk: int = SIM_CHUNK_USERS,
+                   on_moves: Optional[Callable[[int, "np.ndarray", "np.ndarray", "np.ndarray"], None]] = None,
+                   hash_mode: str = HRW_MODE) -> RebalancePlan:
+    """
+    Plan the move from `snap` to `target_shards` / `target_weights` (missing = 1.0) with every shard
+    out of the `evacuate` cells, for users "user-0" .. "user-{users-1}".
+    placement: locations for new shards (default: least-populated cells outside `evacuate`).
+    on_moves(ramp_step, user_indices, src_idx, dst_idx): every moved user, indices into plan shards.
+    hash_mode: the routers' HRW mode; only "fast" can be planned.
+    """
+    if hash_mode != "fast":
+        raise ValueError(f"plan_rebalance models fast-mode HRW only, routers here use {hash_mode!r}: "
+                         f"legacy sha256 scoring has no vectorized form (run the routers with hash_mode='fast')")
+    evacuate = set(evacuate)
+    current = list(snap.shards)
+    target = list(target_shards) if target_shards is not None else current
+    if not target:
+        raise ValueError("target shard list cannot be empty")
+    added = [sid for sid in target if sid not in set(current)]
+    removed = [sid for sid in current if sid not in set(target)]
+    shards = current + added
+    bw = (lambda c: bandwidth.get(c, CELL_BANDWIDTH_BPS)) if bandwidth else (lambda c: CELL_BANDWIDTH_BPS)
+
+    loc = {sid: {"region": l["region"], "cell": l["cell"]} for sid, l in snap.placement.items()}
+    new_loc = dict(placement or {})
+    missing = [sid for sid in added if sid not in new_loc]
+    new_loc.update(place_new_shards(missing, loc, current, evacuate))
+    loc.update({sid: new_loc[sid] for sid in added})
+    cell_of = {sid: loc[sid]["cell"] for sid in shards}
+
+    # weights: now (new shards at 0) -> grown (every increase applied) -> final (decreases, removed at 0)
+    goal = {sid: float((target_weights or {}).get(sid, DEFAULT_SHARD_WEIGHT)) for sid in target}
+    w_now = {sid: float(snap.weights.get(sid, DEFAULT_SHARD_WEIGHT)) for sid in current}
+    w_now.update({sid: 0.0 for sid in added})
+    w_grown = {sid: max(w, goal.get(sid, w)) for sid, w in w_now.items()}
+    w_final = {sid: goal.get(sid, 0.0) for sid in shards}
+
+    h = chunk_hashes(0, min(users, PLAN_SAMPLE_USERS), ids)
+    sample, scale = (h, user_bytes(h)), users / max(1, len(h))
+    boundaries = [w_now]
+    kinds = []
+    for kind, w0, w1 in (("ramp_up", w_now, w_grown), ("ramp_down", w_grown, w_final)):
+        if w0 == w1:
+            continue
+        for t in ramp_points(shards, w0, w1, cell_of, bw, max_step_sec, sample, scale):
+            boundaries.append(_lerp(w0, w1, t))
+            kinds.append(kind)
+    res = diff_users(users, shards, boundaries, ids, workers, chunk, on_moves)
+
+    version = snap.version
+    steps: List[PlanStep] = []
+    if added:
+        version += 1
+        steps.append(PlanStep(version, "add_shards", tuple(shards), {sid: 0.0 for sid in added},
+                              {sid: loc[sid] for sid in added}))
+    for k, kind in enumerate(kinds):
+        version += 1
+        prev, cur = boundaries[k], boundaries[k + 1]
+        step = PlanStep(version, kind, tuple(shards), {sid: w for sid, w in cur.items() if w != prev[sid]})
+        mu, mb = res["users"][k], res["bytes"][k]
+        for i, j in zip(*np.nonzero(mu)):
+            step.transfers.append(Transfer(shards[i], shards[j], cell_of[shards[i]], cell_of[shards[j]],
+                                           int(mu[i, j]), float(mb[i, j])))
+        step.users_moved, step.bytes_moved = int(mu.sum()), float(mb.sum())
+        step.duration_sec, step.bound_sec = schedule_transfers(step.transfers, bw)
+        steps.append(step)
+    if removed:
+        version += 1
+        steps.append(PlanStep(version, "remove_shards", tuple(target)))
+
+    # evacuation: whole shards, biggest first, each to the emptiest cell left in its region
+    after = {sid: float(v) for sid, v in zip(shards, res["after"])}
+    cell_bytes: Dict[Tuple[str, str], float] = defaultdict(float)
+    for sid in target:
+        cell_bytes[(loc[sid]["region"], loc[sid]["cell"])] += after[sid]
+    moves = []
+    for sid in sorted((s for s in target if loc[s]["cell"] in evacuate), key=lambda s: -after[s]):
+        region = loc[sid]["region"]
+        options = [rc for rc in cell_bytes if rc[0] == region and rc[1] not in evacuate]
+        if not options:
+            raise ValueError(f"no cell left in region {region} to evacuate {loc[sid]['cell']} into")
+        dest = min(options, key=lambda rc: (cell_bytes[rc], rc))
+        cell_bytes[dest] += after[sid]
+        moves.append(Transfer(sid, sid, loc[sid]["cell"], dest[1], 0, after[sid]))
+    # first fit into versions whose busiest cell stays within max_step_sec
+    batches: List[Tuple[Dict[str, float], Dict[str, float], List[Transfer]]] = []
+    for t in moves:
+        for out_b, in_b, batch in batches:
+            if max(out_b.get(t.src_cell, 0.0) + t.bytes, in_b.get(t.dst_cell, 0.0) + t.bytes) <= max_step_sec * min(
+                    bw(t.src_cell), bw(t.dst_cell)):
+                break
+        else:
+            out_b, in_b, batch = {}, {}, []
+            batches.append((out_b, in_b, batch))
+        out_b[t.src_cell] = out_b.get(t.src_cell, 0.0) + t.bytes
+        in_b[t.dst_cell] = in_b.get(t.dst_cell, 0.0) + t.bytes
+        batch.append(t)
+    for _, _, batch in batches:
+        version += 1
+        step = PlanStep(version, "move_shards", tuple(target),
+                        moves={t.src: {"region": loc[t.src]["region"], "cell": t.dst_cell} for t in batch},
+                        transfers=batch, bytes_moved=sum(t.bytes for t in batch))
+        step.duration_sec, step.bound_sec = schedule_transfers(batch, bw)
+        steps.append(step)
+
+    return RebalancePlan(snap.version, users, steps, res["direct_users"], res["direct_bytes"],
+                         {sid: float(v) for sid, v in zip(shards, res["before"]) if sid in set(current)},
+                         {sid: after[sid] for sid in target})
+
+def make_placement(shards: Sequence[str], cells: int) -> Dict[str, Dict[str, str]]:
+    return {sid: {"region": "us", "cell": f"us-cell-{i % cells + 1}"} for i, sid in enumerate(shards)}
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000_000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1)
+    n_target = int(sys.argv[3]) if len(sys.argv) > 3 else 256
+    evacuate = [c for c in (sys.argv[4] if len(sys.argv) > 4 else "us-cell-4").split(",") if c and c != "-"]
+    ids = sys.argv[5] if len(sys.argv) > 5 else "exact"
+    max_step = float(sys.argv[6]) if len(sys.argv) > 6 else PLAN_MAX_STEP_SEC
+
+    svc = PlacementService(make_placement(ACTIVE_SHARDS, 4), shards=ACTIVE_SHARDS)
+    t0 = time.perf_counter()
+    plan = plan_rebalance(svc.get_snapshot(), users, shard_ids(n_target), evacuate=evacuate, ids=ids,
+                          max_step_sec=max_step, workers=workers, hash_mode="fast")
+    elapsed = time.perf_counter() - t0
+
+    tb = 1e12
+    print("\nShard rebalancing plan (fast HRW)\n")
+    print(f"Users: {users:,} | Shards: {len(ACTIVE_SHARDS)} -> {n_target} | Evacuate: {', '.join(evacuate) or '-'} "
+          f"| ids: {ids} | workers: {workers}")
+    print(f"Bandwidth: {CELL_BANDWIDTH_BPS * 8 / 1e9:g} Gbit/s per cell and direction | max {max_step / 60:g} min "
+          f"per version | {USER_BYTES_MEAN / 2 ** 20:g} MiB/user")
+    print(f"Planned in {elapsed:.1f}s ({users / elapsed / 1e6:.2f}M users/s)\n")
+    print(f"{'Version':>7} {'Step':14} {'Changed':>8} {'Users moved':>13} {'TB moved':>9} {'Transfers':>10} "
+          f"{'Bound min':>10} {'Schedule min':>13}")
+    print("-" * 92)
+    for s in plan.steps:
+        changed = len(s.moves) if s.kind == "move_shards" else len(s.weights) or len(s.shards)
+        print(f"{s.version:>7} {s.kind:14} {changed:>8} {s.users_moved:>13,} {s.bytes_moved / tb:>9.2f} "
+              f"{len(s.transfers):>10,} {s.bound_sec / 60:>10.1f} {s.duration_sec / 60:>13.1f}")
+    print("-" * 92)
+    print(f"{'':7} {'total':14} {'':8} {plan.users_moved:>13,} {plan.bytes_moved / tb:>9.2f} "
+          f"{sum(len(s.transfers) for s in plan.steps):>10,} {sum(s.bound_sec for s in plan.steps) / 60:>10.1f} "
+          f"{plan.duration_sec / 60:>13.1f}")
+    print(f"\nDirect switch to the final shard set: {plan.direct_users_moved:,} users "
+          f"({plan.direct_users_moved / users:.1%}), {plan.direct_bytes_moved / tb:.2f} TB "
+          f"| plan re-moves {plan.users_moved - plan.direct_users_moved:,} users")
+    before, after = defaultdict(float), defaultdict(float)
+    placement = make_placement(ACTIVE_SHARDS, 4)
+    for sid, v in plan.shard_bytes_before.items():
+        before[placement[sid]["cell"]] += v
+    plan.apply(svc)
+    final = svc.get_snapshot()
+    for sid, v in plan.shard_bytes_after.items():
+        after[final.placement[sid]["cell"]] += v
+    print(f"Applied: placement v{plan.from_version} -> v{final.version}, {len(final.shards)} shards")
+    print(f"\n{'Cell':10} {'TB before':>10} {'TB after':>10}")
+    for cell in sorted(set(before) | set(after)):
+        print(f"{cell:10} {before[cell] / tb:>10.2f} {after[cell] / tb:>10.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
 # shard_fairness_v2.py
+import random
 from collections import Counter
-from common_infra_v2 import ACTIVE_SHARDS, hrw_shard_for_user
+from common_infra_v2 import (
+    ACTIVE_SHARDS, DEFAULT_SHARD_WEIGHT, CellHealth, Dependencies, HotUsers, HrwEngine, PlacementService, Router,
+    User, hrw_shard_for_user,
+)
 
 def zipf_weights(n: int, s: float = 1.15):
     w = [1.0 / (k ** s) for k in range(1, n + 1)]
@@ -47,9 +51,93 @@ def fairness_zipf(users: int = 200_000, s: float = 1.15):
     for sid, v in load.most_common(5):
         print(f"  {sid}: load={v:.6f}")
 
+def demo_weights() -> dict:
+    # 4 shards warming up at half load, 4 bigger cells at 1.5x
+    w = {sid: 0.5 for sid in ACTIVE_SHARDS[:4]}
+    w.update({sid: 1.5 for sid in ACTIVE_SHARDS[-4:]})
+    return w
+
+def fairness_weighted(users: int = 100_000, weights: dict = None):
+    weights = weights or demo_weights()
+    # same assignments as hrw_shard_for_user(uid, ACTIVE_SHARDS, weights), precomputed per shard
+    eng = HrwEngine(ACTIVE_SHARDS, "legacy", weights)
+    uids = [f"user-{i}" for i in range(users)]
+    assigned = eng.shards_for(uids)
+    counts = Counter(assigned)
+
+    total_w = sum(weights.get(sid, DEFAULT_SHARD_WEIGHT) for sid in ACTIVE_SHARDS)
+    worst = 0.0
+
+    print("\nWeighted Shard Fairness \n")
+    print(f"Users: {users:,} | Shards: {len(ACTIVE_SHARDS)} | Non-default weights: {len(weights)}")
+    print(f"{'Shard':10} {'Weight':>7} {'Target %':>9} {'Actual %':>9} {'Actual/Target':>14}")
+    for sid in ACTIVE_SHARDS:
+        w = weights.get(sid, DEFAULT_SHARD_WEIGHT)
+        target = w / total_w
+        actual = counts[sid] / users
+        ratio = actual / target if target else 0.0
+        worst = max(worst, abs(ratio - 1.0))
+        if w != DEFAULT_SHARD_WEIGHT:
+            print(f"{sid:10} {w:>7.2f} {target*100:>9.3f} {actual*100:>9.3f} {ratio:>14.3f}")
+    print(f"Worst |actual/target - 1| over all shards: {worst:.3f}")
+
+    # minimal movement: bump one weight, only users onto that shard should move
+    sid = ACTIVE_SHARDS[0]
+    bumped = dict(weights, **{sid: weights.get(sid, DEFAULT_SHARD_WEIGHT) * 2})
+    after = HrwEngine(ACTIVE_SHARDS, "legacy", bumped).shards_for(uids)
+    moved = [(a, b) for a, b in zip(assigned, after) if a != b]
+    onto = sum(1 for _, b in moved if b == sid)
+    print(f"\n{sid} weight x2 -> moved {len(moved):,} users ({onto:,} onto {sid}, {len(moved) - onto:,} elsewhere)")
+
+def _skew(load: Counter):
+    vals = sorted(load.get(sid, 0.0) for sid in ACTIVE_SHARDS)
+    n, total = len(vals), sum(vals)
+    gini = sum((2 * i - n - 1) * v for i, v in enumerate(vals, 1)) / (n * total)
+    return max(vals) / (total / n), gini
+
+def fairness_hot_split(users: int = 200_000, requests: int = 500_000, s: float = 1.15):
+    # Zipf request stream through a Router with heavy-hitter detection; then compare shard
+    # load with every user on its home vs hot users spread over their sub-shards
+    svc = PlacementService({sid: {"region": "us", "cell": "us-cell-1"} for sid in ACTIVE_SHARDS})
+    hot = HotUsers()
+    router = Router(svc, hash_mode="fast", hot_users=hot, clock=lambda: 0.0)
+    health = CellHealth(cell_ok={"us-cell-1": True})
+    deps = Dependencies()
+
+    weights = zipf_weights(users, s=s)
+    rng = random.Random(11)
+    for i, u in enumerate(rng.choices(range(users), weights=weights, k=requests)):
+        router.route_write(User(f"user-{u}", "us"), "low_value_action", deps, health, key=f"req-{i}")
+
+    snap = svc.get_snapshot()
+    uids = [f"user-{i}" for i in range(users)]
+    homes = [router.hrw.shards[i] for i in router.home_shard_indices(uids, snap)]
+    before, after = Counter(), Counter()
+    for uid, home, w in zip(uids, homes, weights):
+        before[home] += w
+        subs = router.sub_shards(uid, snap)
+        for sid in subs:            # writes keyed uniformly: each sub-key takes 1/fanout
+            after[sid] += w / len(subs)
+
+    split = sorted(hot.users().items(), key=lambda kv: -kv[1])
+    print("\nHot-User Sub-Sharding \n")
+    print(f"Users: {users:,} | Requests: {requests:,} (1 in {hot.sample_every} sampled) | Zipf s: {s}")
+    print(f"Split users: {len(split)} | detector top-k: {hot.detector.k} | "
+          f"hot above {hot.shard_fraction:g} x a shard's fair share")
+    print(f"{'':16} {'Max/avg':>8} {'Gini':>7}")
+    for name, load in (("before (home)", before), ("after (split)", after)):
+        mx, g = _skew(load)
+        print(f"{name:16} {mx:>8.3f} {g:>7.4f}")
+    print("\nTop split users:")
+    for uid, f in split[:5]:
+        share = weights[int(uid.split("-")[1])]
+        print(f"  {uid}: load share={share * 100:.2f}% fanout={f} sub-shards={len(set(router.sub_shards(uid, snap)))}")
+
 def main():
     fairness_uniform(100_000)
     fairness_zipf(200_000, s=1.15)
+    fairness_weighted(100_000)
+    fairness_hot_split(200_000)
 
 if __name__ == "__main__":
     main()
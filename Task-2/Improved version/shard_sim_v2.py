@@ -0,0 +1,144 @@
+# shard_sim_v2.py
+# Shard fairness and Zipf skew at production scale (the 50M-user "Global" phase and past it).
+# - users are streamed in fixed-size chunks, so memory stays flat whatever the user count
+# - per chunk: batched user hashing -> vectorized HRW (HrwEngine.indices_for_hashes) ->
+#   np.bincount for users and Zipf load per shard
+# - chunks are spread over a process pool; per-shard partial sums are merged at the end
+# ids="exact" hashes the real "user-{i}" strings (same homes as Router in fast mode);
+# ids="synthetic" draws 64-bit hashes with mix64 instead (same distribution, no per-user Python).
+import os
+import sys
+import time
+from multiprocessing import get_context
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from common_infra_v2 import DEFAULT_SHARD_WEIGHT, HrwEngine, mix64_np, user_hashes64_np
+
+SIM_CHUNK_USERS = 1_000_000   # users per task; bounds per-worker memory (~60 MB)
+HOT_SHARD_FACTOR = 1.25       # a shard is hot above this multiple of the mean load
+ZIPF_S = 1.15
+SYNTHETIC_SALT = 0x5EED5EED5EED5EED
+PERCENTILES = (50, 90, 99)
+
+def shard_ids(n: int) -> List[str]:
+    # same names as ACTIVE_SHARDS for the first 64
+    return [f"shard-{i:03d}" for i in range(1, n + 1)]
+
+def gini(x) -> float:
+    """Gini coefficient of non-negative values: 0 = perfectly even, ->1 = all on one."""
+    x = np.sort(np.asarray(x, dtype=np.float64))
+    n = len(x)
+    total = x.sum()
+    if n == 0 or total == 0:
+        return 0.0
+    return float((2.0 * np.arange(1, n + 1) @ x) / (n * total) - (n + 1) / n)
+
+def chunk_hashes(start: int, end: int, ids: str):
+    if ids == "exact":
+        return user_hashes64_np([f"user-{i}" for i in range(start, end)])
+    return mix64_np(np.arange(start, end, dtype=np.uint64) ^ np.uint64(SYNTHETIC_SALT))
+
+_engine: Optional[HrwEngine] = None
+
+def _init_worker(shards: List[str], weights: Optional[Dict[str, float]]) -> None:
+    global _engine
+    _engine = HrwEngine(shards, "fast", weights)
+
+def simulate_chunk(task: Tuple[int, int, str, float]):
+    """Users [start, end): per-shard user counts, Zipf load (rank = index + 1, unnormalized) and heaviest rank."""
+    start, end, ids, s = task
+    n = len(_engine.shards)
+    idx = _engine.indices_for_hashes(chunk_hashes(start, end, ids))
+    counts = np.bincount(idx, minlength=n)
+    load = np.bincount(idx, weights=np.arange(start + 1, end + 1, dtype=np.float64) ** -s, minlength=n)
+    # ranks ascend within the chunk, so a shard's first user here is its heaviest
+    top = np.full(n, np.iinfo(np.int64).max, dtype=np.int64)
+    shards_seen, first = np.unique(idx, return_index=True)
+    top[shards_seen] = first + start + 1
+    return counts, load, top
+
+def simulate(users: int, shards: List[str], ids: str = "exact", s: float = ZIPF_S, workers: int = 1,
+             weights: Optional[Dict[str, float]] = None, chunk: int = SIM_CHUNK_USERS) -> dict:
+    n = len(shards)
+    counts = np.zeros(n, dtype=np.int64)
+    load = np.zeros(n, dtype=np.float64)
+    top = np.full(n, np.iinfo(np.int64).max, dtype=np.int64)
+    tasks = [(a, min(a + chunk, users), ids, s) for a in range(0, users, chunk)]
+
+    def merge(part):
+        c, l, t = part
+        np.add(counts, c, out=counts)
+        np.add(load, l, out=load)
+        np.minimum(top, t, out=top)
+
+    if workers <= 1:
+        _init_worker(shards, weights)
+        for t in tasks:
+            merge(simulate_chunk(t))
+    else:
+        ctx = get_context("fork") if hasattr(os, "fork") else get_context()
+        with ctx.Pool(workers, initializer=_init_worker, initargs=(shards, weights)) as pool:
+            for part in pool.imap_unordered(simulate_chunk, tasks):
+                merge(part)
+    total = load.sum()
+    return {"counts": counts, "load": load / total, "zipf_total": total, "top_rank": top}
+
+def summarize(values, shards: List[str], weights: Optional[Dict[str, float]] = None) -> dict:
+    # compare each shard with its weighted fair share, so weighted placements aren't flagged as skew
+    w = np.array([float((weights or {}).get(sid, DEFAULT_SHARD_WEIGHT)) for sid in shards])
+    fair = values.sum() * w / w.sum()
+    ratio = np.divide(values, fair, out=np.zeros_like(fair), where=fair > 0)
+    return {
+        "ratio": ratio,
+        "pct": {p: float(np.percentile(ratio, p)) for p in PERCENTILES},
+        "min": float(ratio.min()),
+        "max": float(ratio.max()),
+        "gini": gini(values / np.maximum(w, 1e-12)),
+        "hot": [shards[i] for i in np.argsort(-ratio) if ratio[i] >= HOT_SHARD_FACTOR],
+    }
+
+def peak_rss_mb() -> float:
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000_000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1)
+    n_shards = int(sys.argv[3]) if len(sys.argv) > 3 else 64
+    ids = sys.argv[4] if len(sys.argv) > 4 else "exact"
+    s = float(sys.argv[5]) if len(sys.argv) > 5 else ZIPF_S
+    if ids not in ("exact", "synthetic"):
+        raise SystemExit("ids must be 'exact' or 'synthetic'")
+    shards = shard_ids(n_shards)
+
+    t0 = time.perf_counter()
+    res = simulate(users, shards, ids, s, workers)
+    elapsed = time.perf_counter() - t0
+
+    print("\nShard fairness simulation (fast HRW)\n")
+    print(f"Users: {users:,} | Shards: {n_shards} | ids: {ids} | Zipf s: {s} | workers: {workers}")
+    print(f"Elapsed: {elapsed:.1f}s ({users / elapsed / 1e6:.2f}M users/s) | chunk: {SIM_CHUNK_USERS:,} users "
+          f"| peak RSS (this process): {peak_rss_mb():.0f} MB\n")
+
+    head = "".join(f"{'p' + str(p):>7}" for p in PERCENTILES)
+    print(f"{'Metric (shard / fair share)':28} {'min':>7}{head} {'max':>7} {'Gini':>7} {'Hot shards':>11}")
+    print("-" * 90)
+    sums = {}
+    for name, values in (("users per shard", res["counts"]), ("Zipf load per shard", res["load"])):
+        st = sums[name] = summarize(values, shards)
+        cols = "".join(f"{st['pct'][p]:>7.3f}" for p in PERCENTILES)
+        print(f"{name:28} {st['min']:>7.3f}{cols} {st['max']:>7.3f} {st['gini']:>7.4f} {len(st['hot']):>11}")
+
+    hot = sums["Zipf load per shard"]["hot"]
+    if hot:
+        print(f"\nHot shards (Zipf load >= {HOT_SHARD_FACTOR}x fair share):")
+        print(f"{'Shard':10} {'Load/fair':>10} {'Load %':>8} {'Users':>12} {'Heaviest user rank':>19} {'Its load %':>11}")
+        load = res["load"]
+        for sid in hot:
+            i = shards.index(sid)
+            rank = int(res["top_rank"][i])
+            print(f"{sid:10} {sums['Zipf load per shard']['ratio'][i]:>10.2f} {load[i] * 100:>7.3f}% "
+                  f"{int(res['counts'][i]):>12,} {rank:>19,} {rank ** -s / res['zipf_total'] * 100:>10.3f}%")
+
+if __name__ == "__main__":
+    main()
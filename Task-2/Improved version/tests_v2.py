@@ -0,0 +1,1177 @@
+import os
+from collections import Counter
+import unittest
+import common_infra_v2
+from common_infra_v2 import *
+
+
+def make_demo_placement() -> dict:
+    placement = {}
+    for i, s in enumerate(ACTIVE_SHARDS):
+        placement[s] = {"region": "us", "cell": "us-cell-1"} if i % 2 == 0 else {"region": "eu", "cell": "eu-cell-1"}
+    return placement
+
+
+class TestHrwEngine(unittest.TestCase):
+
+    def test_legacy_matches_reference(self):
+        eng = HrwEngine(ACTIVE_SHARDS, "legacy")
+        for i in range(2000):
+            uid = f"user-{i}"
+            self.assertEqual(eng.shard_for(uid), hrw_shard_for_user(uid, ACTIVE_SHARDS))
+
+    def test_fast_batch_matches_scalar(self):
+        eng = HrwEngine(ACTIVE_SHARDS, "fast")
+        users = [f"user-{i}" for i in range(3000)]
+        batch = list(eng.shards_for(users))
+        self.assertEqual(batch, [eng.shard_for(u) for u in users])
+
+    def test_router_default_keeps_legacy_homes(self):
+        router = Router(PlacementService(make_demo_placement()))
+        shard, _, _, msg = router.resolve_home("u-123", Dependencies())
+        self.assertEqual(msg, "OK")
+        self.assertEqual(shard, hrw_shard_for_user("u-123", ACTIVE_SHARDS))
+
+
+class TestWeightedHrw(unittest.TestCase):
+
+    def setUp(self):
+        self.weights = {ACTIVE_SHARDS[0]: 0.5, ACTIVE_SHARDS[1]: 2.0}
+        self.users = [f"user-{i}" for i in range(1500)]
+
+    def test_engine_matches_weighted_reference(self):
+        eng = HrwEngine(ACTIVE_SHARDS, "legacy", self.weights)
+        for uid in self.users[:300]:
+            self.assertEqual(eng.shard_for(uid), hrw_shard_for_user(uid, ACTIVE_SHARDS, self.weights))
+
+    def test_uniform_weights_keep_unweighted_assignments(self):
+        eng = HrwEngine(ACTIVE_SHARDS, "legacy", {sid: 3.0 for sid in ACTIVE_SHARDS})
+        self.assertIsNone(eng.weights)
+        for uid in self.users[:200]:
+            self.assertEqual(eng.shard_for(uid), hrw_shard_for_user(uid, ACTIVE_SHARDS))
+
+    def test_reference_accepts_a_generator_of_shards(self):
+        for weights in (self.weights, {sid: 3.0 for sid in ACTIVE_SHARDS}):
+            for uid in self.users[:50]:
+                self.assertEqual(hrw_shard_for_user(uid, (sid for sid in ACTIVE_SHARDS), weights),
+                                 hrw_shard_for_user(uid, ACTIVE_SHARDS, weights))
+
+    def test_weight_change_moves_only_onto_that_shard(self):
+        sid = ACTIVE_SHARDS[5]
+        before = HrwEngine(ACTIVE_SHARDS, "fast", self.weights).shards_for(self.users)
+        after = HrwEngine(ACTIVE_SHARDS, "fast", dict(self.weights, **{sid: 3.0})).shards_for(self.users)
+        moved = [(a, b) for a, b in zip(before, after) if a != b]
+        self.assertTrue(moved)
+        self.assertTrue(all(b == sid for _, b in moved))
+
+    def test_fast_weighted_batch_matches_scalar(self):
+        eng = HrwEngine(ACTIVE_SHARDS, "fast", self.weights)
+        self.assertEqual(list(eng.shards_for(self.users)), [eng.shard_for(u) for u in self.users])
+
+    def test_router_follows_snapshot_weights(self):
+        svc = PlacementService(make_demo_placement())
+        router = Router(svc)
+        uid = next(u for u in self.users if hrw_shard_for_user(u, ACTIVE_SHARDS) == ACTIVE_SHARDS[3])
+        svc.set_weight(ACTIVE_SHARDS[3], 0.0)
+        shard, _, _, _ = router.resolve_home(uid, Dependencies())
+        self.assertNotEqual(shard, ACTIVE_SHARDS[3])
+
+
+class TestHomeShardCache(unittest.TestCase):
+
+    def test_hits_after_first_lookup(self):
+        router = Router(PlacementService(make_demo_placement()))
+        for _ in range(3):
+            shard, _, _, _ = router.resolve_home("u-123", Dependencies())
+        stats = router.home_cache_stats()
+        self.assertEqual((stats["misses"], stats["hits"]), (1, 2))
+        self.assertEqual(shard, hrw_shard_for_user("u-123", ACTIVE_SHARDS))
+
+    def test_clock_eviction_keeps_capacity(self):
+        cache = HomeShardCache(capacity=4)
+        cache.check_version(1)
+        for i in range(10):
+            cache.put(f"u{i}", i)
+        self.assertEqual(len(cache), 4)
+        self.assertEqual(cache.evictions, 6)
+        self.assertEqual(cache.get("u9"), 9)
+
+    def test_shard_set_change_invalidates(self):
+        svc = PlacementService(make_demo_placement())
+        router = Router(svc)
+        router.resolve_home("u-123", Dependencies())
+        extra = "shard-065"
+        svc.set_shards(ACTIVE_SHARDS + [extra], {extra: {"region": "us", "cell": "us-cell-2"}})
+        shard, _, _, _ = router.resolve_home("u-123", Dependencies())
+        self.assertEqual(shard, hrw_shard_for_user("u-123", ACTIVE_SHARDS + [extra]))
+        self.assertEqual(router.home_cache_stats()["invalidations"], 1)
+
+
+class TestPlacementSnapshots(unittest.TestCase):
+
+    def test_snapshot_shared_and_read_only(self):
+        svc = PlacementService(make_demo_placement())
+        snap = svc.get_snapshot()
+        self.assertIs(snap, svc.get_snapshot())
+        with self.assertRaises(TypeError):
+            snap.placement[ACTIVE_SHARDS[0]] = {"region": "x", "cell": "x"}
+        with self.assertRaises(TypeError):
+            snap.placement[ACTIVE_SHARDS[0]]["cell"] = "x"
+
+    def test_move_publishes_delta_and_keeps_old_version(self):
+        svc = PlacementService(make_demo_placement())
+        old = svc.get_snapshot()
+        seen = []
+        unsubscribe = svc.subscribe(lambda snap, delta: seen.append(delta))
+        svc.move_shard(ACTIVE_SHARDS[0], "eu", "eu-cell-2")
+        unsubscribe()
+        svc.move_shard(ACTIVE_SHARDS[1], "us", "us-cell-2")
+        self.assertEqual(len(seen), 1)
+        self.assertEqual((seen[0].from_version, seen[0].to_version), (1, 2))
+        self.assertEqual(dict(seen[0].changes[ACTIVE_SHARDS[0]]), {"region": "eu", "cell": "eu-cell-2"})
+        self.assertEqual(old.placement[ACTIVE_SHARDS[0]]["cell"], "us-cell-1")
+        self.assertEqual(set(svc.changes_since(1)), {ACTIVE_SHARDS[0], ACTIVE_SHARDS[1]})
+        self.assertEqual(svc.changes_since(3), {})
+
+    def test_router_swaps_pointer_on_update(self):
+        svc = PlacementService(make_demo_placement())
+        router = Router(svc)
+        shard, _, v1, _ = router.resolve_home("u-123", Dependencies())
+        svc.move_shard(shard, "eu", "eu-cell-9")
+        self.assertIs(router.placement.snapshot, svc.get_snapshot())
+        _, loc, v2, _ = router.resolve_home("u-123", Dependencies())
+        self.assertEqual((v2, loc["cell"]), (v1 + 1, "eu-cell-9"))
+        router.close()
+        svc.move_shard(shard, "us", "us-cell-1")
+        self.assertEqual(router.placement.snapshot.version, v2)
+
+
+class ManualExecutor:
+    """Queues submitted work until the test runs it."""
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, fn, *args):
+        self.jobs.append((fn, args))
+
+    def run_all(self):
+        jobs, self.jobs = self.jobs, []
+        for fn, args in jobs:
+            fn(*args)
+
+
+class TestPlacementCache(unittest.TestCase):
+
+    def setUp(self):
+        self.svc = PlacementService(make_demo_placement())
+        self.now = [1000.0]
+        self.fetches = 0
+        self.executor = ManualExecutor()
+
+        def fetch():
+            self.fetches += 1
+            return self.svc.get_snapshot()
+        self.cache = PlacementCache(fetch, ttl=30, refresh_ahead=5, max_stale=60,
+                                    executor=self.executor, clock=lambda: self.now[0])
+
+    def test_cold_start_fetches_once(self):
+        snap, msg = self.cache.get()
+        self.assertEqual((snap.version, msg, self.fetches), (1, "OK: placement fresh", 1))
+        self.cache.get()
+        self.assertEqual(self.fetches, 1)
+
+    def test_refresh_ahead_is_async_and_coalesced(self):
+        self.cache.get()
+        self.now[0] += 26
+        for _ in range(50):
+            snap, _ = self.cache.get()
+            self.assertEqual(snap.version, 1)
+        self.assertEqual((self.fetches, len(self.executor.jobs)), (1, 1))
+        self.svc.move_shard(ACTIVE_SHARDS[0], "eu", "eu-cell-2")
+        self.executor.run_all()
+        self.assertEqual(self.fetches, 2)
+        self.assertEqual(self.cache.get()[0].version, 2)
+        self.assertEqual(self.cache.stats()["coalesced"], 49)
+
+    def test_bounded_stale_window_when_placement_down(self):
+        self.cache.get()
+        self.now[0] += 45
+        snap, msg = self.cache.get(placement_ok=False)
+        self.assertIsNotNone(snap)
+        self.assertTrue(msg.startswith("OK: placement stale"))
+        self.now[0] += 50
+        snap, msg = self.cache.get(placement_ok=False)
+        self.assertIsNone(snap)
+        self.assertEqual(msg, "DENY: placement unavailable and cache stale")
+        stats = self.cache.stats()
+        self.assertEqual((stats["stale_serves"], stats["denials"], stats["max_stale_age_sec"]), (1, 1, 45))
+        self.assertEqual(self.executor.jobs, [])
+
+
+class TestBatchRouting(unittest.TestCase):
+
+    def setUp(self):
+        self.svc = PlacementService(make_demo_placement())
+        self.users = [User(f"user-{i}", "eu" if i % 3 else "us") for i in range(500)]
+        self.health = CellHealth(cell_ok={"us-cell-1": True, "eu-cell-1": False})
+
+    def test_write_many_matches_route_write(self):
+        for mode in ("legacy", "fast"):
+            for op in ("low_value_action", "transfer"):
+                groups = Router(self.svc, hash_mode=mode).route_write_many(self.users, op, Dependencies(), self.health)
+                single = Router(self.svc, hash_mode=mode)
+                self.assertEqual(sum(len(g.users) for g in groups.values()), len(self.users))
+                for (shard, cell), g in groups.items():
+                    self.assertEqual((g.shard, g.cell), (shard, cell))
+                    for p, user in zip(g.positions, g.users):
+                        self.assertIs(self.users[p], user)
+                        decision, reason, s, pv = single.route_write(user, op, Dependencies(), self.health)
+                        self.assertEqual((decision, reason, s, pv), (g.decision, g.reason, g.shard, g.placement_version))
+
+    def test_write_many_batch_wide_failure(self):
+        groups = Router(self.svc).route_write_many(self.users, "transfer", Dependencies(risk_ok=False), self.health)
+        self.assertEqual(list(groups), [(None, None)])
+        self.assertEqual(groups[(None, None)].reason, "DENY: risk unavailable (Tier-2 fail closed)")
+        self.assertEqual(len(groups[(None, None)].positions), len(self.users))
+
+    def test_read_many_splits_local_and_home(self):
+        router = Router(self.svc)
+        groups = router.route_read_many(self.users, "view_pii", "eu", Dependencies())
+        local = groups.pop((None, "eu"))
+        self.assertTrue(all(u.residency == "eu" for u in local.users))
+        for g in groups.values():
+            for user in g.users:
+                self.assertEqual(router.route_read(user, "view_pii", "eu", Dependencies()), (True, g.reason))
+        self.assertEqual(len(local.users) + sum(len(g.users) for g in groups.values()), len(self.users))
+
+
+class TestCompiledDepsGate(unittest.TestCase):
+
+    def assert_matches_reference(self):
+        for op in list(OP_TIER) + list(REQUIRES) + ["not_an_op"]:
+            for mask in range(1 << len(DEP_FLAGS)):
+                deps = deps_from_mask(mask)
+                self.assertEqual(deps_mask(deps), mask)
+                self.assertEqual(deps_ok_for(op, deps), deps_ok_for_reference(op, deps), (op, deps))
+
+    def test_every_op_and_health_mask(self):
+        self.assert_matches_reference()
+
+    def test_rebuilds_when_tables_change(self):
+        builds = common_infra_v2.GATE_BUILDS
+        deps_ok_for("view_public", Dependencies())
+        OP_TIER["new_op"] = "TIER_1"
+        REQUIRES["new_op"] = {"auth", "kms"}
+        REQUIRES["view_public"] = {"auth", "audit"}
+        try:
+            self.assertIsInstance(REQUIRES["new_op"], frozenset)
+            self.assertEqual(deps_ok_for("new_op", Dependencies(kms_ok=False)), (False, "DENY: KMS unavailable"))
+            self.assertEqual(deps_ok_for("view_public", Dependencies(audit_ok=False)), (True, "ALLOW"))
+            self.assert_matches_reference()
+        finally:
+            del OP_TIER["new_op"]
+            del REQUIRES["new_op"]
+            REQUIRES["view_public"] = {"auth"}
+        self.assertGreater(common_infra_v2.GATE_BUILDS, builds)
+        self.assert_matches_reference()
+
+
+    def test_in_place_union_rebuilds(self):
+        deps_ok_for("view_public", Dependencies())
+        builds = common_infra_v2.GATE_BUILDS
+        tier, req = OP_TIER, REQUIRES
+        tier |= {"new_op": "TIER_1"}
+        req |= {"new_op": {"auth", "kms"}}
+        try:
+            self.assertIs(tier, OP_TIER)
+            self.assertIsInstance(REQUIRES["new_op"], frozenset)
+            self.assertEqual(deps_ok_for("new_op", Dependencies(kms_ok=False)), (False, "DENY: KMS unavailable"))
+            self.assertGreater(common_infra_v2.GATE_BUILDS, builds)
+        finally:
+            del OP_TIER["new_op"]
+            del REQUIRES["new_op"]
+        self.assert_matches_reference()
+
+class TestRateLimiter(unittest.TestCase):
+
+    def trace(self, backend, events):
+        cp = CoarseProtections(backend)
+        return [cp.check(uid, op, t) for uid, op, t in events]
+
+    def test_log_matches_deque_on_bursts(self):
+        events = [("u1", "low_value_action", 0.0)] * 65 + [("u1", "low_value_action", 61.0)]
+        events += [("u2", "transfer", 10.0 + i) for i in range(5)] + [("u2", "transfer", 700.0)]
+        self.assertEqual(self.trace("log", events), self.trace("deque", events))
+        self.assertEqual(self.trace("log", events)[60], (False, "DENY: coarse rate limit"))
+        self.assertEqual(self.trace("log", events)[-3], (False, "DENY: coarse high-risk velocity"))
+
+    def test_log_matches_deque_where_gcra_is_looser(self):
+        steady = [("u1", "low_value_action", 0.5 * i) for i in range(120)]
+        spaced = [("u2", "transfer", t) for t in (0.0, 0.0, 0.0, 200.0, 400.0, 600.0, 600.5)]
+        edge = [("u3", "low_value_action", 0.0)] * 60 + [("u3", "low_value_action", t) for t in (60.0, 60.01)]
+        for events in (steady, spaced, edge):
+            self.assertEqual(self.trace("log", events), self.trace("deque", events))
+        self.assertEqual(sum(ok for ok, _ in self.trace("deque", steady)), 60)
+        self.assertEqual(sum(ok for ok, _ in self.trace("gcra", steady)), 119)
+        self.assertEqual([ok for ok, _ in self.trace("log", spaced)], [True, True, True, False, False, False, True])
+        self.assertEqual([ok for ok, _ in self.trace("gcra", spaced)][:5], [True] * 5)
+        self.assertEqual([ok for ok, _ in self.trace("log", edge)][-2:], [False, True])
+
+    def test_log_matches_deque_on_random_traces(self):
+        import random
+        rng = random.Random(5)
+        t, events = 0.0, []
+        for _ in range(5000):
+            t += rng.choice((0.0, 0.0, 0.1, 0.5, 1.0, 5.0, 30.0, 120.0))
+            events.append((f"u{rng.randrange(4)}", rng.choice(("low_value_action", "transfer", "view_pii")), t))
+        self.assertEqual(self.trace("log", events), self.trace("deque", events))
+    def test_gcra_refills_at_steady_rate(self):
+        lim = GcraLimiter(limit=60, window=60)
+        self.assertEqual(sum(lim.allow("u", 0.0) for _ in range(61)), 60)
+        self.assertFalse(lim.allow("u", 0.5))
+        self.assertTrue(lim.allow("u", 1.0))
+
+    def test_idle_keys_evicted(self):
+        for backend in ("log", "gcra"):
+            cp = CoarseProtections(backend)
+            for i in range(1000):
+                cp.check(f"user-{i}", "transfer", 0.0)
+                cp.check(f"user-{i}", "transfer", 1.0)
+            self.assertEqual(cp.tracked_keys(), 2000)
+            cp.check("late", "view_public", 700.0)
+            self.assertEqual(cp.tracked_keys(), 1)
+
+    def test_sharded_variant(self):
+        sharded = ShardedCoarseProtections(shards=4)
+        results = [sharded.check("u1", "low_value_action", 0.0) for _ in range(61)]
+        self.assertEqual(results[-1], (False, "DENY: coarse rate limit"))
+        self.assertTrue(all(ok for ok, _ in results[:60]))
+
+
+class FullScanIdempotencyStore:
+    """The original store: scans every key on every call."""
+    def __init__(self):
+        self._store = {}
+
+    def get_or_record(self, user_id, op, idem_key, ph, compute_response_fn, now, ttl_sec=24 * 3600):
+        for k in [k for k, (_, __, ts) in self._store.items() if now - ts > ttl_sec]:
+            del self._store[k]
+        if not idem_key:
+            return False, None, "DENY: missing idempotency key"
+        k = (user_id, op, idem_key)
+        if k in self._store:
+            prev_ph, resp, _ = self._store[k]
+            if prev_ph != ph:
+                return False, None, "DENY: idempotency key reused with different payload"
+            return True, resp, "ALLOW: idempotent replay (cached response)"
+        resp = compute_response_fn()
+        self._store[k] = (ph, resp, now)
+        return True, resp, "ALLOW: recorded idempotency"
+
+
+class TestIdempotencyExpiry(unittest.TestCase):
+
+    def test_matches_full_scan_store(self):
+        import random
+        rng = random.Random(3)
+        ref, store = FullScanIdempotencyStore(), IdempotencyStore(gc_budget=2)
+        now = 0.0
+        for i in range(5000):
+            now += rng.random() * 5
+            args = (f"u{rng.randrange(20)}", "transfer", f"k{rng.randrange(30)}" if i % 50 else "",
+                    payload_hash(str(rng.randrange(2))))
+            resp = {"n": i}
+            self.assertEqual(store.get_or_record(*args, lambda: resp, now, ttl_sec=300),
+                             ref.get_or_record(*args, lambda: resp, now, ttl_sec=300))
+
+    def test_gc_is_bounded_per_call(self):
+        store = IdempotencyStore(gc_budget=10)
+        for i in range(100):
+            store.get_or_record("u", "transfer", f"k{i}", "ph", dict, 0.0, ttl_sec=60)
+        store.get_or_record("u", "transfer", "new", "ph", dict, 100.0, ttl_sec=60)
+        self.assertEqual(len(store), 91)
+        self.assertEqual(store.expire(100.0, ttl_sec=60), 90)
+        self.assertEqual(len(store), 1)
+
+    def test_rerecorded_key_survives_its_old_wheel_entry(self):
+        store = IdempotencyStore(gc_budget=0)
+        store.get_or_record("u", "transfer", "k", "a", lambda: "first", 0.0, ttl_sec=60)
+        self.assertEqual(store.get_or_record("u", "transfer", "k", "b", lambda: "second", 61.0, ttl_sec=60),
+                         (True, "second", "ALLOW: recorded idempotency"))
+        store.expire(100.0, ttl_sec=60)
+        self.assertEqual(store.get_or_record("u", "transfer", "k", "b", lambda: "third", 100.0, ttl_sec=60)[1], "second")
+
+
+class TestDurableIdempotency(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_survives_restart(self):
+        from durable_idempotency_v2 import SqliteIdempotencyBackend
+        store = IdempotencyStore(SqliteIdempotencyBackend(self.dir))
+        ph = payload_hash("p")
+        self.assertEqual(store.get_or_record("u1", "transfer", "k1", ph, lambda: {"id": 7}, 10.0)[2],
+                         "ALLOW: recorded idempotency")
+        store.close()
+
+        store = IdempotencyStore(SqliteIdempotencyBackend(self.dir))
+        self.assertEqual(store.get_or_record("u1", "transfer", "k1", ph, lambda: {"id": 8}, 20.0),
+                         (True, {"id": 7}, "ALLOW: idempotent replay (cached response)"))
+        self.assertEqual(store.get_or_record("u1", "transfer", "k1", payload_hash("q"), dict, 20.0)[2],
+                         "DENY: idempotency key reused with different payload")
+        self.assertEqual(store.get_or_record("u1", "transfer", "k1", ph, lambda: {"id": 9}, 10.0 + 86401)[1], {"id": 9})
+        store.close()
+
+    def test_same_response_from_every_layer(self):
+        from durable_idempotency_v2 import SqliteIdempotencyBackend
+        backend = SqliteIdempotencyBackend(self.dir, durable=False, checkpoint_rows=10**9, checkpoint_sec=3600)
+        k, expect = ("u1", "transfer", "k1"), ("ph", {"ids": [1, 2], "ok": True}, 1.0)
+        backend.put(k, ("ph", {"ids": (1, 2), "ok": True}, 1.0))
+        self.assertEqual(backend.get(k), expect)       # pending
+        backend.flush()
+        self.assertEqual(backend.get(k), expect)       # logged, not checkpointed
+        backend.close()
+        backend = SqliteIdempotencyBackend(self.dir)
+        self.assertEqual(backend.get(k), expect)       # shard file
+        with self.assertRaises(TypeError):
+            backend.put(("u2", "transfer", "k"), ("ph", {1, 2}, 1.0))
+        backend.close()
+
+    def test_refuses_a_different_shard_layout(self):
+        from durable_idempotency_v2 import SqliteIdempotencyBackend
+        SqliteIdempotencyBackend(self.dir, shards=ACTIVE_SHARDS[:8]).close()
+        for kwargs in (dict(shards=ACTIVE_SHARDS), dict(shards=ACTIVE_SHARDS[:8], hash_mode="fast"),
+                       dict(shards=ACTIVE_SHARDS[:8], weights={ACTIVE_SHARDS[0]: 2.0})):
+            with self.assertRaises(ValueError):
+                SqliteIdempotencyBackend(self.dir, **kwargs)
+        # uniform weights route exactly like none
+        SqliteIdempotencyBackend(self.dir, shards=ACTIVE_SHARDS[:8], weights={s: 3.0 for s in ACTIVE_SHARDS}).close()
+
+    def test_log_replayed_after_crash(self):
+        import sqlite3
+        from durable_idempotency_v2 import SqliteIdempotencyBackend
+        crashed = SqliteIdempotencyBackend(self.dir, checkpoint_rows=10**9, checkpoint_sec=3600)
+        users = [f"user-{i}" for i in range(50)]
+        for u in users:
+            crashed.put((u, "transfer", "k"), ("ph", {"u": u}, 1.0))
+        # no close(): rows are only in the log
+        fresh = SqliteIdempotencyBackend(self.dir)
+        self.assertEqual(fresh.stats()["recovered"], 50)
+        for u in users:
+            self.assertEqual(fresh.get((u, "transfer", "k")), ("ph", {"u": u}, 1.0))
+        path = os.path.join(self.dir, f"idem-{fresh.shard_for(users[0])}.db")
+        fresh.close()
+        crashed.close()
+        rows = sqlite3.connect(path).execute("SELECT user_id FROM idem").fetchall()
+        self.assertIn((users[0],), rows)
+
+
+class TestDrainScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.svc = PlacementService(make_demo_placement())
+        self.queue = WriteQueue()
+        self.health = CellHealth(cell_ok={"us-cell-1": True, "eu-cell-1": True})
+        self.writes = []
+        self.lock = threading.Lock()
+
+    def bulk_write(self, shard, events):
+        with self.lock:
+            self.writes.append((shard, list(events)))
+
+    def add(self, user, n, shard=ACTIVE_SHARDS[0], payload="x", at=0.0):
+        for i in range(n):
+            self.queue.enqueue(WriteEvent(user, "low_value_action", payload, f"{user}-{i}", at, shard, 1))
+
+    def test_heavy_user_does_not_starve_light_users(self):
+        self.add("heavy", 1000)
+        for i in range(20):
+            self.add(f"light-{i}", 2)
+        sched = DrainScheduler(self.queue, self.svc.get_snapshot, quantum_bytes=4, round_events=64, clock=lambda: 1.0)
+        report = sched.run(self.bulk_write, self.health, max_rounds=1)
+        first_round = [ev.user_id for _, evs in self.writes for ev in evs]
+        self.assertEqual(sum(1 for u in first_round if u.startswith("light-")), 40)
+        self.assertEqual(first_round.count("heavy"), 4)  # one quantum per DRR pass
+        self.assertEqual(report.remaining, 1000 - 4)
+        self.assertEqual((report.blocked, report.budget_exhausted), (0, 1000 - 4))
+
+    def test_budget_exhausted_reported_apart_from_blocked(self):
+        eu_shard = next(s for s, loc in self.svc.get_snapshot().placement.items() if loc["cell"] == "eu-cell-1")
+        self.add("us-user", 10)
+        self.add("eu-user", 3, eu_shard)
+        health = CellHealth(cell_ok={"us-cell-1": True, "eu-cell-1": False})
+        sched = DrainScheduler(self.queue, self.svc.get_snapshot, quantum_bytes=2, clock=lambda: 1.0)
+        report = sched.run(self.bulk_write, health, max_rounds=2)
+        self.assertEqual((report.processed, report.blocked, report.budget_exhausted), (4, 3, 6))
+        report = sched.run(self.bulk_write, health)
+        self.assertEqual((report.processed, report.blocked, report.budget_exhausted), (6, 3, 0))
+
+    def test_groups_by_shard_and_keeps_order(self):
+        for i in range(300):
+            shard = ACTIVE_SHARDS[i % 4]
+            self.queue.enqueue(WriteEvent(f"user-{i % 7}", "low_value_action", "x", str(i), 0.0, shard, 1))
+        report = DrainScheduler(self.queue, self.svc.get_snapshot, batch_max=50, clock=lambda: 1.0).run(
+            self.bulk_write, self.health)
+        self.assertEqual((report.processed, report.remaining, len(self.queue)), (300, 0, 0))
+        self.assertEqual(report.time_to_empty_sec, report.elapsed_sec)
+        for shard, evs in self.writes:
+            self.assertLessEqual(len(evs), 50)
+            self.assertTrue(all(ev.target_shard == shard for ev in evs))
+        for user in {f"user-{i}" for i in range(7)}:
+            keys = [int(ev.idem_key) for _, evs in self.writes for ev in evs if ev.user_id == user]
+            for shard in ACTIVE_SHARDS[:4]:
+                per_shard = [k for k in keys if ACTIVE_SHARDS[k % 4] == shard]
+                self.assertEqual(per_shard, sorted(per_shard))
+
+    def test_cell_concurrency_cap_and_down_cell(self):
+        us_shards = [s for s, loc in self.svc.get_snapshot().placement.items() if loc["cell"] == "us-cell-1"]
+        eu_shards = [s for s, loc in self.svc.get_snapshot().placement.items() if loc["cell"] == "eu-cell-1"]
+        for i, shard in enumerate(us_shards):
+            self.add(f"us-{i}", 5, shard)
+        self.add("eu-user", 5, eu_shards[0])
+        health = CellHealth(cell_ok={"us-cell-1": True, "eu-cell-1": False})
+        release = threading.Event()
+
+        def slow_write(shard, events):
+            release.wait(0.01)
+            self.bulk_write(shard, events)
+
+        report = DrainScheduler(self.queue, self.svc.get_snapshot, cell_concurrency=2, clock=lambda: 1.0).run(
+            slow_write, health)
+        self.assertLessEqual(report.max_in_flight["us-cell-1"], 2)
+        self.assertEqual(report.per_cell, {"us-cell-1": 5 * len(us_shards)})
+        self.assertEqual((report.blocked, report.remaining), (5, 5))
+
+    def test_ttl_drop_and_failed_batch_requeued(self):
+        self.add("old", 3, at=0.0)
+        self.add("new", 3, at=QUEUE_ITEM_TTL_SEC)
+
+        def failing(shard, events):
+            raise RuntimeError("shard down")
+
+        sched = DrainScheduler(self.queue, self.svc.get_snapshot, clock=lambda: QUEUE_ITEM_TTL_SEC + 10.0)
+        report = sched.run(failing, self.health)
+        self.assertEqual((report.processed, report.dropped, report.remaining), (0, 3, 3))
+        self.assertEqual([ev.idem_key for ev in self.queue.user_queue("new")], ["new-0", "new-1", "new-2"])
+        report = sched.run(self.bulk_write, self.health)
+        self.assertEqual((report.processed, report.remaining), (3, 0))
+
+
+class TestWriteWal(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def events(self, n, users=7):
+        return [WriteEvent(f"user-{i % users}", "low_value_action", f"p{i}", f"k{i}", float(i),
+                           ACTIVE_SHARDS[i % 4], 1) for i in range(n)]
+
+    def test_restart_rebuilds_queues_without_acked_events(self):
+        from write_wal_v2 import SegmentedWal
+        queue = WriteQueue(SegmentedWal(self.dir, segment_bytes=2048))
+        for ev in self.events(100):
+            queue.enqueue(ev)
+        self.assertEqual(queue.drain("user-0", 100.0, lambda ev: None, rate_limit=10), (10, 0))
+        queue.wal.close()
+
+        reopened = WriteQueue(SegmentedWal(self.dir, segment_bytes=2048))
+        self.assertEqual(len(reopened), 90)
+        self.assertEqual([ev.idem_key for ev in reopened.user_queue("user-0")], ["k70", "k77", "k84", "k91", "k98"])
+        self.assertEqual(list(reopened.user_queue("user-3"))[0],
+                         WriteEvent("user-3", "low_value_action", "p3", "k3", 3.0, ACTIVE_SHARDS[3], 1, seq=4))
+        ev = WriteEvent("user-9", "transfer", "x", "new", 200.0, ACTIVE_SHARDS[0], 2)
+        reopened.enqueue(ev)
+        self.assertEqual(ev.seq, 101)
+        reopened.wal.close()
+
+    def test_drained_segments_are_deleted(self):
+        from write_wal_v2 import SegmentedWal
+        wal = SegmentedWal(self.dir, segment_bytes=1024)
+        queue = WriteQueue(wal)
+        for ev in self.events(200):
+            queue.enqueue(ev)
+        wal.sync()
+        segments = len(os.listdir(self.dir))
+        self.assertGreater(segments, 5)
+        sched = DrainScheduler(queue, PlacementService(make_demo_placement()).get_snapshot, clock=lambda: 300.0)
+        health = CellHealth(cell_ok={"us-cell-1": True, "eu-cell-1": True})
+        self.assertEqual(sched.run(lambda shard, evs: None, health).processed, 200)
+        wal.compact()
+        self.assertEqual((len(wal), len(os.listdir(self.dir))), (0, 1))
+        self.assertEqual(wal.stats()["segments_deleted"], segments - 1)
+        wal.close()
+        self.assertEqual(len(WriteQueue(SegmentedWal(self.dir))), 0)
+
+    def test_torn_tail_is_cut(self):
+        from write_wal_v2 import SegmentedWal
+        wal = SegmentedWal(self.dir)
+        queue = WriteQueue(wal)
+        for ev in self.events(10):
+            queue.enqueue(ev)
+        wal.close()
+        path = os.path.join(self.dir, os.listdir(self.dir)[0])
+        size = os.path.getsize(path)
+        os.truncate(path, size - 5)  # crash in the middle of the last record
+        wal = SegmentedWal(self.dir)
+        self.assertEqual((wal.stats()["recovered"], wal.stats()["torn_bytes"]), (9, size - 5 - os.path.getsize(path)))
+        self.assertEqual([ev.idem_key for ev in wal.replay()], [f"k{i}" for i in range(9)])
+        wal.close()
+
+
+class TestDrainRerouting(unittest.TestCase):
+
+    def setUp(self):
+        self.svc = PlacementService(make_demo_placement())
+        self.router = Router(self.svc)
+        self.queue = WriteQueue()
+        self.health = CellHealth(cell_ok={"us-cell-1": True, "eu-cell-1": True})
+        self.written = []
+
+    def bulk_write(self, shard, events):
+        self.written.extend((shard, ev) for ev in events)
+
+    def enqueue_homes(self, n, tag="k"):
+        snap = self.svc.get_snapshot()
+        for i in range(n):
+            uid = f"user-{i}"
+            self.queue.enqueue(WriteEvent(uid, "low_value_action", "x", f"{tag}{i}", 0.0,
+                                          self.router.home_shard(uid, snap), snap.version))
+
+    def drain(self):
+        return DrainScheduler(self.queue, router=self.router, clock=lambda: 1.0).run(self.bulk_write, self.health)
+
+    def test_coalesces_same_idempotency_key(self):
+        self.enqueue_homes(50)
+        self.enqueue_homes(50)   # client retries of the same writes
+        self.enqueue_homes(10, tag="other")
+        report = self.drain()
+        self.assertEqual((report.processed, report.coalesced, report.remaining), (60, 50, 0))
+        self.assertEqual(len({(ev.user_id, ev.idem_key) for _, ev in self.written}), 60)
+
+    def test_moved_shard_follows_new_cell(self):
+        self.enqueue_homes(200)
+        eu_shards = {s for s, loc in self.svc.get_snapshot().placement.items() if loc["cell"] == "eu-cell-1"}
+        for shard in eu_shards:
+            self.svc.move_shard(shard, "us", "us-cell-1")   # evacuate eu-cell-1 while it is down
+        self.health.cell_ok["eu-cell-1"] = False
+        report = self.drain()
+        self.assertEqual((report.processed, report.remaining, report.rerouted), (200, 0, 0))
+        self.assertEqual(report.moved, sum(1 for shard, _ in self.written if shard in eu_shards))
+        self.assertGreater(report.moved, 0)
+        self.assertEqual(report.reroute_batches, 1)
+        self.assertEqual(report.per_cell, {"us-cell-1": 200})
+
+    def test_shard_set_change_rerouted_in_bulk_per_version(self):
+        calls = []
+        delta_since = self.svc.delta_since
+        self.svc.delta_since = lambda *a: calls.append(a) or delta_since(*a)
+        self.enqueue_homes(300)
+        self.svc.set_weight(ACTIVE_SHARDS[0], 0.0)
+        self.enqueue_homes(300, tag="v2-")
+        self.svc.set_weight(ACTIVE_SHARDS[1], 0.0)
+        report = self.drain()
+        snap = self.svc.get_snapshot()
+        self.assertEqual(report.processed, 600)
+        self.assertEqual((report.reroute_batches, len(calls)), (2, 2))
+        self.assertGreater(report.rerouted, 0)
+        for shard, ev in self.written:
+            self.assertEqual(shard, Router(self.svc).home_shard(ev.user_id, snap))
+            self.assertEqual(ev.placement_version, snap.version)
+            self.assertNotIn(shard, ACTIVE_SHARDS[:2])
+
+    def test_split_user_keeps_its_sub_shards_across_a_shard_set_change(self):
+        hot = HotUsers()
+        hot.promote("whale", 4)
+        self.router = Router(self.svc, hot_users=hot)
+        deps = Dependencies()
+        for i in range(8):
+            shard, _, pv, _ = self.router.resolve_home("whale", deps, key=f"order-{i}")
+            self.queue.enqueue(WriteEvent("whale", "low_value_action", "x", f"order-{i}", 0.0, shard, pv))
+        subs = set(self.router.sub_shards("whale", self.svc.get_snapshot()))
+        self.svc.set_weight(next(s for s in ACTIVE_SHARDS if s not in subs), 0.5)   # unrelated shard
+        report = self.drain()
+        self.assertEqual((report.processed, report.reroute_batches, report.rerouted), (8, 1, 0))
+        for shard, ev in self.written:
+            self.assertEqual(shard, self.router.resolve_home("whale", deps, key=ev.idem_key)[0])
+        self.assertGreater(len({shard for shard, _ in self.written}), 1)
+
+    def test_log_gap_falls_back_to_bulk_resolve(self):
+        self.enqueue_homes(100)
+        self.svc.set_weight(ACTIVE_SHARDS[2], 0.0)
+        self.svc._deltas.clear()   # delta log no longer reaches the queued version
+        report = self.drain()
+        self.assertEqual((report.processed, report.reroute_batches), (100, 1))
+        self.assertTrue(all(shard != ACTIVE_SHARDS[2] for shard, _ in self.written))
+
+
+class TestShardSimulator(unittest.TestCase):
+
+    def test_matches_per_user_assignment(self):
+        import numpy as np
+        from shard_sim_v2 import simulate
+        users = 20_000
+        weights = {ACTIVE_SHARDS[0]: 0.5, ACTIVE_SHARDS[1]: 2.0}
+        res = simulate(users, ACTIVE_SHARDS, ids="exact", s=1.1, weights=weights, chunk=3_000)
+        eng = HrwEngine(ACTIVE_SHARDS, "fast", weights)
+        idx = [eng.index_for(f"user-{i}") for i in range(users)]
+        self.assertEqual(res["counts"].tolist(), np.bincount(idx, minlength=len(ACTIVE_SHARDS)).tolist())
+        load = np.bincount(idx, weights=np.arange(1, users + 1) ** -1.1, minlength=len(ACTIVE_SHARDS))
+        self.assertTrue(np.allclose(res["load"], load / load.sum()))
+        self.assertEqual(int(res["top_rank"][idx[0]]), 1)
+
+    def test_gini_and_hot_shards(self):
+        import numpy as np
+        from shard_sim_v2 import gini, summarize
+        self.assertAlmostEqual(gini([5, 5, 5, 5]), 0.0)
+        self.assertAlmostEqual(gini([0, 0, 0, 8]), 0.75)
+        shards = ACTIVE_SHARDS[:4]
+        st = summarize(np.array([1.0, 1.0, 1.0, 3.0]), shards)
+        self.assertEqual((st["hot"], st["max"]), ([shards[3]], 2.0))
+        # a shard carrying its weighted share is not hot
+        self.assertEqual(summarize(np.array([1.0, 1.0, 1.0, 3.0]), shards, {shards[3]: 3.0})["hot"], [])
+
+
+class TestHotUsers(unittest.TestCase):
+
+    def test_count_min_never_undercounts(self):
+        import random
+        cms = CountMinSketch(width=64, depth=4)
+        rng = random.Random(5)
+        truth = Counter(rng.randrange(1000) for _ in range(20_000))
+        for k, n in truth.items():
+            cms.add(hash(f"k{k}") & (2**64 - 1), n)
+        for k, n in truth.items():
+            self.assertGreaterEqual(cms.estimate(hash(f"k{k}") & (2**64 - 1)), n)
+
+    def test_top_k_and_window_decay(self):
+        hh = HeavyHitters(k=3, window_sec=10)
+        for i in range(2000):
+            hh.observe(f"user-{i % 200}", 0.0)
+            if i % 4 == 0:
+                hh.observe("whale", 0.0)
+            if i % 10 == 0:
+                hh.observe("dolphin", 0.0)
+        self.assertEqual([u for u, _ in hh.top(2)], ["whale", "dolphin"])
+        self.assertEqual(dict(hh.top())["whale"], 500)
+        hh.observe("whale", 25.0)   # two windows later: counts halved twice
+        self.assertEqual(dict(hh.top())["whale"], 126)
+
+    def test_promotion_grows_in_powers_of_two(self):
+        hot = HotUsers(min_events=5000, sample_every=1, max_fanout=8)
+        for i in range(10_000):
+            hot.observe(f"user-{i % 1000}", 64, 0.0)
+        self.assertEqual(hot.users(), {})
+        for _ in range(3000):
+            hot.observe("whale", 64, 0.0)
+        self.assertEqual(hot.users(), {"whale": 8})
+        hot.promote("whale", 3)   # never shrinks
+        self.assertEqual(hot.fanout("whale"), 8)
+        self.assertEqual(hot.promotions, 1)
+
+    def test_router_splits_only_hot_users(self):
+        svc = PlacementService(make_demo_placement())
+        hot = HotUsers()
+        hot.promote("whale", 4)
+        router, plain = Router(svc, hot_users=hot), Router(svc)
+        health = CellHealth(cell_ok={"us-cell-1": True, "eu-cell-1": True})
+        snap = svc.get_snapshot()
+        for i in range(50):
+            user = User(f"user-{i}", "us")
+            self.assertEqual(router.route_write(user, "transfer", Dependencies(), health, key=f"k{i}"),
+                             plain.route_write(user, "transfer", Dependencies(), health))
+        whale = User("whale", "us")
+        subs = router.sub_shards("whale", snap)
+        self.assertEqual((len(subs), subs[0]), (4, plain.home_shard("whale", snap)))
+        self.assertEqual(router.read_shards("whale", Dependencies()), (subs, "OK"))
+        used = set()
+        for i in range(100):
+            shard = router.route_write(whale, "transfer", Dependencies(), health, key=f"order-{i}")[2]
+            self.assertEqual(shard, router.route_write(whale, "transfer", Dependencies(), health, key=f"order-{i}")[2])
+            used.add(shard)
+        self.assertEqual(used, set(subs))
+        self.assertEqual(router.route_write(whale, "transfer", Dependencies(), health)[2], subs[0])
+        hot.demote("whale")
+        self.assertEqual(router.read_shards("whale", Dependencies()), ((subs[0],), "OK"))
+
+    def test_batch_and_evaluator_paths_split_hot_users(self):
+        from degraded_mode_v2 import Evaluator
+        svc = PlacementService(make_demo_placement())
+        hot = HotUsers()
+        hot.promote("whale", 4)
+        router = Router(svc, hot_users=hot)
+        health = CellHealth(cell_ok={"us-cell-1": True, "eu-cell-1": True})
+        whale = User("whale", "us")
+        users, keys = [whale] * 40 + [User("minnow", "us")], [f"order-{i}" for i in range(41)]
+        groups = router.route_write_many(users, "transfer", Dependencies(), health, keys)
+        for g in groups.values():
+            for p in g.positions:
+                self.assertEqual(g.shard, router.route_write(users[p], "transfer", Dependencies(), health, key=keys[p])[2])
+        self.assertEqual(len({g.shard for g in groups.values() if g.users[0] is whale}), 4)
+        ev = Evaluator(router)
+        ev.coarse = CoarseProtections()
+        shards = set()
+        for i in range(40):
+            ok, msg = ev.write(whale, "low_value_action", "{}", f"order-{i}", Dependencies(), health)
+            self.assertTrue(ok, msg)
+            shards.add(msg.split()[1])
+            ev.coarse = CoarseProtections()   # keep the per-user rate limit out of the way
+        self.assertEqual(shards, set(router.sub_shards("whale", svc.get_snapshot())))
+
+    def test_detection_is_reproducible_across_processes(self):
+        import subprocess
+        import sys
+        code = ("from common_infra_v2 import HeavyHitters\n"
+                "hh = HeavyHitters(k=5, width=16, depth=2)\n"
+                "for i in range(3000): hh.observe(f'user-{i % 97}', 0.0)\n"
+                "print(hh.top())")
+        here = os.path.dirname(os.path.abspath(__file__))
+        outs = {subprocess.run([sys.executable, "-c", code], cwd=here, capture_output=True, text=True,
+                               env=dict(os.environ, PYTHONHASHSEED=str(seed))).stdout for seed in (1, 2)}
+        self.assertEqual(len(outs), 1)
+        self.assertIn("user-", outs.pop())
+
+
+class TestRebalancePlanner(unittest.TestCase):
+
+    def setUp(self):
+        from rebalance_planner_v2 import make_placement
+        self.svc = PlacementService(make_placement(ACTIVE_SHARDS[:8], 2), shards=ACTIVE_SHARDS[:8])
+
+    def test_moves_match_published_versions(self):
+        from rebalance_planner_v2 import plan_rebalance
+        users = [f"user-{i}" for i in range(5000)]
+        recorded = {}
+
+        def on_moves(step, who, src, dst):
+            recorded.setdefault(step, set()).update(zip(who.tolist(), src.tolist(), dst.tolist()))
+
+        # grow by 8 shards and drop 2, in several versions
+        plan = plan_rebalance(self.svc.get_snapshot(), len(users), ACTIVE_SHARDS[2:16], max_step_sec=0.3,
+                              chunk=1500, on_moves=on_moves, hash_mode="fast")
+        snaps = [self.svc.get_snapshot()]
+        self.svc.subscribe(lambda snap, delta: snaps.append(snap))
+        self.assertEqual(plan.apply(self.svc), [s.version for s in plan.steps])
+        homes = [HrwEngine(s.shards, "fast", dict(s.weights)).shards_for(users) for s in snaps]
+        self.assertEqual(homes[-1], HrwEngine(ACTIVE_SHARDS[2:16], "fast").shards_for(users))
+
+        kinds = [s.kind for s in plan.steps]
+        self.assertEqual((kinds[0], kinds[-1]), ("add_shards", "remove_shards"))
+        self.assertGreater(kinds.count("ramp_up"), 1)
+        shards = plan.steps[0].shards
+        ramps = [i for i, k in enumerate(kinds) if k.startswith("ramp")]
+        for k, i in enumerate(ramps):
+            expected = {(u, a, b) for u, (a, b) in enumerate(zip(homes[i], homes[i + 1])) if a != b}
+            self.assertEqual({(u, shards[a], shards[b]) for u, a, b in recorded.get(k, ())}, expected)
+            self.assertEqual(plan.steps[i].users_moved, len(expected))
+        for i in set(range(len(kinds))) - set(ramps):
+            self.assertEqual(homes[i], homes[i + 1])
+        # nobody moves twice
+        self.assertEqual(plan.users_moved, plan.direct_users_moved)
+        self.assertEqual(plan.direct_users_moved, sum(a != b for a, b in zip(homes[0], homes[-1])))
+
+    def test_evacuation_respects_cell_bandwidth(self):
+        from rebalance_planner_v2 import plan_rebalance
+        plan = plan_rebalance(self.svc.get_snapshot(), 3000, ACTIVE_SHARDS[:12], evacuate=["us-cell-2"],
+                              ids="synthetic", max_step_sec=0.5, hash_mode="fast")
+        plan.apply(self.svc)
+        snap = self.svc.get_snapshot()
+        self.assertEqual({snap.placement[s]["cell"] for s in snap.shards}, {"us-cell-1"})
+        self.assertAlmostEqual(sum(plan.shard_bytes_after.values()), sum(plan.shard_bytes_before.values()))
+        self.assertIn("move_shards", [s.kind for s in plan.steps])
+        for step in plan.steps:
+            self.assertGreaterEqual(step.duration_sec + 1e-9, step.bound_sec)
+            for side in ("src_cell", "dst_cell"):
+                spans = sorted((t.start_sec, t.end_sec) for t in step.transfers if getattr(t, side) == "us-cell-1")
+                for (_, end), (start, _) in zip(spans, spans[1:]):
+                    self.assertLessEqual(end, start + 1e-9)
+
+    def test_refuses_legacy_hrw(self):
+        from rebalance_planner_v2 import plan_rebalance
+        self.assertEqual(Router(self.svc).hash_mode, "legacy")
+        with self.assertRaisesRegex(ValueError, "fast-mode HRW only"):
+            plan_rebalance(self.svc.get_snapshot(), 100, ACTIVE_SHARDS[:12])
+
+    def test_schedule_busiest_cell_first(self):
+        from rebalance_planner_v2 import Transfer, schedule_transfers
+        ts = [Transfer("s1", "s2", "a", "b", 1, 10.0), Transfer("s1", "s3", "a", "c", 1, 10.0),
+              Transfer("s4", "s2", "d", "b", 1, 10.0)]
+        self.assertEqual(schedule_transfers(ts, lambda cell: 1.0), (20.0, 20.0))
+
+
+class TestBlastRadiusMonteCarlo(unittest.TestCase):
+
+    def setUp(self):
+        from blast_radius_mc_v2 import build_topology, make_placement
+        shards = ACTIVE_SHARDS[:12]
+        self.svc = PlacementService(make_placement(shards, 2), shards=shards)
+        self.topo = build_topology(self.svc.get_snapshot(), {sid: 100.0 * (i + 1) for i, sid in enumerate(shards)})
+        self.total = sum(100.0 * (i + 1) for i in range(12))
+
+    def test_topology_follows_placement(self):
+        snap = self.svc.get_snapshot()
+        for ci, cell in enumerate(self.topo.cells):
+            expected = sum(100.0 * (i + 1) for i, sid in enumerate(snap.shards) if snap.placement[sid]["cell"] == cell)
+            self.assertEqual(self.topo.users[ci], expected)
+            self.assertEqual(self.topo.regions[self.topo.cell_region[ci]], cell.rsplit("-cell-", 1)[0])
+        self.assertAlmostEqual(self.topo.load.sum(), 1.0)
+
+    def test_hard_and_dependency_outages(self):
+        import numpy as np
+        from blast_radius_mc_v2 import OP_MIX, FailureModel, simulate_scenarios
+        quiet = dict(p_region=0.0, p_az=0.0, p_cell=0.0, p_deploy=0.0, p_dep={}, p_dep_global=0.0)
+        res = simulate_scenarios(self.topo, FailureModel(**dict(quiet, p_cell=1.0)), 100)
+        self.assertTrue((res["down"] == self.total).all() and (res["lost"] == self.total).all())
+        # KMS down everywhere: only export_data and rotate_keys are denied
+        res = simulate_scenarios(self.topo, FailureModel(**dict(quiet, p_dep={"kms": 1.0})), 100)
+        self.assertTrue((res["down"] == 0).all() and (res["degraded"] == self.total).all())
+        share = OP_MIX["export_data"] + OP_MIX["rotate_keys"]
+        self.assertTrue(np.allclose(res["lost"], self.total * share))
+        self.assertTrue(np.allclose(res["load_lost"], share))
+
+    def test_mean_matches_analytic(self):
+        from blast_radius_mc_v2 import FailureModel, simulate_scenarios
+        m = FailureModel(p_region=0.01, p_az=0.02, p_cell=0.05, p_deploy=0.1, deploy_cells=2, p_dep={})
+        res = simulate_scenarios(self.topo, m, 200_000, batch=30_000)
+        p_down = 1 - (1 - m.p_cell) * (1 - m.p_az) * (1 - m.p_region) * (1 - m.p_deploy * 2 / len(self.topo.cells))
+        self.assertAlmostEqual(res["down"].mean() / (self.total * p_down), 1.0, delta=0.03)
+
+
+class TestLatencyModel(unittest.TestCase):
+
+    def _fixed(self, **kw):
+        # every hop constant, no caches, no dependency errors
+        from latency_model_v2 import Hop, LatencyConfig, _dep_hops, _hops
+        cfg = LatencyConfig(dns_hit=0.0, tls_resumed=0.0, cache_hit=0.0, dep_error={}, **kw)
+        cfg.hops = {k: Hop(h.p50_ms) for k, h in _hops().items()}
+        cfg.dep_hops = {k: Hop(h.p50_ms) for k, h in _dep_hops().items()}
+        return cfg
+
+    def test_lognormal_hop_hits_its_quantiles(self):
+        import numpy as np
+        from latency_model_v2 import Hop
+        x = Hop(10, 50).draw(np.random.default_rng(1), 400_000)
+        self.assertAlmostEqual(np.quantile(x, 0.5) / 10, 1.0, delta=0.02)
+        self.assertAlmostEqual(np.quantile(x, 0.99) / 50, 1.0, delta=0.04)
+        self.assertEqual(set(Hop(samples=(1.0, 3.0)).draw(np.random.default_rng(1), 100).tolist()), {1.0, 3.0})
+
+    def test_fixed_hops_add_up(self):
+        import numpy as np
+        from latency_model_v2 import sample_route
+        cfg = self._fixed()
+        rng = np.random.default_rng(2)
+        r = sample_route("read_home_remote", {"view_pii": 1}, 100, cfg, rng)
+        # DNS + TLS + gateway + auth + policy + cache miss + storage + cross-region
+        self.assertTrue(np.allclose(r["latency"], 20 + 30 + 10 + 8 + 5 + 5 + 40 + 120))
+        self.assertTrue(r["allowed"].all() and (r["attempts"] == 2).all())
+        r = sample_route("write_home_local", {"transfer": 1}, 100, cfg, rng)
+        self.assertTrue(np.allclose(r["latency"], 20 + 30 + 10 + 8 + max(5, 15, 6) + 60))
+
+    def test_retries_and_tier_rules(self):
+        import numpy as np
+        from latency_model_v2 import sample_route
+        cfg = self._fixed(dep_backoff_ms=0.0)
+        cfg.dep_error = {"risk": 1.0}
+        rng = np.random.default_rng(3)
+        r = sample_route("write_home_local", {"transfer": 1}, 50, cfg, rng)
+        # risk times out on every attempt: Tier-2 fails closed, no storage write
+        self.assertFalse(r["allowed"].any())
+        self.assertTrue(np.allclose(r["latency"], 20 + 30 + 10 + 8 + 3 * cfg.dep_timeout_ms))
+        self.assertTrue((r["attempts"] == 1 + 3 + 1 + 1).all())
+        # Tier-1 degrades instead
+        r = sample_route("write_home_local", {"low_value_action": 1}, 50, cfg, rng)
+        self.assertTrue(r["allowed"].all())
+
+    def test_route_mix_from_router(self):
+        from latency_model_v2 import route_mix
+        svc = PlacementService(make_demo_placement())
+        router = Router(svc, hash_mode="fast")
+        users = [User(f"user-{i}", "us" if i % 2 else "eu") for i in range(200)]
+        mix = route_mix(router, users, requests=2000, away=0.0)
+        self.assertEqual(sum(sum(c.values()) for c in mix.values()), 2000)
+        self.assertFalse({"read_home_local", "read_home_remote"} & set(mix))   # no one reads away from home
+        self.assertEqual(set(mix["read_local"]), {"view_public", "view_profile_basic", "view_pii", "export_data"})
+        self.assertIn("write_home_remote", mix)   # HRW homes ignore residency
+        down = CellHealth(cell_ok={"us-cell-1": False, "eu-cell-1": False})
+        mix = route_mix(router, users, requests=2000, away=0.5, health=down)
+        self.assertEqual(set(mix["write_queued"]), {"low_value_action"})
+        self.assertIn("read_home_remote", mix)
+
+
+class TestLoadGen(unittest.TestCase):
+
+    class FakeClock:
+        def __init__(self):
+            self.t = 100.0
+
+        def __call__(self):
+            return self.t
+
+        def sleep(self, d):
+            self.t += d
+
+    def test_requests_are_zipf_and_retry_keys(self):
+        from common_infra_v2 import OP_TIER
+        from loadgen_v2 import make_requests
+        reqs = make_requests(20_000, users=1000, seed=1)
+        self.assertEqual([r.idem_key for r in reqs], [r.idem_key for r in make_requests(20_000, users=1000, seed=1)])
+        top = Counter(r.user.user_id for r in reqs).most_common(2)
+        self.assertEqual(top[0][0], "user-0")
+        self.assertAlmostEqual(top[0][1] / top[1][1], 2 ** 1.1, delta=0.2)
+        self.assertTrue({r.op for r in reqs} <= set(OP_TIER))
+        self.assertGreater(len(reqs) - len({r.idem_key for r in reqs}), 500)   # ~5% resend a key
+
+    def test_open_loop_charges_a_stall_to_everything_behind_it(self):
+        from loadgen_v2 import make_evaluator, make_requests, run
+        clock = self.FakeClock()
+        ev, timer = make_evaluator()
+        write = ev.write
+
+        def slow_write(*args):
+            if args[3] == "k-10":
+                clock.t += 0.05          # one 50ms stall at 1000 req/s
+            return write(*args)
+
+        ev.write = slow_write
+        res = run(ev, timer, make_requests(200, users=1000, seed=2), rate=1000, clock=clock, sleep=clock.sleep)
+        self.assertEqual(int((res["service"] >= 0.001).sum()), 1)
+        # the 49 requests due during the stall were sent late; a closed loop would never see them
+        self.assertEqual(int((res["latency"] >= 0.001).sum()), 50)
+        self.assertAlmostEqual(res["latency"].max(), 0.05)
+
+    def test_failure_script_and_drain(self):
+        from loadgen_v2 import FailureEvent, make_evaluator, make_requests, run
+        clock = self.FakeClock()
+        ev, timer = make_evaluator()
+        script = [FailureEvent(0.0, "cell", "us-cell-1", False), FailureEvent(0.0, "dep", "risk", False),
+                  FailureEvent(0.1, "cell", "us-cell-1", True), FailureEvent(0.1, "dep", "risk", True),
+                  FailureEvent(0.1, "drain")]
+        res = run(ev, timer, make_requests(200, users=1000, seed=3), rate=1000, script=script,
+                  clock=clock, sleep=clock.sleep)
+        self.assertGreater(res["outcomes"]["queued"], 0)
+        self.assertGreater(res["outcomes"]["DENY: risk unavailable"], 0)
+        self.assertGreater(res["outcomes"]["executed"], 0)
+        # one drain round per user (QUEUE_DRAIN_RATE_PER_USER): only the hottest users have a backlog left
+        self.assertTrue(set(ev.queue.users()) <= {"user-0", "user-1"})
+        self.assertEqual(sum(res["outcomes"].values()), 200)
+
+    def test_baseline_compare_scales_by_machine_speed(self):
+        from loadgen_v2 import compare
+        base = {"calibration_sec": 0.02, "capacity_rps": 40_000.0, "service_us": {"p50": 10.0, "p99": 100.0},
+                "component_us": {"routing": 10.0}}
+        # machine half as fast, everything twice as slow: no regression
+        slow = {"calibration_sec": 0.04, "capacity_rps": 20_000.0, "service_us": {"p50": 20.0, "p99": 200.0},
+                "component_us": {"routing": 20.0}}
+        self.assertFalse(any(bad for *_, bad in compare(slow, base)))
+        worse = dict(base, capacity_rps=25_000.0, service_us={"p50": 30.0, "p99": 100.0})
+        rows = {name: bad for name, _, _, bad in compare(worse, base)}
+        self.assertTrue(rows["capacity_rps"])
+        self.assertFalse(rows["service_us.p99"])
+        self.assertIsNone(rows["service_us.p50"])     # reported, not gated
+
+class TestAsyncRouter(unittest.TestCase):
+
+    def _router(self, latency=0.01, **kw):
+        from async_router_v2 import AsyncRouter, LocalPlacementServer
+        from common_infra_v2 import PlacementService
+        from degraded_mode_v2 import make_demo_placement
+        self.now = [1000.0]
+        server = LocalPlacementServer(PlacementService(make_demo_placement()), latency)
+        return server, AsyncRouter(server, clock=lambda: self.now[0], **kw)
+
+    def test_concurrent_lookups_share_one_fetch(self):
+        import asyncio
+        from common_infra_v2 import CellHealth, Dependencies, PlacementService, Router, User
+        from degraded_mode_v2 import make_demo_placement
+        server, router = self._router()
+        users = [User(f"u-{i}", "us") for i in range(300)]
+        deps, health = Dependencies(), CellHealth()
+
+        async def burst():
+            return await asyncio.gather(*(router.route_write_async(u, "low_value_action", deps, health) for u in users))
+
+        got = asyncio.run(burst())
+        self.assertEqual(server.fetches, 1)
+        self.assertEqual(server.max_in_flight, 1)
+        self.assertEqual(router.placement_stats()["coalesced"], 299)
+        sync = Router(PlacementService(make_demo_placement()))
+        self.assertEqual(got, [sync.route_write(u, "low_value_action", deps, health) for u in users])
+
+    def test_deadline_fails_closed_and_fetch_completes(self):
+        import asyncio
+        from async_router_v2 import PLACEMENT_DENY
+        from common_infra_v2 import CellHealth, Dependencies, User
+        server, router = self._router(latency=0.2, deadline=0.02)
+        user, deps = User("u-1", "us"), Dependencies()
+
+        async def go():
+            first = await asyncio.gather(*(router.route_write_async(user, "transfer", deps, CellHealth())
+                                           for _ in range(20)))
+            await asyncio.sleep(0.3)
+            return first, await router.route_write_async(user, "transfer", deps, CellHealth())
+
+        first, later = asyncio.run(go())
+        self.assertEqual(set(first), {("FAIL", PLACEMENT_DENY, None, None)})
+        self.assertEqual(later[0], "WRITE_HOME")
+        self.assertEqual(server.fetches, 1)
+        self.assertEqual(router.placement_stats()["deadline_exceeded"], 20)
+        # a per-call deadline overrides the router default
+        self.now[0] += 10_000
+
+        async def patient():
+            return await router.route_write_async(user, "transfer", deps, CellHealth(), deadline=1.0)
+
+        self.assertEqual(asyncio.run(patient())[0], "WRITE_HOME")
+
+    def test_stale_serving_and_server_down(self):
+        import asyncio
+        from async_router_v2 import PLACEMENT_DENY
+        from common_infra_v2 import PLACEMENT_CACHE_TTL_SEC, PLACEMENT_MAX_STALE_SEC, Dependencies
+        server, router = self._router()
+        deps = Dependencies()
+
+        async def go(n):
+            out = await asyncio.gather(*(router.read_shards_async(f"u-{i}", deps) for i in range(n)))
+            await asyncio.sleep(0.05)
+            return out
+
+        asyncio.run(go(1))
+        server.down = True
+        self.now[0] += PLACEMENT_CACHE_TTL_SEC + 1
+        stale = asyncio.run(go(50))
+        self.assertTrue(all(shards and msg == "OK" for shards, msg in stale))
+        self.assertEqual(server.fetches, 2)              # one background refresh for the whole burst
+        self.assertEqual(router.placement_stats()["refresh_failures"], 1)
+        self.now[0] += PLACEMENT_MAX_STALE_SEC
+        self.assertEqual(set(asyncio.run(go(10))), {((), PLACEMENT_DENY)})
+        self.assertEqual(server.fetches, 3)
+
+    def test_requests_that_need_no_placement_never_fetch(self):
+        import asyncio
+        from async_router_v2 import PLACEMENT_DENY
+        from common_infra_v2 import CellHealth, Dependencies, User
+        server, router = self._router()
+
+        async def go():
+            return (await router.route_write_async(User("u-1", "us"), "transfer", Dependencies(risk_ok=False), CellHealth()),
+                    await router.route_read_async(User("u-1", "us"), "view_public", "eu", Dependencies()),
+                    await router.resolve_home_async("u-1", Dependencies(placement_ok=False)))
+
+        denied, local, no_placement = asyncio.run(go())
+        self.assertEqual(denied[:2], ("FAIL", "DENY: risk unavailable (Tier-2 fail closed)"))
+        self.assertEqual(local, (True, "ALLOW: read-local in eu"))
+        self.assertEqual(no_placement, (None, None, None, PLACEMENT_DENY))
+        self.assertEqual(server.fetches, 0)
+
+if __name__ == "__main__":
+    unittest.main()
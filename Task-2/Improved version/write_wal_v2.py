@@ -0,0 +1,417 @@
+# write_wal_v2.py
+# Durable, segmented write-ahead log for WriteQueue: deferred Tier-1 writes survive a restart.
+# - compact binary records: [body length u32][crc32 u32][type u8] + body
+# - append() only packs the record into the open group; one flusher thread writes each group
+#   with a single os.write + fsync, so enqueue stays in microseconds and writers share the fsync
+# - drained events are acked by ack records in the same log; the oldest segments are deleted
+#   once none of their events is live (prefix only: an ack can sit in a newer segment than its
+#   event). QUEUE_ITEM_TTL_SEC bounds how long one stuck event can hold a segment.
+# - startup replays every segment through mmap, cuts a torn tail, and hands the live events
+#   back to WriteQueue(wal=...) to rebuild the per-user queues
+import gc
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Sequence, Tuple
+from common_infra_v2 import ACTIVE_SHARDS, WriteEvent, WriteQueue
+
+SEGMENT_BYTES = 64 * 1024 * 1024   # roll to a new segment file past this size
+WAL_FSYNC = True                   # fsync every group (one per flush, shared by all appends in it)
+COMMIT_DELAY_SEC = 0.0             # extra wait to grow a group; 0 = flush as soon as the last one lands
+SEGMENT_PREFIX = "wal-"
+SEGMENT_SUFFIX = ".seg"
+
+REC_EVENT = 1
+REC_ACK = 2
+HEADER = struct.Struct("<IIB")       # body length, crc32(body), record type
+EVENT = struct.Struct("<QdIHHHHI")   # seq, created_at, placement_version, byte lengths of
+                                     # user_id, action, idem_key, target_shard, payload
+ACK_SEQ = struct.Struct("<Q")
+
+# record encoding
+
+def encode_event(ev: WriteEvent, seq: int) -> bytes:
+    u = ev.user_id.encode("utf-8")
+    a = ev.action.encode("utf-8")
+    k = ev.idem_key.encode("utf-8")
+    s = ev.target_shard.encode("utf-8")
+    p = ev.payload.encode("utf-8")
+    body = b"".join((EVENT.pack(seq, ev.created_at, ev.placement_version, len(u), len(a), len(k), len(s), len(p)),
+                     u, a, k, s, p))
+    return HEADER.pack(len(body), zlib.crc32(body), REC_EVENT) + body
+
+def decode_event(buf, off: int) -> WriteEvent:
+    seq, created_at, version, lu, la, lk, ls, lp = EVENT.unpack_from(buf, off)
+    off += EVENT.size
+    raw = buf[off:off + lu + la + lk + ls + lp]
+    text = raw.decode("utf-8")
+    if len(text) != len(raw):
+        text = raw  # non-ASCII: cut on byte offsets, decode per field below
+    a = lu + la
+    k = a + lk
+    s = k + ls
+    fields = (text[:lu], text[lu:a], text[a:k], text[k:s], text[s:])
+    if text is raw:
+        fields = tuple(f.decode("utf-8") for f in fields)
+    user_id, action, idem_key, shard, payload = fields
+    return WriteEvent(user_id, action, payload, idem_key, created_at, shard, version, seq)
+
+def encode_ack(seqs: Sequence[int]) -> bytes:
+    body = struct.pack(f"<{len(seqs)}Q", *seqs)
+    return HEADER.pack(len(body), zlib.crc32(body), REC_ACK) + body
+
+def scan_segment(path: str) -> Tuple[Dict[int, int], List[int], int]:
+    """
+    One pass over a segment: {seq: body offset} of its events, the seqs it acks, and the
+    offset where valid records end. Bodies are decoded later, only for events still live.
+    """
+    events: Dict[int, int] = {}
+    acks: List[int] = []
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return events, acks, 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            off = 0
+            while off + HEADER.size <= size:
+                n, crc, kind = HEADER.unpack_from(buf, off)
+                start = off + HEADER.size
+                if start + n > size or zlib.crc32(buf[start:start + n]) != crc:
+                    break  # torn tail from a crash mid-write
+                if kind == REC_EVENT:
+                    events[ACK_SEQ.unpack_from(buf, start)[0]] = start
+                elif kind == REC_ACK:
+                    acks.extend(s for (s,) in ACK_SEQ.iter_unpack(buf[start:start + n]))
+                off = start + n
+    return events, acks, off
+
+def read_events(path: str, offsets: Sequence[int]) -> List[WriteEvent]:
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        return [decode_event(buf, off) for off in offsets]
+
+def _segment_path(directory: str, first_seq: int) -> str:
+    return os.path.join(directory, f"{SEGMENT_PREFIX}{first_seq:020d}{SEGMENT_SUFFIX}")
+
+class SegmentedWal:
+    """
+    Write-ahead log for WriteQueue(wal=...). append() assigns the event's sequence number
+    and returns without waiting for disk; sync() waits until everything appended so far is
+    written (and fsynced when fsync=True). ack() marks events drained. replay() hands back,
+    once, the events that were live when the log was opened, in sequence order.
+    Losing acks in a crash only replays already-written events: drains are at-least-once
+    and the shard dedups on idem_key.
+    """
+    def __init__(self, directory: str, segment_bytes: int = SEGMENT_BYTES, fsync: bool = WAL_FSYNC,
+                 commit_delay: float = COMMIT_DELAY_SEC):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.commit_delay = commit_delay
+
+        self._cv = threading.Condition()
+        self._segments: List[int] = []        # first seq of each segment on disk, ascending
+        self._live: Dict[int, int] = {}       # segment -> events not acked yet
+        self._where: Dict[int, int] = {}      # live seq -> its segment
+        self._pending: Dict[int, bytearray] = {}   # segment -> records waiting for the flusher
+        self._pending_records = 0
+        self._gen = 0             # group currently filling
+        self._flushed_gen = -1    # last group on disk
+        self._compact = False
+        self._closed = False
+        self._fd: Optional[int] = None
+        self._fd_seg = -1
+        self.group_commits = 0
+        self.bytes_written = 0
+        self.records_written = 0
+        self.segments_deleted = 0
+        self.recovered = 0
+        self.torn_bytes = 0
+
+        # replay allocates an object per live event and none of them form cycles: pausing the
+        # collector roughly halves restart time with a large backlog
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self._replayed = self._recover()
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+        self._next_seq = max(self._max_seq, max(self._segments, default=0)) + 1
+        # always start a fresh segment: recovered files stay read-only until compacted away
+        self._seg = self._next_seq
+        self._seg_bytes = 0
+        self._open_segment(self._seg)
+        self._delete_drained()
+
+        self._flusher = threading.Thread(target=self._flush_loop, name="wal-flusher", daemon=True)
+        self._flusher.start()
+
+    # WriteQueue interface
+
+    def replay(self) -> List[WriteEvent]:
+        out, self._replayed = self._replayed, []
+        return out
+
+    def append(self, ev: WriteEvent, wait: bool = False) -> int:
+        with self._cv:
+            if self._closed:
+                raise RuntimeError("wal is closed")
+            seq = self._next_seq
+            self._next_seq += 1
+            rec = encode_event(ev, seq)
+            if self._seg_bytes and self._seg_bytes + len(rec) > self.segment_bytes:
+                self._open_segment(seq)
+            buf = self._pending.get(self._seg)
+            if buf is None:
+                buf = self._pending[self._seg] = bytearray()
+                self._cv.notify()
+            buf += rec
+            self._seg_bytes += len(rec)
+            self._pending_records += 1
+            self._live[self._seg] += 1
+            self._where[seq] = self._seg
+            if wait:
+                gen = self._gen
+                while self._flushed_gen < gen:
+                    self._cv.wait()
+        return seq
+
+    def ack(self, seqs: Sequence[int]) -> None:
+        with self._cv:
+            seqs = [s for s in seqs if s in self._where]
+            if not seqs:
+                return
+            oldest = self._segments[0]
+            for s in seqs:
+                self._live[self._where.pop(s)] -= 1
+            rec = encode_ack(seqs)
+            buf = self._pending.get(self._seg)
+            if buf is None:
+                buf = self._pending[self._seg] = bytearray()
+            buf += rec
+            self._seg_bytes += len(rec)
+            self._pending_records += 1
+            if oldest != self._seg and self._live[oldest] == 0:
+                self._compact = True
+            self._cv.notify()
+
+    def sync(self) -> None:
+        with self._cv:
+            gen = self._gen if self._pending else self._gen - 1
+            self._cv.notify_all()
+            while self._flushed_gen < gen:
+                self._cv.wait()
+
+    def compact(self) -> None:
+        # delete drained segments now instead of waiting for the next ack to trigger it
+        with self._cv:
+            self._compact = True
+            gen = self._gen
+            self._cv.notify_all()
+            while self._flushed_gen < gen:
+                self._cv.wait()
+
+    def close(self) -> None:
+        with self._cv:
+            self._closed = True
+            self._cv.notify_all()
+        self._flusher.join()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def stats(self) -> dict:
+        return {
+            "live_events": len(self._where),
+            "segments": len(self._segments),
+            "group_commits": self.group_commits,
+            "records_per_commit": self.records_written / self.group_commits if self.group_commits else 0.0,
+            "bytes_written": self.bytes_written,
+            "segments_deleted": self.segments_deleted,
+            "recovered": self.recovered,
+            "torn_bytes": self.torn_bytes,
+        }
+
+    # segments
+
+    def _open_segment(self, first_seq: int) -> None:
+        # called with the lock held (or before the flusher starts)
+        self._seg = first_seq
+        self._seg_bytes = 0
+        if first_seq not in self._live:
+            self._segments.append(first_seq)
+            self._live[first_seq] = 0
+
+    def _recover(self) -> List[WriteEvent]:
+        names = sorted(n for n in os.listdir(self.directory)
+                       if n.startswith(SEGMENT_PREFIX) and n.endswith(SEGMENT_SUFFIX))
+        scanned: List[Tuple[int, Dict[int, int]]] = []
+        acked = set()
+        self._max_seq = 0
+        for name in names:
+            first = int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+            path = os.path.join(self.directory, name)
+            offsets, acks, good = scan_segment(path)
+            size = os.path.getsize(path)
+            if good < size:
+                self.torn_bytes += size - good
+                os.truncate(path, good)
+            self._segments.append(first)
+            self._live[first] = 0
+            scanned.append((first, offsets))
+            acked.update(acks)
+            if offsets:
+                self._max_seq = max(self._max_seq, max(offsets))
+        live: List[WriteEvent] = []
+        for first, offsets in scanned:
+            keep = [off for seq, off in offsets.items() if seq not in acked]
+            if not keep:
+                continue
+            evs = read_events(_segment_path(self.directory, first), keep)
+            for ev in evs:
+                self._where[ev.seq] = first
+            self._live[first] = len(evs)
+            live.extend(evs)
+        live.sort(key=lambda ev: ev.seq)
+        self.recovered = len(live)
+        return live
+
+    def _delete_drained(self) -> None:
+        # oldest segments first; stop at the first one still holding a live event
+        doomed = []
+        with self._cv:
+            while len(self._segments) > 1 and self._segments[0] != self._seg:
+                first = self._segments[0]
+                if self._live[first] or first in self._pending:
+                    break
+                self._segments.pop(0)
+                del self._live[first]
+                doomed.append(first)
+        for first in doomed:
+            if self._fd_seg == first:
+                os.close(self._fd)
+                self._fd, self._fd_seg = None, -1
+            os.remove(_segment_path(self.directory, first))
+            self.segments_deleted += 1
+
+    def _write(self, batch: Dict[int, bytearray]) -> None:
+        for seg, data in batch.items():
+            if seg != self._fd_seg:
+                if self._fd is not None:
+                    if self.fsync:
+                        os.fsync(self._fd)
+                    os.close(self._fd)
+                self._fd = os.open(_segment_path(self.directory, seg), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+                self._fd_seg = seg
+            view = memoryview(data)
+            while view:
+                view = view[os.write(self._fd, view):]
+            self.bytes_written += len(data)
+        if self.fsync and self._fd is not None:
+            os.fsync(self._fd)
+        self.group_commits += 1
+
+    def _flush_loop(self) -> None:
+        while True:
+            with self._cv:
+                while not self._pending and not self._closed and not self._compact:
+                    self._cv.wait()
+                if self.commit_delay and self._pending and not self._closed:
+                    self._cv.wait(self.commit_delay)
+                batch, records = self._pending, self._pending_records
+                self._pending, self._pending_records = {}, 0
+                gen = self._gen
+                self._gen += 1
+                closing = self._closed
+                # taken with the batch: a compact() that arrives mid-write waits for the next generation
+                compact, self._compact = self._compact, False
+
+            if batch:
+                self._write(batch)
+                self.records_written += records
+            if compact:
+                self._delete_drained()
+            with self._cv:
+                self._flushed_gen = gen
+                self._cv.notify_all()
+            if closing and not self._pending:
+                return
+
+# benchmark + restart check
+
+def make_events(n: int) -> List[WriteEvent]:
+    now = time.time()
+    return [WriteEvent(f"user-{i % 50_000}", "low_value_action", '{"amount":100,"note":"deferred"}',
+                       f"k{i}", now, ACTIVE_SHARDS[i % len(ACTIVE_SHARDS)], 1) for i in range(n)]
+
+def enqueue_us(queue: WriteQueue, events: List[WriteEvent]) -> float:
+    t0 = time.perf_counter()
+    for ev in events:
+        queue.enqueue(ev)
+    return (time.perf_counter() - t0) / len(events) * 1e6
+
+def run(base: str, n: int, segment_bytes: int) -> None:
+    print("\nWriteQueue write-ahead log\n")
+    print(f"Events: {n:,} | segment size: {segment_bytes / 2**20:g} MiB\n")
+    print(f"{'Queue':22} {'us/enqueue':>11} {'sync s':>8} {'fsyncs':>8} {'events/fsync':>13} {'B/event':>8}")
+    print("-" * 75)
+
+    us = enqueue_us(WriteQueue(), make_events(n))
+    print(f"{'memory only':22} {us:>11.2f} {'-':>8} {'-':>8} {'-':>13} {'-':>8}")
+
+    for fsync in (False, True):
+        d = os.path.join(base, f"fsync-{int(fsync)}")
+        wal = SegmentedWal(d, segment_bytes=segment_bytes, fsync=fsync)
+        queue = WriteQueue(wal)
+        us = enqueue_us(queue, make_events(n))
+        t0 = time.perf_counter()
+        wal.sync()
+        sync_s = time.perf_counter() - t0
+        st = wal.stats()
+        name = "wal, group fsync" if fsync else "wal, no fsync"
+        print(f"{name:22} {us:>11.2f} {sync_s:>8.2f} {st['group_commits']:>8,} "
+              f"{n / max(1, st['group_commits']):>13,.0f} {st['bytes_written'] / n:>8.1f}")
+        if fsync:
+            last = (wal, queue, d)
+        else:
+            wal.close()
+
+    wal, queue, d = last
+    # drain the oldest ~90% (acks delete segments as they empty), then restart from the log
+    before = len(os.listdir(d))
+    drained = 0
+    target = n * 9 // 10
+    for uid in queue.users():
+        q = queue.user_queue(uid)
+        take = [q.popleft() for _ in range(sum(1 for ev in q if ev.seq <= target))]
+        queue.ack(take)
+        drained += len(take)
+    wal.compact()
+    after = len(os.listdir(d))
+    wal.close()
+
+    t0 = time.perf_counter()
+    reopened = WriteQueue(SegmentedWal(d, segment_bytes=segment_bytes))
+    replay_s = time.perf_counter() - t0
+    print(f"\nDrained {drained:,} of {n:,}; segments {before} -> {after} after compaction")
+    print(f"Restart: rebuilt {len(reopened):,} queued events for {len(reopened.users()):,} users "
+          f"in {replay_s:.2f}s ({len(reopened) / replay_s:,.0f} events/s, log scanned via mmap)")
+    reopened.wal.close()
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    segment_bytes = int(sys.argv[2]) if len(sys.argv) > 2 else 8 * 1024 * 1024
+    with tempfile.TemporaryDirectory(prefix="write-wal-") as base:
+        run(base, n, segment_bytes)
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,23 @@
 from __future__ import annotations
 
 import hashlib
+import heapq
+import math
+import random
+import threading
 import time
+import zlib
+from array import array
 from dataclasses import dataclass, field
 from collections import defaultdict, deque
-from typing import Dict, Iterable, Optional, Tuple, Any
+from concurrent.futures import Future, ThreadPoolExecutor
+from types import MappingProxyType
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple, Any
+
+try:
+    import numpy as np  # only needed for the batch/vectorized paths
+except ImportError:
+    np = None
 
 # 1) Stable shard membership 
 
@@ -17,7 +30,10 @@ ACTIVE_SHARDS = [f"shard-{i:03d}" for i in range(1, 65)]  # 64 logical shards
 def _u256(s: str) -> int:
     return int(hashlib.sha256(s.encode("utf-8")).hexdigest(), 16)
 
-def hrw_shard_for_user(user_id: str, shard_ids: Iterable[str]) -> str:
+def hrw_shard_for_user(user_id: str, shard_ids: Iterable[str], weights: Optional[Dict[str, float]] = None) -> str:
+    shard_ids = tuple(shard_ids)   # read more than once below; a generator would be used up
+    if weights and not _uniform_weights(weights, shard_ids):
+        return _weighted_hrw_shard_for_user(user_id, shard_ids, weights)
     best_sid = None
     best_score = None
     for sid in shard_ids:
@@ -28,35 +44,337 @@ def hrw_shard_for_user(user_id: str, shard_ids: Iterable[str]) -> str:
     assert best_sid is not None
     return best_sid
 
+# Weighted HRW (logarithmic method): score = w / -ln(u), u ~ U(0,1) from the pair hash.
+# A shard wins with probability w / sum(w), and changing one weight only moves users
+# onto or off that shard. Missing weights default to 1.0.
+
+DEFAULT_SHARD_WEIGHT = 1.0
+
+def _uniform_weights(weights: Dict[str, float], shard_ids: Iterable[str]) -> bool:
+    # all-equal weights rank exactly like the plain hash -> keep the unweighted path (and its assignments)
+    return len({weights.get(sid, DEFAULT_SHARD_WEIGHT) for sid in shard_ids}) <= 1
+
+def _unit_from_bits(top53: int) -> float:
+    return (top53 + 0.5) / float(1 << 53)
+
+def weighted_score(w: float, top53: int) -> float:
+    if w <= 0:
+        return 0.0
+    return w / -math.log(_unit_from_bits(top53))
+
+def _weighted_hrw_shard_for_user(user_id: str, shard_ids: Iterable[str], weights: Dict[str, float]) -> str:
+    best_sid = None
+    best_score = -1.0
+    for sid in shard_ids:
+        score = weighted_score(weights.get(sid, DEFAULT_SHARD_WEIGHT), _u256(f"{user_id}:{sid}") >> 203)
+        if score > best_score:
+            best_score = score
+            best_sid = sid
+    assert best_sid is not None
+    return best_sid
+
+# 2b) Routing-hash engine (precomputed per-shard state)
+
+HRW_MODE = "legacy"     # "legacy" keeps hrw_shard_for_user assignments; "fast" = 64-bit keyed score
+HRW_BATCH_CHUNK = 65536
+HRW_SCORE_BLOCK = 4096  # users scored at once: 4096 x 64 shards x 8 B = 2 MB, stays in cache
+
+_MASK64 = (1 << 64) - 1
+_MIX_C1 = 0xBF58476D1CE4E5B9
+_MIX_C2 = 0x94D049BB133111EB
+
+def user_hash64(user_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(user_id.encode("utf-8"), digest_size=8).digest(), "big")
+
+def shard_seed64(shard_id: str) -> int:
+    return int.from_bytes(hashlib.sha256(f"hrw-seed:{shard_id}".encode("utf-8")).digest()[:8], "big")
+
+def mix64(x: int) -> int:
+    # splitmix64 finalizer: bijective, full avalanche
+    x = ((x ^ (x >> 30)) * _MIX_C1) & _MASK64
+    x = ((x ^ (x >> 27)) * _MIX_C2) & _MASK64
+    return x ^ (x >> 31)
+
+def mix64_np(x):
+    # vectorized mix64 over a uint64 array (multiplication wraps mod 2^64)
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(_MIX_C1)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(_MIX_C2)
+    return x ^ (x >> np.uint64(31))
+
+def user_hashes64_np(user_ids: Sequence[str]):
+    digests = b"".join(hashlib.blake2b(u.encode("utf-8"), digest_size=8).digest() for u in user_ids)
+    return np.frombuffer(digests, dtype=">u8").astype(np.uint64)
+
+class HrwEngine:
+    """
+    Rendezvous hashing over a fixed shard list, with per-shard state computed once.
+    legacy: same winner as hrw_shard_for_user (sha256 of "user:shard"), comparing raw
+            digests instead of hex-decoding a 256-bit int per shard.
+    fast:   score = mix64(blake2b64(user) ^ seed(shard)); different assignments from legacy.
+    weights (optional, shard -> weight) switch either mode to weighted HRW.
+    """
+    def __init__(self, shard_ids: Iterable[str], mode: str = HRW_MODE, weights: Optional[Dict[str, float]] = None):
+        if mode not in ("legacy", "fast"):
+            raise ValueError(f"unknown HRW mode: {mode}")
+        self.shards: Tuple[str, ...] = tuple(shard_ids)
+        if not self.shards:
+            raise ValueError("shard list cannot be empty")
+        self.mode = mode
+        self._suffixes = [f":{sid}".encode("utf-8") for sid in self.shards]
+        self._seeds = [shard_seed64(sid) for sid in self.shards]
+        self._seeds_np = np.array(self._seeds, dtype=np.uint64) if np is not None else None
+
+        self.weights: Optional[Tuple[float, ...]] = None
+        if weights and not _uniform_weights(weights, self.shards):
+            self.weights = tuple(float(weights.get(sid, DEFAULT_SHARD_WEIGHT)) for sid in self.shards)
+            if any(w < 0 for w in self.weights):
+                raise ValueError("shard weights must be >= 0")
+        self._weights_np = np.array(self.weights) if (np is not None and self.weights) else None
+
+    def index_for(self, user_id: str) -> int:
+        if self.weights is not None:
+            return self._weighted_index_for(user_id)
+        if self.mode == "legacy":
+            ub = user_id.encode("utf-8")
+            sha = hashlib.sha256
+            best = None
+            best_i = 0
+            for i, suffix in enumerate(self._suffixes):
+                d = sha(ub + suffix).digest()
+                if best is None or d > best:
+                    best = d
+                    best_i = i
+            return best_i
+
+        h = user_hash64(user_id)
+        if self._seeds_np is not None:
+            return int(mix64_np(self._seeds_np ^ np.uint64(h)).argmax())
+        best = -1
+        best_i = 0
+        for i, seed in enumerate(self._seeds):
+            score = mix64(h ^ seed)
+            if score > best:
+                best = score
+                best_i = i
+        return best_i
+
+    def _weighted_index_for(self, user_id: str) -> int:
+        if self.mode == "legacy":
+            ub = user_id.encode("utf-8")
+            bits = [int.from_bytes(hashlib.sha256(ub + sfx).digest()[:8], "big") >> 11 for sfx in self._suffixes]
+        else:
+            h = user_hash64(user_id)
+            bits = [mix64(h ^ seed) >> 11 for seed in self._seeds]
+        best = -1.0
+        best_i = 0
+        for i, (w, b) in enumerate(zip(self.weights, bits)):
+            score = weighted_score(w, b)
+            if score > best:
+                best = score
+                best_i = i
+        return best_i
+
+    def shard_for(self, user_id: str) -> str:
+        return self.shards[self.index_for(user_id)]
+
+    def indices_for_hashes(self, hashes):
+        """fast mode only: uint64 user hashes -> shard index array, chunked to bound memory."""
+        if self.mode != "fast":
+            raise ValueError("hash-level batch assignment needs mode='fast'")
+        out = np.empty(len(hashes), dtype=np.int32)
+        seeds = self._seeds_np[None, :]
+        if self._weights_np is not None:
+            for i in range(0, len(hashes), HRW_BATCH_CHUNK):
+                h = hashes[i:i + HRW_BATCH_CHUNK]
+                scores = mix64_np(h[:, None] ^ seeds)
+                u = ((scores >> np.uint64(11)).astype(np.float64) + 0.5) / float(1 << 53)
+                with np.errstate(divide="ignore"):
+                    scores = self._weights_np[None, :] / -np.log(u)
+                out[i:i + len(h)] = scores.argmax(axis=1)
+            return out
+        # unweighted: mix64 in place on one reused block (same result as mix64_np, ~2x faster)
+        block = np.empty((min(HRW_SCORE_BLOCK, len(hashes)), len(self.shards)), dtype=np.uint64)
+        tmp = np.empty_like(block)
+        c1, c2 = np.uint64(_MIX_C1), np.uint64(_MIX_C2)
+        s30, s27, s31 = np.uint64(30), np.uint64(27), np.uint64(31)
+        for i in range(0, len(hashes), HRW_SCORE_BLOCK):
+            h = hashes[i:i + HRW_SCORE_BLOCK]
+            x = block[:len(h)]
+            t = tmp[:len(h)]
+            np.bitwise_xor(h[:, None], seeds, out=x)
+            np.right_shift(x, s30, out=t)
+            x ^= t
+            x *= c1
+            np.right_shift(x, s27, out=t)
+            x ^= t
+            x *= c2
+            np.right_shift(x, s31, out=t)
+            x ^= t
+            out[i:i + len(h)] = x.argmax(axis=1)
+        return out
+
+    def indices_for(self, user_ids: Sequence[str]):
+        """Batch assignment -> shard index per user (NumPy array; list without NumPy)."""
+        if self.mode == "fast" and np is not None:
+            out = np.empty(len(user_ids), dtype=np.int32)
+            for i in range(0, len(user_ids), HRW_BATCH_CHUNK):
+                chunk = user_ids[i:i + HRW_BATCH_CHUNK]
+                out[i:i + len(chunk)] = self.indices_for_hashes(user_hashes64_np(chunk))
+            return out
+        # sha256 has no vectorized form; still skips the hex/int round trip per shard
+        idx = [self.index_for(u) for u in user_ids]
+        return np.array(idx, dtype=np.int32) if np is not None else idx
+
+    def shards_for(self, user_ids: Sequence[str]) -> List[str]:
+        return [self.shards[i] for i in self.indices_for(user_ids)]
+
 # 3) Placement service (logical shard -> region/cell) 
 
 
-@dataclass
+PLACEMENT_DELTA_LOG = 1024   # deltas kept for changes_since()
+
+Location = Mapping[str, str]
+
+def _frozen_loc(region: str, cell: str) -> Location:
+    return MappingProxyType({"region": region, "cell": cell})
+
+@dataclass(frozen=True)
 class PlacementSnapshot:
-    placement: Dict[str, Dict[str, str]]  # shard -> {"region":..., "cell":...}
+    """
+    Immutable, versioned view of the placement map. One object per version is
+    published and shared by reference with every reader; nothing copies it.
+    """
+    placement: Mapping[str, Location]  # shard -> {"region":..., "cell":...}
     version: int
-    fetched_at: float
+    fetched_at: float  # when this version was published
+    weights: Mapping[str, float] = field(default_factory=lambda: MappingProxyType({}))  # shard -> HRW weight (missing = 1.0)
+    shard_set_version: int = 1  # bumps when HRW inputs (shards/weights) change
+    shards: Tuple[str, ...] = field(default_factory=lambda: tuple(ACTIVE_SHARDS))
+
+@dataclass(frozen=True)
+class PlacementDelta:
+    from_version: int
+    to_version: int
+    changes: Mapping[str, Location]  # shards whose location changed -> new location
+    shard_set_changed: bool = False
 
 class PlacementService:
     """
     In reality: strongly consistent metadata store (e.g., etcd/spanner).
     Here: in-memory + version increments.
+    Each change publishes a new immutable snapshot plus a small delta to subscribers.
     """
-    def __init__(self, initial_placement: Dict[str, Dict[str, str]]):
-        # should contain entries for all ACTIVE_SHARDS
-        self._placement = dict(initial_placement)
-        self._version = 1
+    def __init__(self, initial_placement: Dict[str, Dict[str, str]], weights: Optional[Dict[str, float]] = None,
+                 shards: Optional[Iterable[str]] = None):
+        # should contain entries for all shards (default ACTIVE_SHARDS)
+        self._lock = threading.Lock()
+        self._subscribers: List[Callable[[PlacementSnapshot, PlacementDelta], None]] = []
+        self._deltas: deque = deque(maxlen=PLACEMENT_DELTA_LOG)
+        self._snap = PlacementSnapshot(
+            placement=MappingProxyType({sid: _frozen_loc(loc["region"], loc["cell"]) for sid, loc in initial_placement.items()}),
+            version=1,
+            fetched_at=time.time(),
+            weights=MappingProxyType(dict(weights or {})),
+            shard_set_version=1,
+            shards=tuple(shards or ACTIVE_SHARDS)
+        )
 
     def get_snapshot(self) -> PlacementSnapshot:
-        return PlacementSnapshot(
-            placement=dict(self._placement),
-            version=self._version,
-            fetched_at=time.time()
-        )
+        # O(1): the current version is shared, not copied
+        return self._snap
+
+    def subscribe(self, fn: Callable[[PlacementSnapshot, PlacementDelta], None]) -> Callable[[], None]:
+        with self._lock:
+            self._subscribers.append(fn)
+        def unsubscribe():
+            with self._lock:
+                if fn in self._subscribers:
+                    self._subscribers.remove(fn)
+        return unsubscribe
+
+    def delta_since(self, version: int, to_version: Optional[int] = None) -> Optional[PlacementDelta]:
+        """Deltas after `version` up to `to_version` (default: current) merged into one; None if the log no longer reaches back."""
+        deltas = list(self._deltas)
+        to_version = self._snap.version if to_version is None else to_version
+        if version >= to_version:
+            return PlacementDelta(version, version, MappingProxyType({}))
+        span = [d for d in deltas if version < d.to_version <= to_version]
+        if not span or span[0].from_version > version:
+            return None
+        merged: Dict[str, Location] = {}
+        for d in span:
+            merged.update(d.changes)
+        return PlacementDelta(version, to_version, MappingProxyType(merged), any(d.shard_set_changed for d in span))
+
+    def changes_since(self, version: int) -> Optional[Dict[str, Location]]:
+        """Merged location changes after `version`; None if the delta log no longer reaches back that far."""
+        delta = self.delta_since(version)
+        return None if delta is None else dict(delta.changes)
+
+    def _publish(self, changes: Dict[str, Location], placement: Optional[Dict[str, Location]] = None,
+                 weights: Optional[Dict[str, float]] = None, shards: Optional[Tuple[str, ...]] = None) -> None:
+        with self._lock:
+            old = self._snap
+            if placement is None and changes:
+                # copy-on-write once per change, on the publisher side only
+                placement = dict(old.placement)
+                placement.update(changes)
+            shard_set_changed = weights is not None or shards is not None
+            snap = PlacementSnapshot(
+                placement=MappingProxyType(placement) if placement is not None else old.placement,
+                version=old.version + 1,
+                fetched_at=time.time(),
+                weights=MappingProxyType(weights) if weights is not None else old.weights,
+                shard_set_version=old.shard_set_version + (1 if shard_set_changed else 0),
+                shards=shards if shards is not None else old.shards
+            )
+            delta = PlacementDelta(old.version, snap.version, MappingProxyType(changes), shard_set_changed)
+            self._snap = snap
+            self._deltas.append(delta)
+            subscribers = list(self._subscribers)
+        for fn in subscribers:
+            fn(snap, delta)
 
     def move_shard(self, shard_id: str, region: str, cell: str) -> None:
-        self._placement[shard_id] = {"region": region, "cell": cell}
-        self._version += 1
+        self._publish({shard_id: _frozen_loc(region, cell)})
+
+    def move_shards(self, moves: Dict[str, Dict[str, str]]) -> None:
+        # several shard moves published as one version
+        self._publish({sid: _frozen_loc(loc["region"], loc["cell"]) for sid, loc in moves.items()})
+
+    def set_weight(self, shard_id: str, weight: float) -> None:
+        self.set_weights({shard_id: weight})
+
+    def set_weights(self, weights: Dict[str, float]) -> None:
+        # merged into the current weights, one version for the whole batch
+        if any(w < 0 for w in weights.values()):
+            raise ValueError("shard weight must be >= 0")
+        merged = dict(self._snap.weights)
+        merged.update({sid: float(w) for sid, w in weights.items()})
+        self._publish({}, weights=merged)
+
+    def set_shards(self, shard_ids: Iterable[str], placement: Optional[Dict[str, Dict[str, str]]] = None,
+                   weights: Optional[Dict[str, float]] = None) -> None:
+        # grow/shrink the HRW shard set; every shard needs a placement entry.
+        # weights (optional) are merged in the same version, e.g. new shards at 0.0 to ramp them in later
+        shards = tuple(shard_ids)
+        if not shards:
+            raise ValueError("Shard list cannot be empty")
+        changes = {sid: _frozen_loc(loc["region"], loc["cell"]) for sid, loc in (placement or {}).items()}
+        merged = dict(self._snap.placement)
+        merged.update(changes)
+        missing = [sid for sid in shards if sid not in merged]
+        if missing:
+            raise ValueError(f"no placement for shards: {missing[:5]}")
+        new_weights = None
+        if weights is not None:
+            if any(w < 0 for w in weights.values()):
+                raise ValueError("shard weight must be >= 0")
+            new_weights = dict(self._snap.weights)
+            new_weights.update({sid: float(w) for sid, w in weights.items()})
+        self._publish(changes, placement=merged, weights=new_weights, shards=shards)
 
 # 4) Dependencies + tier gating
 
@@ -69,7 +387,52 @@ class Dependencies:
     kms_ok: bool = True
     placement_ok: bool = True
 
-OP_TIER = {
+class _GateTable(dict):
+    """
+    dict that tells the compiled deps gate to rebuild whenever it is mutated.
+    Edit OP_TIER / REQUIRES in place; rebinding the module names is not tracked.
+    """
+    def __init__(self, items, freeze=None):
+        super().__init__()
+        self._freeze = freeze
+        for k, v in items.items():
+            super().__setitem__(k, freeze(v) if freeze else v)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, self._freeze(value) if self._freeze else value)
+        _invalidate_deps_gate()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        _invalidate_deps_gate()
+
+    def update(self, *args, **kwargs):
+        for k, v in dict(*args, **kwargs).items():
+            self[k] = v
+
+    def __ior__(self, other):
+        # dict's |= writes straight into the table; route it through update()
+        self.update(other)
+        return self
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, *args):
+        _invalidate_deps_gate()
+        return super().pop(*args)
+
+    def popitem(self):
+        _invalidate_deps_gate()
+        return super().popitem()
+
+    def clear(self):
+        super().clear()
+        _invalidate_deps_gate()
+
+OP_TIER = _GateTable({
     "view_public": "TIER_0",
     "view_profile_basic": "TIER_1",
     "low_value_action": "TIER_1",
@@ -80,9 +443,9 @@ OP_TIER = {
     "issue_token": "TIER_2",
     "rotate_keys": "TIER_2",
     "transfer": "TIER_2",
-}
+})
 
-REQUIRES = {
+REQUIRES = _GateTable({
     "view_public": {"auth"},
     "view_profile_basic": {"auth"},
     "low_value_action": {"auth"},
@@ -93,14 +456,15 @@ REQUIRES = {
     "issue_token": {"auth", "policy", "risk"},
     "rotate_keys": {"auth", "policy", "kms", "audit"},
     "transfer": {"auth", "policy", "risk", "audit"},
-}
+}, freeze=frozenset)  # frozen so in-place set edits can't bypass the rebuild
 
 SECURITY_CRITICAL = {
     "view_pii", "export_data", "change_permissions",
     "high_value_action", "issue_token", "rotate_keys", "transfer"
 }
 
-def deps_ok_for(op: str, deps: Dependencies) -> Tuple[bool, str]:
+def deps_ok_for_reference(op: str, deps: Dependencies) -> Tuple[bool, str]:
+    # the rule chain; compile_deps_gate() turns it into a table and the tests hold the two equal
     tier = OP_TIER.get(op, "TIER_2")
     req = REQUIRES.get(op, {"auth", "policy"})
 
@@ -132,6 +496,53 @@ def deps_ok_for(op: str, deps: Dependencies) -> Tuple[bool, str]:
 
     return True, "ALLOW"
 
+DEP_FLAGS = ("auth", "policy", "risk", "audit", "kms", "placement")  # bit i of the mask = <flag>_ok
+
+def deps_mask(deps: Dependencies) -> int:
+    return (deps.auth_ok + 2 * deps.policy_ok + 4 * deps.risk_ok
+            + 8 * deps.audit_ok + 16 * deps.kms_ok + 32 * deps.placement_ok)
+
+def deps_from_mask(mask: int) -> Dependencies:
+    return Dependencies(**{f"{name}_ok": bool(mask >> i & 1) for i, name in enumerate(DEP_FLAGS)})
+
+# deps_ok_for compiled to one flat table: row = op id, column = dependency-health mask.
+# Row 0 is every op missing from the tables (Tier-2, auth+policy default).
+_GATE_STRIDE = 1 << len(DEP_FLAGS)  # columns per op row
+_UNKNOWN_OP = "\0unknown-op"
+_GATE_OP_IDS: Dict[str, int] = {}
+_GATE_TABLE: Optional[List[Tuple[bool, str]]] = None
+GATE_BUILDS = 0
+
+def _invalidate_deps_gate() -> None:
+    global _GATE_TABLE
+    _GATE_TABLE = None
+
+def compile_deps_gate() -> List[Tuple[bool, str]]:
+    global _GATE_TABLE, _GATE_OP_IDS, GATE_BUILDS
+    # deps_ok_for inlines the mask: a flag added to Dependencies but not to DEP_FLAGS (and the
+    # inline sum) would read as "down" in every column, so refuse to build instead
+    if tuple(f"{name}_ok" for name in DEP_FLAGS) != tuple(Dependencies.__dataclass_fields__):
+        raise RuntimeError("DEP_FLAGS must list every Dependencies flag, in order")
+    if any(deps_mask(d) != m for m, d in enumerate(map(deps_from_mask, range(_GATE_STRIDE)))):
+        raise RuntimeError("deps_mask() is out of step with DEP_FLAGS")
+    ops = sorted(set(OP_TIER) | set(REQUIRES))
+    masks = [deps_from_mask(m) for m in range(_GATE_STRIDE)]
+    table = []
+    for op in [_UNKNOWN_OP] + ops:
+        table.extend(deps_ok_for_reference(op, d) for d in masks)
+    _GATE_OP_IDS = {op: i + 1 for i, op in enumerate(ops)}
+    _GATE_TABLE = table
+    GATE_BUILDS += 1
+    return table
+
+def deps_ok_for(op: str, deps: Dependencies) -> Tuple[bool, str]:
+    table = _GATE_TABLE
+    if table is None:
+        table = compile_deps_gate()
+    # mask arithmetic inlined (same sum as deps_mask): this runs on every routed request
+    return table[_GATE_OP_IDS.get(op, 0) * _GATE_STRIDE + deps.auth_ok + 2 * deps.policy_ok + 4 * deps.risk_ok
+                 + 8 * deps.audit_ok + 16 * deps.kms_ok + 32 * deps.placement_ok]
+
 # 5) Coarse protections 
 
 
@@ -140,16 +551,167 @@ RATE_LIMIT_MAX_PER_WINDOW = 60
 HIGH_RISK_WINDOW_SEC = 600
 HIGH_RISK_MAX_PER_WINDOW = 3
 
+RATE_LIMIT_BACKEND = "log"    # "log" = exact sliding log; "gcra" = opt-in, looser; "deque" = original
+LIMITER_WHEEL_SLOTS = 64      # idle-key eviction wheel: one slot per window/64 seconds
+LIMITER_SHARDS = 16
+
+class _WheelLimiter:
+    """
+    Per-key limiter state with idle-key eviction on a timer wheel. Subclasses say when a key's
+    state stops mattering (_deadline) and whether it already has (_idle); such a key is
+    indistinguishable from a new one, so the wheel drops it.
+    """
+    def __init__(self, limit: int, window: float, wheel_slots: int = LIMITER_WHEEL_SLOTS):
+        if limit < 1 or window <= 0:
+            raise ValueError("limit must be >= 1 and window > 0")
+        self.limit = limit
+        self.window = window
+        self._state: Dict[str, Any] = {}
+        self._slot_width = window / wheel_slots
+        self._wheel: List[List[str]] = [[] for _ in range(wheel_slots)]
+        self._tick: Optional[int] = None
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._state)
+
+    def _deadline(self, value) -> float:
+        raise NotImplementedError
+
+    def _idle(self, value, now: float) -> bool:
+        raise NotImplementedError
+
+    def _schedule(self, key: str, at: float) -> None:
+        # swept once the tick containing `at` has fully passed
+        self._wheel[(int(at / self._slot_width) + 1) % len(self._wheel)].append(key)
+
+    def _advance(self, now: float) -> None:
+        tick = int(now / self._slot_width)
+        if self._tick is None:
+            self._tick = tick
+        if tick < self._tick:
+            return
+        slots = len(self._wheel)
+        start = max(self._tick, tick - slots + 1)  # a long gap sweeps each slot once
+        state = self._state
+        for t in range(start, tick + 1):
+            keys = self._wheel[t % slots]
+            if not keys:
+                continue
+            self._wheel[t % slots] = []
+            for key in keys:
+                value = state.get(key)
+                if value is None:
+                    continue
+                if self._idle(value, now):
+                    del state[key]
+                    self.evictions += 1
+                else:
+                    self._schedule(key, self._deadline(value))
+        self._tick = tick + 1
+
+    def expire(self, now: float) -> None:
+        # cheap unless a wheel tick has passed
+        if self._tick is None or now >= self._tick * self._slot_width:
+            self._advance(now)
+
+class SlidingLogLimiter(_WheelLimiter):
+    """
+    Exactly the timestamp-log rule: an event is allowed iff fewer than `limit` allowed events
+    lie within the trailing `window` (an event `window` seconds old still counts). Only the last
+    `limit` allowed timestamps can decide that, so a key holds a bare float for its first event
+    and a deque(maxlen=limit) after that; a check is O(1), with no per-timestamp GC.
+    """
+    def _deadline(self, value) -> float:
+        return (value if type(value) is float else value[-1]) + self.window
+
+    def _idle(self, value, now: float) -> bool:
+        return self._deadline(value) < now
+
+    def allow(self, key: str, now: float) -> bool:
+        self.expire(now)
+        state = self._state
+        log = state.get(key)
+        if log is None or self._idle(log, now):
+            # nothing in the window: back to a bare float
+            if log is None:
+                self._schedule(key, now + self.window)
+            state[key] = now
+            return True
+        if type(log) is float:
+            if self.limit == 1:
+                return False
+            log = state[key] = deque((log,), maxlen=self.limit)
+        # the oldest kept timestamp is the limit-th most recent: in the window means the window is full
+        if len(log) == self.limit and now - log[0] <= self.window:
+            return False
+        log.append(now)
+        return True
+
+class GcraLimiter(_WheelLimiter):
+    """
+    Generic cell rate algorithm: `limit` per `window`, bursts up to `limit`.
+    One float per key (theoretical arrival time, TAT).
+    Looser than the timestamp log, so opt-in only: capacity comes back at limit/window
+    continuously, and a trailing window can admit up to 2*limit - 1 (a full burst, then
+    the refill). 60/min at one request per 0.5s for a minute allows 119 where the log
+    allows 60.
+    """
+    def __init__(self, limit: int, window: float, wheel_slots: int = LIMITER_WHEEL_SLOTS):
+        super().__init__(limit, window, wheel_slots)
+        self.interval = window / limit           # emission interval T
+        self.tolerance = window - self.interval  # burst tolerance (limit - 1) * T
+
+    def _deadline(self, value) -> float:
+        return value
+
+    def _idle(self, value, now: float) -> bool:
+        return value <= now
+
+    def allow(self, key: str, now: float) -> bool:
+        self.expire(now)
+        tat = self._state.get(key)
+        if tat is None:
+            self._state[key] = now + self.interval
+            self._schedule(key, now + self.interval)
+            return True
+        if tat < now:
+            tat = now
+        if tat - now > self.tolerance:
+            return False
+        self._state[key] = tat + self.interval
+        return True
+
+_LIMITERS = {"log": SlidingLogLimiter, "gcra": GcraLimiter}
+
 class CoarseProtections:
-    def __init__(self):
-        self._actions: Dict[str, deque] = defaultdict(deque)
-        self._high_risk: Dict[str, deque] = defaultdict(deque)
+    def __init__(self, backend: str = RATE_LIMIT_BACKEND):
+        if backend not in _LIMITERS and backend != "deque":
+            raise ValueError(f"unknown rate limit backend: {backend}")
+        self.backend = backend
+        if backend in _LIMITERS:
+            self._rate = _LIMITERS[backend](RATE_LIMIT_MAX_PER_WINDOW, RATE_LIMIT_WINDOW_SEC)
+            self._risk = _LIMITERS[backend](HIGH_RISK_MAX_PER_WINDOW, HIGH_RISK_WINDOW_SEC)
+        else:
+            self._actions: Dict[str, deque] = defaultdict(deque)
+            self._high_risk: Dict[str, deque] = defaultdict(deque)
 
     def _gc(self, q: deque, now: float, window: float) -> None:
         while q and now - q[0] > window:
             q.popleft()
 
     def check(self, user_id: str, op: str, now: float) -> Tuple[bool, str]:
+        if self.backend != "deque":
+            # a passed rate check is spent even if the high-risk check then denies (as with the log)
+            if not self._rate.allow(user_id, now):
+                return False, "DENY: coarse rate limit"
+            if op in SECURITY_CRITICAL:
+                if not self._risk.allow(user_id, now):
+                    return False, "DENY: coarse high-risk velocity"
+            else:
+                self._risk.expire(now)
+            return True, "OK"
+
         q = self._actions[user_id]
         self._gc(q, now, RATE_LIMIT_WINDOW_SEC)
         if len(q) >= RATE_LIMIT_MAX_PER_WINDOW:
@@ -165,6 +727,36 @@ class CoarseProtections:
 
         return True, "OK"
 
+    def expire(self, now: float) -> None:
+        # idle keys otherwise go when traffic advances the wheels; the deque backend never drops keys
+        if self.backend != "deque":
+            self._rate.expire(now)
+            self._risk.expire(now)
+
+    def tracked_keys(self) -> int:
+        if self.backend != "deque":
+            return len(self._rate) + len(self._risk)
+        return len(self._actions) + len(self._high_risk)
+
+class ShardedCoarseProtections:
+    """CoarseProtections split by user across independently locked shards, for threaded gateways."""
+    def __init__(self, shards: int = LIMITER_SHARDS, backend: str = RATE_LIMIT_BACKEND):
+        self._shards = [CoarseProtections(backend) for _ in range(shards)]
+        self._locks = [threading.Lock() for _ in range(shards)]
+
+    def check(self, user_id: str, op: str, now: float) -> Tuple[bool, str]:
+        i = hash(user_id) % len(self._shards)
+        with self._locks[i]:
+            return self._shards[i].check(user_id, op, now)
+
+    def expire(self, now: float) -> None:
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                shard.expire(now)
+
+    def tracked_keys(self) -> int:
+        return sum(s.tracked_keys() for s in self._shards)
+
 
 
 # 6) Real idempotency 
@@ -173,18 +765,91 @@ class CoarseProtections:
 def payload_hash(payload: str) -> str:
     return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
+IDEMPOTENCY_TTL_SEC = 24 * 3600
+IDEMPOTENCY_GC_BUDGET = 64        # expiry work (wheel steps) per call; the rest wait for later calls or expire()
+IDEMPOTENCY_WHEEL_TICK_SEC = 1.0  # expiry bucket width
+
+IdemKey = Tuple[str, str, str]              # (user_id, op, idem_key)
+IdemEntry = Tuple[str, Any, float]          # (payload_hash, response, recorded_at)
+
+class MemoryIdempotencyBackend:
+    """
+    Default in-process backend. Keys are also filed in a timing wheel by record time
+    (one bucket per tick), so expiry walks forward from the oldest bucket a bounded
+    amount per call: O(1) amortized.
+    Backend interface: get(key), put(key, entry), expire(now, ttl_sec, budget), __len__, close().
+    """
+    def __init__(self, tick_sec: float = IDEMPOTENCY_WHEEL_TICK_SEC):
+        self._store: Dict[IdemKey, IdemEntry] = {}
+        self._buckets: Dict[int, List[IdemKey]] = {}
+        self._cursor: Optional[int] = None  # oldest bucket that may still hold keys
+        self.tick_sec = tick_sec
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def get(self, k: IdemKey) -> Optional[IdemEntry]:
+        return self._store.get(k)
+
+    def put(self, k: IdemKey, entry: IdemEntry) -> None:
+        self._store[k] = entry
+        b = int(entry[2] // self.tick_sec)
+        if self._cursor is None:
+            self._cursor = b
+        elif b < self._cursor:
+            b = self._cursor  # clock went backwards past the cursor: expire a little late
+        bucket = self._buckets.get(b)
+        if bucket is None:
+            self._buckets[b] = [k]
+        else:
+            bucket.append(k)
+
+    def expire(self, now: float, ttl_sec: int, budget: Optional[int] = None) -> int:
+        if self._cursor is None or not self._buckets:
+            return 0
+        # bucket b is fully expired once its end is more than ttl ago
+        last = math.floor((now - ttl_sec) / self.tick_sec) - 1
+        steps = 0
+        removed = 0
+        store = self._store
+        while self._cursor <= last and (budget is None or steps < budget):
+            bucket = self._buckets.get(self._cursor)
+            if not bucket:
+                self._buckets.pop(self._cursor, None)
+                self._cursor += 1
+                steps += 1
+                continue
+            while bucket and (budget is None or steps < budget):
+                k = bucket.pop()
+                steps += 1
+                entry = store.get(k)
+                if entry is not None and now - entry[2] > ttl_sec:  # re-recorded keys are filed again later
+                    del store[k]
+                    removed += 1
+        return removed
+
+    def close(self) -> None:
+        pass
+
 class IdempotencyStore:
     """
     (user, op, idempotency_key) -> (payload_hash, response, ts)
     If retried with same payload_hash -> return same response.
+    Storage is pluggable (MemoryIdempotencyBackend by default; durable_idempotency_v2 for SQLite).
     """
-    def __init__(self):
-        self._store: Dict[Tuple[str, str, str], Tuple[str, Any, float]] = {}
+    def __init__(self, backend=None, gc_budget: int = IDEMPOTENCY_GC_BUDGET):
+        self.backend = backend if backend is not None else MemoryIdempotencyBackend()
+        self.gc_budget = gc_budget
+
+    def __len__(self) -> int:
+        return len(self.backend)
 
-    def _gc(self, now: float, ttl_sec: int) -> None:
-        expired = [k for k, (_, __, ts) in self._store.items() if now - ts > ttl_sec]
-        for k in expired:
-            del self._store[k]
+    def expire(self, now: float, ttl_sec: int = IDEMPOTENCY_TTL_SEC) -> int:
+        # full sweep of everything already expired (background / maintenance path)
+        return self.backend.expire(now, ttl_sec)
+
+    def close(self) -> None:
+        self.backend.close()
 
     def get_or_record(
         self,
@@ -194,21 +859,23 @@ class IdempotencyStore:
         ph: str,
         compute_response_fn,
         now: float,
-        ttl_sec: int = 24 * 3600
+        ttl_sec: int = IDEMPOTENCY_TTL_SEC
     ) -> Tuple[bool, Any, str]:
-        self._gc(now, ttl_sec)
+        self.backend.expire(now, ttl_sec, self.gc_budget)
         if not idem_key:
             return False, None, "DENY: missing idempotency key"
 
         k = (user_id, op, idem_key)
-        if k in self._store:
-            prev_ph, resp, _ = self._store[k]
+        entry = self.backend.get(k)
+        # an expired entry the budgeted GC hasn't reached yet counts as absent
+        if entry is not None and now - entry[2] <= ttl_sec:
+            prev_ph, resp, _ = entry
             if prev_ph != ph:
                 return False, None, "DENY: idempotency key reused with different payload"
             return True, resp, "ALLOW: idempotent replay (cached response)"
 
         resp = compute_response_fn()
-        self._store[k] = (ph, resp, now)
+        self.backend.put(k, (ph, resp, now))
         return True, resp, "ALLOW: recorded idempotency"
 
 # 7) Queue carries target shard + placement version
@@ -226,14 +893,48 @@ class WriteEvent:
     created_at: float
     target_shard: str
     placement_version: int
+    seq: int = -1  # position in the queue's write-ahead log, once logged
 
 class WriteQueue:
-    def __init__(self):
+    """
+    Per-user FIFO of deferred writes. With a wal (append(ev) -> seq, ack(seqs), replay(),
+    e.g. write_wal_v2.SegmentedWal) events are logged on enqueue, acked once written or
+    dropped, and the queues are rebuilt from the log at startup.
+    """
+    def __init__(self, wal=None):
         self._q: Dict[str, deque] = defaultdict(deque)
+        self.wal = wal
+        if wal is not None:
+            for ev in wal.replay():
+                self._q[ev.user_id].append(ev)
+
+    def __len__(self) -> int:
+        return sum(len(q) for q in self._q.values())
+
+    def users(self) -> List[str]:
+        return [u for u, q in self._q.items() if q]
+
+    def user_queue(self, user_id: str) -> Optional[deque]:
+        return self._q.get(user_id)
+
+    def discard_empty(self, user_id: str) -> None:
+        if not self._q.get(user_id):
+            self._q.pop(user_id, None)
 
     def enqueue(self, ev: WriteEvent) -> None:
+        if self.wal is not None:
+            ev.seq = self.wal.append(ev)
         self._q[ev.user_id].append(ev)
 
+    def push_front(self, ev: WriteEvent) -> None:
+        # put a dequeued, not yet acked event back at the head of its user's queue
+        self._q[ev.user_id].appendleft(ev)
+
+    def ack(self, events: Sequence[WriteEvent]) -> None:
+        # events are done (written or dropped): a restart must not bring them back
+        if self.wal is not None and events:
+            self.wal.ack([ev.seq for ev in events])
+
     def drain(self, user_id: str, now: float, process_fn, rate_limit: int = QUEUE_DRAIN_RATE_PER_USER) -> Tuple[int, int]:
         q = self._q.get(user_id)
         if not q:
@@ -241,13 +942,15 @@ class WriteQueue:
 
         processed = 0
         dropped = 0
+        done: List[WriteEvent] = []
 
         while q and (now - q[0].created_at) > QUEUE_ITEM_TTL_SEC:
-            q.popleft()
+            done.append(q.popleft())
             dropped += 1
 
         while q and processed < rate_limit:
             ev = q.popleft()
+            done.append(ev)
             if (now - ev.created_at) > QUEUE_ITEM_TTL_SEC:
                 dropped += 1
                 continue
@@ -257,13 +960,493 @@ class WriteQueue:
         if not q:
             self._q.pop(user_id, None)
 
+        self.ack(done)
         return processed, dropped
 
+DRAIN_QUANTUM_BYTES = 4096     # DRR credit per user per round (event cost = payload bytes, min 1)
+DRAIN_ROUND_EVENTS = 4096      # events dequeued per scheduling round
+DRAIN_BATCH_MAX = 256          # events per bulk write
+DRAIN_CELL_CONCURRENCY = 2     # bulk writes in flight per cell
+
+@dataclass
+class DrainReport:
+    processed: int = 0
+    dropped: int = 0             # past QUEUE_ITEM_TTL_SEC
+    blocked: int = 0             # left queued: target cell still down / shard not placed / shard refusing writes
+    budget_exhausted: int = 0    # left queued: drainable, but the run stopped at max_rounds
+    bulk_writes: int = 0
+    rounds: int = 0
+    elapsed_sec: float = 0.0
+    remaining: int = 0
+    coalesced: int = 0           # later copies of a queued (user, action, idem_key), acked unwritten
+    rerouted: int = 0            # home shard changed (shard set / weights moved on while queued)
+    moved: int = 0               # same shard, now in another cell
+    reroute_batches: int = 0     # placement versions resolved (one delta + one bulk pass each)
+    max_in_flight: Dict[str, int] = field(default_factory=dict)   # cell -> peak concurrent bulk writes
+    per_cell: Dict[str, int] = field(default_factory=dict)        # cell -> events written
+
+    @property
+    def throughput(self) -> float:
+        return self.processed / self.elapsed_sec if self.elapsed_sec > 0 else 0.0
+
+    @property
+    def time_to_empty_sec(self) -> Optional[float]:
+        # measured when the queue emptied, otherwise projected at the observed rate
+        if self.remaining == 0:
+            return self.elapsed_sec
+        rate = self.throughput
+        return self.elapsed_sec + self.remaining / rate if rate > 0 else None
+
+class DrainScheduler:
+    """
+    Global drain for WriteQueue after a cell recovers.
+    - deficit round robin across users: a heavy user can't starve light ones
+    - each round's events are grouped by target_shard into bulk writes (order kept per shard)
+    - at most cell_concurrency bulk writes in flight per cell; rounds are barriers, so a
+      shard never has two batches in flight
+    - with a router, queued events are brought up to the current placement version first:
+      duplicate (user, action, idem_key) writes are coalesced, and events are re-resolved
+      per placement version they were queued at (one delta, one bulk HRW pass each)
+    bulk_write_fn(shard, events) must raise to leave nothing half-acknowledged; events
+    of a failed batch are put back at the front of their users' queues.
+    """
+    def __init__(self, queue: WriteQueue, placement: Optional[Callable[[], Optional[PlacementSnapshot]]] = None,
+                 quantum_bytes: int = DRAIN_QUANTUM_BYTES, round_events: int = DRAIN_ROUND_EVENTS,
+                 batch_max: int = DRAIN_BATCH_MAX, cell_concurrency: int = DRAIN_CELL_CONCURRENCY,
+                 executor=None, clock: Callable[[], float] = time.time, router: Optional[Router] = None):
+        if placement is None:
+            if router is None:
+                raise ValueError("DrainScheduler needs a placement source or a router")
+            placement = router.svc.get_snapshot
+        self.queue = queue
+        self.placement = placement
+        self.router = router
+        self.quantum = quantum_bytes
+        self.round_events = round_events
+        self.batch_max = batch_max
+        self.cell_concurrency = cell_concurrency
+        self._executor = executor
+        self._clock = clock
+        self._active: deque = deque()        # DRR ring of backlogged users
+        self._deficit: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, int] = defaultdict(int)
+        self._stalled = False
+
+    @staticmethod
+    def cost(ev: WriteEvent) -> int:
+        return max(1, len(ev.payload))
+
+    def _prepare(self, snap: PlacementSnapshot, report: DrainReport) -> None:
+        # one pass over the queue per run / placement version, not one lookup per event
+        stale: Dict[int, List[WriteEvent]] = defaultdict(list)
+        dups: List[WriteEvent] = []
+        for user in self.queue.users():
+            q = self.queue.user_queue(user)
+            seen = set()
+            kept = []
+            for ev in q:
+                key = (ev.action, ev.idem_key)
+                if key in seen:
+                    dups.append(ev)  # same idempotency key: the shard would replay the first anyway
+                    continue
+                seen.add(key)
+                kept.append(ev)
+                if ev.placement_version != snap.version:
+                    stale[ev.placement_version].append(ev)
+            if len(kept) != len(q):
+                q.clear()
+                q.extend(kept)
+        report.coalesced += len(dups)
+        self.queue.ack(dups)
+        if self.router is None:
+            return
+
+        for version, evs in stale.items():
+            report.reroute_batches += 1
+            delta = self.router.svc.delta_since(version, snap.version)
+            changes = delta.changes if delta is not None else {}
+            if delta is None or delta.shard_set_changed:
+                # HRW inputs changed (or the delta log is gone): homes may differ, resolve in bulk
+                users = list(dict.fromkeys(ev.user_id for ev in evs))
+                idx = self.router.home_shard_indices(users, snap)
+                shards = self.router.hrw.shards
+                home = {u: shards[i] for u, i in zip(users, idx)}
+                for ev in evs:
+                    # split users: same sub-shard as route_write(key=idem_key) picks
+                    shard = self.router.write_shard(ev.user_id, home[ev.user_id], ev.idem_key, snap)
+                    if shard != ev.target_shard:
+                        ev.target_shard = shard
+                        report.rerouted += 1
+                    elif shard in changes:
+                        report.moved += 1
+                    ev.placement_version = snap.version
+            else:
+                # same homes; only shards named in the delta changed cell
+                for ev in evs:
+                    if ev.target_shard in changes:
+                        report.moved += 1
+                    ev.placement_version = snap.version
+
+    def _refresh_active(self) -> None:
+        known = set(self._deficit)
+        for u in self.queue.users():
+            if u not in known:
+                self._deficit[u] = 0
+                self._active.append(u)
+
+    def _next_round(self, now: float, cell_of, health: CellHealth, report: DrainReport) -> List[WriteEvent]:
+        out: List[WriteEvent] = []
+        expired: List[WriteEvent] = []
+        self._stalled = True     # stays True if every backlogged user is blocked
+        visits = len(self._active)
+        while self._active and visits and len(out) < self.round_events:
+            visits -= 1
+            user = self._active.popleft()
+            q = self.queue.user_queue(user)
+            while q and now - q[0].created_at > QUEUE_ITEM_TTL_SEC:
+                expired.append(q.popleft())
+            if not q:
+                self._deficit.pop(user, None)
+                self.queue.discard_empty(user)
+                continue
+            cell = cell_of(q[0].target_shard)
+            if cell is None or not health.cell_ok.get(cell, True):
+                # head event can't go yet; keep the user's order and credit for later
+                self._active.append(user)
+                continue
+            self._stalled = False
+            deficit = self._deficit[user] + self.quantum
+            while q and self.cost(q[0]) <= deficit and len(out) < self.round_events:
+                ev = q[0]
+                if now - ev.created_at > QUEUE_ITEM_TTL_SEC:
+                    expired.append(q.popleft())
+                    continue
+                c = cell_of(ev.target_shard)
+                if c is None or not health.cell_ok.get(c, True):
+                    break
+                q.popleft()
+                deficit -= self.cost(ev)
+                out.append(ev)
+            if q:
+                self._deficit[user] = deficit
+                self._active.append(user)
+            else:
+                self._deficit.pop(user, None)   # DRR: an idle flow keeps no credit
+                self.queue.discard_empty(user)
+        report.dropped += len(expired)
+        self.queue.ack(expired)
+        return out
+
+    def _write_shard(self, shard: str, cell: str, events: List[WriteEvent], sems: Dict[str, threading.Semaphore],
+                     bulk_write_fn, report: DrainReport) -> List[WriteEvent]:
+        failed: List[WriteEvent] = []
+        for i in range(0, len(events), self.batch_max):
+            batch = events[i:i + self.batch_max]
+            with sems[cell]:
+                with self._lock:
+                    self._in_flight[cell] += 1
+                    report.max_in_flight[cell] = max(report.max_in_flight.get(cell, 0), self._in_flight[cell])
+                try:
+                    bulk_write_fn(shard, batch)
+                    self.queue.ack(batch)
+                except Exception:
+                    failed = events[i:]
+                    break
+                finally:
+                    with self._lock:
+                        self._in_flight[cell] -= 1
+            with self._lock:
+                report.processed += len(batch)
+                report.bulk_writes += 1
+                report.per_cell[cell] = report.per_cell.get(cell, 0) + len(batch)
+        return failed
+
+    def run(self, bulk_write_fn: Callable[[str, List[WriteEvent]], None], health: CellHealth,
+            max_rounds: Optional[int] = None) -> DrainReport:
+        report = DrainReport()
+        t0 = self._clock()
+        snap = self.placement()
+        if snap is None:
+            report.remaining = len(self.queue)
+            return report
+
+        def cell_of(shard: str) -> Optional[str]:
+            loc = snap.placement.get(shard)
+            return loc["cell"] if loc else None
+
+        own_pool = self._executor is None
+        pool = ThreadPoolExecutor(max_workers=max(1, self.cell_concurrency * len({loc["cell"] for loc in snap.placement.values()}))) \
+            if own_pool else self._executor
+        sems = defaultdict(lambda: threading.BoundedSemaphore(self.cell_concurrency))
+        exhausted = False
+        try:
+            self._prepare(snap, report)
+            self._refresh_active()
+            while self._active:
+                if max_rounds is not None and report.rounds >= max_rounds:
+                    exhausted = True
+                    break
+                latest = self.placement()
+                if latest is not None and latest.version != snap.version:
+                    snap = latest   # placement moved mid-drain: cell_of() follows, queue is re-resolved
+                    self._prepare(snap, report)
+                events = self._next_round(self._clock(), cell_of, health, report)
+                if not events:
+                    if self._stalled:
+                        break  # everyone left is blocked on a down cell
+                    continue   # heads cost more than one quantum: credit builds up
+                report.rounds += 1
+                by_shard: Dict[str, List[WriteEvent]] = {}
+                for ev in events:
+                    by_shard.setdefault(ev.target_shard, []).append(ev)
+                for shard in by_shard:
+                    sems[cell_of(shard)]
+                futures = [pool.submit(self._write_shard, shard, cell_of(shard), evs, sems, bulk_write_fn, report)
+                           for shard, evs in by_shard.items()]
+                failed = [ev for fut in futures for ev in fut.result()]
+                if failed:
+                    # put back in dequeue order so each user's queue order survives
+                    pos = {id(ev): i for i, ev in enumerate(events)}
+                    for ev in sorted(failed, key=lambda e: pos[id(e)], reverse=True):
+                        self._requeue_front(ev)
+                    break  # a shard is refusing writes; leave the rest for the next run
+        finally:
+            if own_pool:
+                pool.shutdown(wait=True)
+
+        for user in self._active:
+            q = self.queue.user_queue(user)
+            if not q:
+                continue
+            # a user's events go in order, so its head decides whether the rest could have moved
+            cell = cell_of(q[0].target_shard)
+            if exhausted and cell is not None and health.cell_ok.get(cell, True):
+                report.budget_exhausted += len(q)
+            else:
+                report.blocked += len(q)
+        report.remaining = len(self.queue)
+        report.elapsed_sec = self._clock() - t0
+        return report
+
+    def _requeue_front(self, ev: WriteEvent) -> None:
+        self.queue.push_front(ev)
+        if ev.user_id not in self._deficit:
+            self._deficit[ev.user_id] = 0
+            self._active.append(ev.user_id)
+
 
 # 8) Routing (read-local / write-home) 
 
 
+HOME_CACHE_SIZE = 1_000_000
+
+class HomeShardCache:
+    """
+    Bounded user -> home shard index cache with CLOCK eviction.
+    Stores a 2-byte shard index per slot; the whole cache is tied to one shard-set
+    version and is dropped when the version changes.
+    """
+    def __init__(self, capacity: int = HOME_CACHE_SIZE):
+        if capacity <= 0:
+            raise ValueError("capacity must be > 0")
+        self.capacity = capacity
+        self.version: Optional[int] = None
+        self._slot: Dict[str, int] = {}
+        self._keys: List[Optional[str]] = []
+        self._vals = array("H")
+        self._ref = bytearray()
+        self._hand = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def check_version(self, version: int) -> None:
+        if version != self.version:
+            if self.version is not None:
+                self.invalidations += 1
+            self.clear()
+            self.version = version
+
+    def clear(self) -> None:
+        self._slot.clear()
+        self._keys = []
+        self._vals = array("H")
+        self._ref = bytearray()
+        self._hand = 0
+
+    def get(self, user_id: str) -> Optional[int]:
+        i = self._slot.get(user_id)
+        if i is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._ref[i] = 1
+        return self._vals[i]
+
+    def put(self, user_id: str, shard_idx: int) -> None:
+        if user_id in self._slot:
+            return
+        if len(self._keys) < self.capacity:
+            self._slot[user_id] = len(self._keys)
+            self._keys.append(user_id)
+            self._vals.append(shard_idx)
+            self._ref.append(0)
+            return
+        # second chance: clear ref bits until an unreferenced slot comes up
+        while self._ref[self._hand]:
+            self._ref[self._hand] = 0
+            self._hand = (self._hand + 1) % self.capacity
+        i = self._hand
+        del self._slot[self._keys[i]]
+        self.evictions += 1
+        self._keys[i] = user_id
+        self._vals[i] = shard_idx
+        self._ref[i] = 0
+        self._slot[user_id] = i
+        self._hand = (i + 1) % self.capacity
+
+    def __len__(self) -> int:
+        return len(self._slot)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._slot),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
 PLACEMENT_CACHE_TTL_SEC = 30
+PLACEMENT_REFRESH_AHEAD_SEC = 5    # start a background refresh this long before the TTL runs out
+PLACEMENT_MAX_STALE_SEC = 120      # past the TTL, keep serving the last snapshot this long
+
+class PlacementCache:
+    """
+    Stale-while-revalidate cache in front of PlacementService.get_snapshot().
+    Reads never wait on the placement service while a usable snapshot is held:
+    close to expiry a refresh runs on the executor, and concurrent triggers share
+    one in-flight fetch. Past the TTL the last snapshot is served for at most
+    max_stale seconds, then requests fail closed.
+    """
+    def __init__(self, fetch: Callable[[], PlacementSnapshot], ttl: float = PLACEMENT_CACHE_TTL_SEC,
+                 refresh_ahead: float = PLACEMENT_REFRESH_AHEAD_SEC, max_stale: float = PLACEMENT_MAX_STALE_SEC,
+                 executor=None, clock: Callable[[], float] = time.time):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.refresh_ahead = min(refresh_ahead, ttl)
+        self.max_stale = max_stale
+        self._executor = executor
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._snap: Optional[PlacementSnapshot] = None
+        self._at = 0.0  # last time _snap was confirmed current (fetch or push)
+        self._inflight: Optional[Future] = None
+        self.hits = 0
+        self.stale_serves = 0
+        self.max_stale_age = 0.0
+        self.refreshes = 0
+        self.coalesced = 0
+        self.refresh_failures = 0
+        self.sync_fetches = 0
+        self.denials = 0
+
+    @property
+    def snapshot(self) -> Optional[PlacementSnapshot]:
+        return self._snap
+
+    def age(self) -> float:
+        return self._clock() - self._at
+
+    def put(self, snap: PlacementSnapshot) -> None:
+        with self._lock:
+            if self._snap is None or snap.version >= self._snap.version:
+                self._snap = snap
+            self._at = self._clock()
+
+    def _run_refresh(self, fut: Future) -> None:
+        try:
+            snap = self._fetch()
+        except Exception as e:
+            with self._lock:
+                self.refresh_failures += 1
+                self._inflight = None
+            fut.set_exception(e)
+            return
+        self.put(snap)
+        with self._lock:
+            self.refreshes += 1
+            self._inflight = None
+        fut.set_result(snap)
+
+    def refresh(self, wait: bool = False) -> Future:
+        """Start (or join) the single in-flight fetch. wait=True runs it on the calling thread."""
+        with self._lock:
+            if self._inflight is not None:
+                self.coalesced += 1
+                fut = self._inflight
+                owner = False
+            else:
+                fut = self._inflight = Future()
+                owner = True
+        if owner:
+            if wait:
+                self._run_refresh(fut)
+            else:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="placement-refresh")
+                self._executor.submit(self._run_refresh, fut)
+        return fut
+
+    def get(self, placement_ok: bool = True) -> Tuple[Optional[PlacementSnapshot], str]:
+        snap = self._snap
+        age = self.age()
+
+        if snap is not None and age <= self.ttl:
+            if placement_ok and age >= self.ttl - self.refresh_ahead:
+                self.refresh()
+            self.hits += 1
+            return snap, "OK: placement fresh" if placement_ok else "OK: placement cached"
+
+        if snap is not None and age <= self.ttl + self.max_stale:
+            if placement_ok:
+                self.refresh()
+            self.stale_serves += 1
+            self.max_stale_age = max(self.max_stale_age, age)
+            return snap, f"OK: placement stale ({age:.0f}s old)"
+
+        if placement_ok:
+            # nothing servable: the request has to wait, but still shares the one fetch
+            try:
+                snap = self.refresh(wait=True).result(timeout=self.ttl)
+            except Exception:
+                snap = None
+            if snap is not None:
+                self.sync_fetches += 1
+                return snap, "OK: placement fresh"
+
+        self.denials += 1
+        return None, "DENY: placement unavailable and cache stale"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self._snap.version if self._snap else None,
+            "age_sec": self.age() if self._snap else None,
+            "hits": self.hits,
+            "stale_serves": self.stale_serves,
+            "max_stale_age_sec": self.max_stale_age,
+            "refreshes": self.refreshes,
+            "coalesced": self.coalesced,
+            "refresh_failures": self.refresh_failures,
+            "sync_fetches": self.sync_fetches,
+            "denials": self.denials,
+        }
 
 @dataclass
 class CellHealth:
@@ -280,36 +1463,305 @@ def residency_allows(user: User, region: str, op: str) -> bool:
         return user.residency == region
     return True
 
+HOT_SKETCH_WIDTH = 4096        # Count-Min columns per row
+HOT_SKETCH_DEPTH = 4           # rows: error <= 2/width of traffic w.p. 1 - 2^-depth
+HOT_TOPK = 64                  # users tracked in the top-k heap
+HOT_WINDOW_SEC = 60.0          # counts halve every window, so estimates follow recent traffic
+HOT_USER_SHARD_FRACTION = 0.5  # a user is hot above this fraction of one shard's fair share
+HOT_MIN_EVENTS = 10_000        # no promotion before the window has seen this much traffic
+HOT_MAX_FANOUT = 16            # sub-shards per hot user
+HOT_SAMPLE_EVERY = 8           # router feeds 1 in N requests to the detector, counted N times
+
+class CountMinSketch:
+    """Count-Min sketch with conservative update; estimates never undercount."""
+    def __init__(self, width: int = HOT_SKETCH_WIDTH, depth: int = HOT_SKETCH_DEPTH):
+        if width <= 0 or depth <= 0:
+            raise ValueError("width and depth must be > 0")
+        self.width = width
+        self.depth = depth
+        self._rows = [array("q", bytes(8 * width)) for _ in range(depth)]
+
+    def _cols(self, key_hash: int) -> List[int]:
+        # double hashing: depth columns from one 64-bit hash
+        h1 = key_hash & 0xFFFFFFFF
+        h2 = (key_hash >> 32) | 1
+        w = self.width
+        return [(h1 + i * h2) % w for i in range(self.depth)]
+
+    def add(self, key_hash: int, n: int = 1) -> int:
+        h1 = key_hash & 0xFFFFFFFF
+        h2 = (key_hash >> 32) | 1
+        w = self.width
+        rows = self._rows
+        cols = [(h1 + i * h2) % w for i in range(self.depth)]
+        vals = [row[c] for row, c in zip(rows, cols)]
+        new = min(vals) + n
+        for row, c, v in zip(rows, cols, vals):
+            if v < new:
+                row[c] = new
+        return new
+
+    def estimate(self, key_hash: int) -> int:
+        return min([row[c] for row, c in zip(self._rows, self._cols(key_hash))])
+
+    def halve(self) -> None:
+        self._rows = [array("q", (v >> 1 for v in row)) for row in self._rows]
+
+class HeavyHitters:
+    """
+    Streaming top-k users by recent traffic: Count-Min estimates plus a top-k min-heap.
+    The heap is lazy: a tracked user's count is updated in the dict only, and an entry
+    that surfaces with an old count is pushed back with the current one. Keys are hashed
+    with user_hash64 (blake2b), so detection is the same across restarts and workers.
+    """
+    def __init__(self, k: int = HOT_TOPK, width: int = HOT_SKETCH_WIDTH, depth: int = HOT_SKETCH_DEPTH,
+                 window_sec: float = HOT_WINDOW_SEC):
+        self.k = k
+        self.sketch = CountMinSketch(width, depth)
+        self.window_sec = window_sec
+        self.total = 0
+        self._window_start: Optional[float] = None
+        self._top: Dict[str, int] = {}
+        self._heap: List[Tuple[int, str]] = []
+
+    def _roll(self, now: float) -> None:
+        if self._window_start is None:
+            self._window_start = now
+            return
+        while now - self._window_start >= self.window_sec:
+            self._window_start += self.window_sec
+            self.sketch.halve()
+            self.total >>= 1
+            self._top = {u: c >> 1 for u, c in self._top.items()}
+            self._heap = [(c, u) for u, c in self._top.items()]
+            heapq.heapify(self._heap)
+
+    def _heap_min(self) -> Tuple[int, str]:
+        heap, top = self._heap, self._top
+        while True:
+            c, u = heap[0]
+            cur = top.get(u)
+            if cur == c:
+                return heap[0]
+            if cur is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (cur, u))
+
+    def observe(self, user_id: str, now: float, n: int = 1) -> int:
+        """Count n events for user_id; returns the user's current estimate."""
+        self._roll(now)
+        est = self.sketch.add(user_hash64(user_id), n)
+        self.total += n
+        top = self._top
+        if user_id in top:
+            top[user_id] = est      # counts only grow inside a window: the heap entry is a lower bound
+        elif len(top) < self.k:
+            top[user_id] = est
+            heapq.heappush(self._heap, (est, user_id))
+        elif est > self._heap_min()[0]:
+            del top[heapq.heappop(self._heap)[1]]
+            top[user_id] = est
+            heapq.heappush(self._heap, (est, user_id))
+        return est
+
+    def estimate(self, user_id: str) -> int:
+        return self.sketch.estimate(user_hash64(user_id))
+
+    def top(self, n: Optional[int] = None) -> List[Tuple[str, int]]:
+        ranked = sorted(self._top.items(), key=lambda kv: -kv[1])
+        return ranked[:n] if n is not None else ranked
+
+class HotUsers:
+    """
+    Users split across sub-shards. Sub-key 0 is the user's normal HRW home and sub-key
+    j > 0 is HRW("user#j"), so a promotion leaves existing data where it is. A write goes
+    to the sub-key picked by its key (one sub-shard per key keeps that key's writes
+    serialized); reads fan out to every sub-shard.
+    Fanouts are powers of two and only grow: doubling keeps every key on its sub-key or
+    moves it to sub-key + old fanout, so half of a user's keys move once. Promotion is
+    sticky: unsplitting needs a data merge, so demote() is explicit. Share one instance
+    between routers (in reality it would be published with placement).
+    """
+    def __init__(self, detector: Optional[HeavyHitters] = None, shard_fraction: float = HOT_USER_SHARD_FRACTION,
+                 min_events: int = HOT_MIN_EVENTS, max_fanout: int = HOT_MAX_FANOUT,
+                 sample_every: int = HOT_SAMPLE_EVERY):
+        self.detector = detector or HeavyHitters()
+        self.shard_fraction = shard_fraction
+        self.min_events = min_events
+        self.max_fanout = max_fanout
+        self.sample_every = sample_every
+        self._sample_p = 1.0 / sample_every
+        self._fanout: Dict[str, int] = {}
+        self._subs: Dict[str, Tuple[str, ...]] = {}
+        self._subs_version: Optional[int] = None
+        self.promotions = 0
+
+    def fanout(self, user_id: str) -> int:
+        return self._fanout.get(user_id, 1)
+
+    def observe(self, user_id: str, num_shards: int, now: float) -> None:
+        # random (not every-Nth) sampling: periodic traffic can't alias with it
+        if self.sample_every > 1 and random.random() >= self._sample_p:
+            return
+        est = self.detector.observe(user_id, now, self.sample_every)
+        if self.detector.total < self.min_events:
+            return
+        # split until each sub-key carries at most the limit
+        limit = self.shard_fraction * self.detector.total / num_shards
+        if est > limit * self._fanout.get(user_id, 1):
+            self.promote(user_id, math.ceil(est / limit))
+
+    def promote(self, user_id: str, fanout: int) -> None:
+        """Split user_id over at least `fanout` sub-keys (rounded up to a power of two, capped)."""
+        fanout = min(self.max_fanout, 1 << max(1, (fanout - 1).bit_length()))
+        current = self._fanout.get(user_id, 1)
+        if fanout > current:
+            self._fanout[user_id] = fanout
+            self._subs.pop(user_id, None)
+            if current == 1:
+                self.promotions += 1
+
+    def demote(self, user_id: str) -> None:
+        self._fanout.pop(user_id, None)
+        self._subs.pop(user_id, None)
+
+    def users(self) -> Dict[str, int]:
+        return dict(self._fanout)
+
+    def sub_shards(self, user_id: str, home: str, engine: HrwEngine, shard_set_version: int) -> Tuple[str, ...]:
+        if shard_set_version != self._subs_version:
+            self._subs.clear()
+            self._subs_version = shard_set_version
+        subs = self._subs.get(user_id)
+        if subs is None:
+            subs = (home,) + tuple(engine.shard_for(f"{user_id}#{j}") for j in range(1, self.fanout(user_id)))
+            self._subs[user_id] = subs
+        return subs
+
+    def sub_index(self, user_id: str, key: str) -> int:
+        # stable across processes (unlike hash()), so every router picks the same sub-key
+        return zlib.crc32(key.encode("utf-8")) % self.fanout(user_id)
+
+@dataclass
+class RouteGroup:
+    """One (shard, cell) slice of a batched routing call; positions index into the input batch."""
+    decision: str
+    reason: str
+    shard: Optional[str] = None
+    region: Optional[str] = None
+    cell: Optional[str] = None
+    placement_version: Optional[int] = None
+    users: List[User] = field(default_factory=list)
+    positions: List[int] = field(default_factory=list)
+
 class Router:
-    def __init__(self, placement_svc: PlacementService):
+    def __init__(self, placement_svc: PlacementService, hash_mode: str = HRW_MODE,
+                 home_cache_size: int = HOME_CACHE_SIZE, subscribe: bool = True, executor=None,
+                 hot_users: Optional[HotUsers] = None, clock: Callable[[], float] = time.time):
         self.svc = placement_svc
-        self._cache: Optional[PlacementSnapshot] = None
+        self.placement = PlacementCache(placement_svc.get_snapshot, executor=executor)
+        self._init_routing(hash_mode, home_cache_size, hot_users, clock)
+        self._unsubscribe = placement_svc.subscribe(self._on_placement) if subscribe else None
+
+    def _init_routing(self, hash_mode: str, home_cache_size: int, hot_users: Optional[HotUsers],
+                      clock: Callable[[], float]) -> None:
+        # everything but the placement source (shared with async_router_v2.AsyncRouter)
+        self.hot = hot_users
+        self._clock = clock
+        self.hash_mode = hash_mode
+        self.hrw = HrwEngine(ACTIVE_SHARDS, hash_mode)
+        self._hrw_version: Optional[int] = None
+        self.home_cache = HomeShardCache(home_cache_size)
+
+    def _on_placement(self, snap: PlacementSnapshot, delta: PlacementDelta) -> None:
+        # pushed by PlacementService: just swap the pointer
+        self.placement.put(snap)
+
+    def close(self) -> None:
+        if self._unsubscribe:
+            self._unsubscribe()
+            self._unsubscribe = None
+
+    def _engine(self, snap: PlacementSnapshot) -> HrwEngine:
+        # rebuild only when the snapshot's shard set / weights changed
+        if snap.shard_set_version != self._hrw_version:
+            self.hrw = HrwEngine(snap.shards, self.hash_mode, snap.weights)
+            self._hrw_version = snap.shard_set_version
+        self.home_cache.check_version(snap.shard_set_version)
+        return self.hrw
+
+    def home_shard(self, user_id: str, snap: PlacementSnapshot) -> str:
+        eng = self._engine(snap)
+        idx = self.home_cache.get(user_id)
+        if idx is None:
+            idx = eng.index_for(user_id)
+            self.home_cache.put(user_id, idx)
+        return eng.shards[idx]
+
+    def home_shard_indices(self, user_ids: Sequence[str], snap: PlacementSnapshot) -> List[int]:
+        # cache first, then one vectorized HRW pass over the misses
+        eng = self._engine(snap)
+        cache = self.home_cache
+        out = [cache.get(u) for u in user_ids]
+        miss = [i for i, idx in enumerate(out) if idx is None]
+        if miss:
+            fresh = eng.indices_for([user_ids[i] for i in miss])
+            for i, idx in zip(miss, fresh):
+                idx = int(idx)
+                out[i] = idx
+                cache.put(user_ids[i], idx)
+        return out
+
+    def home_cache_stats(self) -> Dict[str, Any]:
+        return self.home_cache.stats()
+
+    def placement_stats(self) -> Dict[str, Any]:
+        return self.placement.stats()
 
     def _snapshot(self, deps: Dependencies) -> Tuple[Optional[PlacementSnapshot], str]:
-        now = time.time()
-
-        if deps.placement_ok:
-            snap = self.svc.get_snapshot()
-            self._cache = snap
-            return snap, "OK: placement fresh"
-
-        if self._cache and (now - self._cache.fetched_at) <= PLACEMENT_CACHE_TTL_SEC:
-            return self._cache, "OK: placement cached"
+        # served from the stale-while-revalidate cache; refreshes happen off the request path
+        return self.placement.get(deps.placement_ok)
+
+    def sub_shards(self, user_id: str, snap: PlacementSnapshot) -> Tuple[str, ...]:
+        """Shards holding the user's data: just the home unless the user was split."""
+        home = self.home_shard(user_id, snap)
+        if self.hot is None or self.hot.fanout(user_id) == 1:
+            return (home,)
+        return self.hot.sub_shards(user_id, home, self.hrw, snap.shard_set_version)
+
+    def write_shard(self, user_id: str, home: str, key: Optional[str], snap: PlacementSnapshot) -> str:
+        """The sub-shard a write with this key goes to (home for unsplit users or key=None)."""
+        if key is None or self.hot is None or self.hot.fanout(user_id) == 1:
+            return home
+        return self.hot.sub_shards(user_id, home, self.hrw, snap.shard_set_version)[self.hot.sub_index(user_id, key)]
+
+    def read_shards(self, user_id: str, deps: Dependencies) -> Tuple[Tuple[str, ...], str]:
+        """Read fan-out targets for the user's data; () plus the reason when placement is unavailable."""
+        snap, msg = self._snapshot(deps)
+        if not snap:
+            return (), msg
+        return self.sub_shards(user_id, snap), "OK"
 
-        return None, "DENY: placement unavailable and cache stale"
+    def _observe(self, user_id: str) -> None:
+        if self.hot is not None:
+            self.hot.observe(user_id, len(self.hrw.shards), self._clock())
 
-    def resolve_home(self, user_id: str, deps: Dependencies) -> Tuple[Optional[str], Optional[Dict[str, str]], Optional[int], str]:
+    def resolve_home(self, user_id: str, deps: Dependencies,
+                     key: Optional[str] = None) -> Tuple[Optional[str], Optional[Location], Optional[int], str]:
         snap, msg = self._snapshot(deps)
         if not snap:
             return None, None, None, msg
 
-        shard = hrw_shard_for_user(user_id, ACTIVE_SHARDS)
+        # one dict lookup for users that were never split
+        shard = self.write_shard(user_id, self.home_shard(user_id, snap), key, snap)
         return shard, snap.placement[shard], snap.version, "OK"
 
     def route_read(self, user: User, op: str, serving_region: str, deps: Dependencies) -> Tuple[bool, str]:
         ok, reason = deps_ok_for(op, deps)
         if not ok:
             return False, reason
+        self._observe(user.user_id)
 
         if not residency_allows(user, serving_region, op):
             shard, loc, _, msg = self.resolve_home(user.user_id, deps)
@@ -319,12 +1771,15 @@ class Router:
 
         return True, f"ALLOW: read-local in {serving_region}"
 
-    def route_write(self, user: User, op: str, deps: Dependencies, health: CellHealth) -> Tuple[str, str, Optional[str], Optional[int]]:
+    def route_write(self, user: User, op: str, deps: Dependencies, health: CellHealth,
+                    key: Optional[str] = None) -> Tuple[str, str, Optional[str], Optional[int]]:
+        # key (e.g. the idempotency key) picks the sub-shard for split users; ignored otherwise
         ok, reason = deps_ok_for(op, deps)
         if not ok:
             return "FAIL", reason, None, None
+        self._observe(user.user_id)
 
-        shard, loc, pv, msg = self.resolve_home(user.user_id, deps)
+        shard, loc, pv, msg = self.resolve_home(user.user_id, deps, key)
         if not shard:
             return "FAIL", msg, None, None
 
@@ -336,4 +1791,87 @@ class Router:
 
         return "WRITE_HOME", f"WRITE_HOME: {shard} via {loc['region']} {cell}", shard, pv
 
+    # batch API: one dependency check and one snapshot per call
+
+    def _group_homes(self, users: Sequence[User], positions: List[int], snap: PlacementSnapshot,
+                     groups: Dict[Tuple[Optional[str], Optional[str]], RouteGroup], decide,
+                     keys: Optional[Sequence[str]] = None) -> None:
+        idx = self.home_shard_indices([users[p].user_id for p in positions], snap)
+        shards = self.hrw.shards
+        for p, i in zip(positions, idx):
+            shard = shards[i]
+            if keys is not None:
+                shard = self.write_shard(users[p].user_id, shard, keys[p], snap)
+            loc = snap.placement[shard]
+            g = groups.get((shard, loc["cell"]))
+            if g is None:
+                decision, reason = decide(shard, loc)
+                g = groups[(shard, loc["cell"])] = RouteGroup(
+                    decision, reason, shard, loc["region"], loc["cell"], snap.version)
+            g.users.append(users[p])
+            g.positions.append(p)
+
+    def route_write_many(self, users: Sequence[User], op: str, deps: Dependencies, health: CellHealth,
+                         keys: Optional[Sequence[str]] = None) -> Dict[Tuple[Optional[str], Optional[str]], RouteGroup]:
+        """
+        Batched route_write -> {(shard, cell): RouteGroup}; a batch-wide failure is keyed (None, None).
+        keys[i] is users[i]'s write key (as route_write's key): split users go to its sub-shard.
+        """
+        everyone = list(range(len(users)))
+        ok, reason = deps_ok_for(op, deps)
+        if not ok:
+            return {(None, None): RouteGroup("FAIL", reason, users=list(users), positions=everyone)}
+        for user in users if self.hot is not None else ():
+            self._observe(user.user_id)
+
+        snap, msg = self._snapshot(deps)
+        if not snap:
+            return {(None, None): RouteGroup("FAIL", msg, users=list(users), positions=everyone)}
+
+        def decide(shard: str, loc: Location) -> Tuple[str, str]:
+            cell = loc["cell"]
+            if not health.cell_ok.get(cell, True):
+                if op in SECURITY_CRITICAL:
+                    return "FAIL", f"DENY: home cell down ({cell}) for Tier-2"
+                return "QUEUE", f"QUEUE: home cell down ({cell}) for Tier-1"
+            return "WRITE_HOME", f"WRITE_HOME: {shard} via {loc['region']} {cell}"
+
+        groups: Dict[Tuple[Optional[str], Optional[str]], RouteGroup] = {}
+        self._group_homes(users, everyone, snap, groups, decide, keys)
+        return groups
+
+    def route_read_many(self, users: Sequence[User], op: str, serving_region: str,
+                        deps: Dependencies) -> Dict[Tuple[Optional[str], Optional[str]], RouteGroup]:
+        """Batched route_read. Local reads are keyed (None, serving_region); home reads (shard, cell)."""
+        everyone = list(range(len(users)))
+        ok, reason = deps_ok_for(op, deps)
+        if not ok:
+            return {(None, None): RouteGroup("DENY", reason, users=list(users), positions=everyone)}
+        for user in users if self.hot is not None else ():
+            self._observe(user.user_id)
+
+        groups: Dict[Tuple[Optional[str], Optional[str]], RouteGroup] = {}
+        home = []
+        for p, user in enumerate(users):
+            if residency_allows(user, serving_region, op):
+                g = groups.get((None, serving_region))
+                if g is None:
+                    g = groups[(None, serving_region)] = RouteGroup(
+                        "ALLOW", f"ALLOW: read-local in {serving_region}", region=serving_region)
+                g.users.append(user)
+                g.positions.append(p)
+            else:
+                home.append(p)
+        if not home:
+            return groups
+
+        snap, msg = self._snapshot(deps)
+        if not snap:
+            groups[(None, None)] = RouteGroup("DENY", msg, users=[users[p] for p in home], positions=home)
+            return groups
+
+        def decide(shard: str, loc: Location) -> Tuple[str, str]:
+            return "ALLOW", f"ALLOW: residency forces home-read via {loc['region']} {loc['cell']}"
 
+        self._group_homes(users, home, snap, groups, decide)
+        return groups